@@ -33,6 +33,9 @@ class ConfigurationContribution(MainWindow):
         绘制各个组态的贡献
 
         """
+        if not self.simulate_page4.has_contribution():
+            warnings.warn('该光谱由网格诊断得到，没有组态贡献', UserWarning)
+            return
         add_example = get_configuration_add_list(self)
         self.simulate_page4.plot_con_contribution_html(add_example)
         self.ui.webEngineView_2.load(QUrl.fromLocalFile(self.simulate_page4.example_path))
@@ -42,6 +45,9 @@ class ConfigurationContribution(MainWindow):
         绘制各个离子的贡献
 
         """
+        if not self.simulate_page4.has_contribution():
+            warnings.warn('该光谱由网格诊断得到，没有离子贡献', UserWarning)
+            return
         add_example = get_configuration_add_list(self)
         self.simulate_page4.plot_ion_contribution_html(add_example, self.ui.page4_consider_popular.isChecked())
         self.ui.webEngineView_2.load(QUrl.fromLocalFile(self.simulate_page4.example_path))
@@ -84,8 +90,11 @@ class UpdateConfigurationContribution(MainWindow):
         for key in self.space_time_resolution.simulate_spectral_dict:
             if (self.space_time_resolution.simulate_spectral_dict[key].temperature is not None
                     or self.space_time_resolution.simulate_spectral_dict[key].electron_density is not None):
-                temp_list.append('时间：{}       位置：{}, {}, {}'.format(
-                    key[0], key[1][0], key[1][1], key[1][2]))
+                # 与 get_simulate_spectral_diagnosed_by_index 的序号保持一致，没有组态贡献的光谱仍然列出，但加以标注
+                suffix = '' if self.space_time_resolution.simulate_spectral_dict[key].has_contribution() \
+                    else '       （网格诊断，无组态贡献）'
+                temp_list.append('时间：{}       位置：{}, {}, {}{}'.format(
+                    key[0], key[1][0], key[1][1], key[1][2], suffix))
         self.ui.comboBox.addItems(temp_list)
 
     def update_treeview(self):
@@ -115,6 +124,10 @@ class UpdateConfigurationContribution(MainWindow):
 
                 self.ui.treeWidget.addTopLevelItem(parents)
 
+        # 网格诊断得到的光谱没有组态贡献，树状列表留空
+        if self.simulate_page4 is None or self.simulate_page4.get_con_contribution() is None:
+            warnings.warn('该光谱由网格诊断得到，没有组态贡献', UserWarning)
+            return
         self.task_thread = ProgressThread(dialog_title='正在加载...')
         self.task_thread.set_run(task)
         self.task_thread.start()
@@ -270,6 +270,9 @@ class DataShowWidget(QWidget):
             return
         st_key, simulate = self.main_window.space_time_resolution.get_simulate_spectral_diagnosed_by_index(st_index)
         simulate: SimulateSpectral
+        if not simulate.has_contribution():
+            QMessageBox.warning(self, '警告', '该光谱由网格诊断得到，没有离子贡献！')
+            return
         ion_contribution: dict = simulate.get_ion_contribution()
 
         console_logger.info('space time resolution grouped data export started')
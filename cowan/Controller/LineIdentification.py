@@ -16,7 +16,7 @@ from ..Tools import console_logger
 from ..Model import (
     PROJECT_PATH,
     ANGULAR_QUANTUM_NUM_NAME,
-    Atom, In36, In2, ExpData, Cowan, CowanThread,
+    Atom, In36, In2, ExpData, Cowan, CowanThread, EXP_READERS, EXP_FILE_FILTER,
 )
 from ..View import CustomProgressDialog
 
@@ -38,13 +38,11 @@ class LineIdentification(MainWindow):
 
         """
         path, types = QFileDialog.getOpenFileName(self, '请选择实验数据', PROJECT_PATH().as_posix(),
-                                                  '数据文件(*.txt *.csv)')
+                                                  EXP_FILE_FILTER)
         path = Path(path)
         # 将实验数据复制到项目路径下
-        if 'csv' in path.name:
-            new_path = PROJECT_PATH() / f'exp_data.csv'
-        elif 'txt' in path.name:
-            new_path = PROJECT_PATH() / f'exp_data.txt'
+        if path.suffix[1:].lower() in EXP_READERS:
+            new_path = PROJECT_PATH() / f'exp_data{path.suffix.lower()}'
         else:
             raise Exception('文件格式错误')
         # 将实验数据拷贝至项目文件夹下
@@ -403,12 +401,12 @@ class LineIdentification(MainWindow):
 
             # -------------------------- 展宽 --------------------------
             self.cowan.cal_data.widen_all.set_threading(False)
-            if self.info['x_range'] is None:
-                self.cowan.cal_data.widen_all.widen()  # 整体展宽
-                self.cowan.cal_data.widen_part.widen_by_group()  # 部分展宽
-            else:
+            if self.info['x_range'] is not None:
                 num = int((self.info['x_range'][1] - self.info['x_range'][0]) / self.info['x_range'][2])
                 self.cowan.set_xrange(self.info['x_range'], num)
+            # 在添加到运行历史之前展宽，历史记录中的副本不需要再次展宽
+            self.cowan.cal_data.widen_all.widen()  # 整体展宽
+            self.cowan.cal_data.widen_part.widen_by_group()  # 部分展宽
             # -------------------------- 添加到运行历史 --------------------------
             self.cowan_lists.add_history(self.cowan)
             # -------------------------- 更新页面 --------------------------
@@ -472,6 +470,7 @@ class LineIdentification(MainWindow):
         console_logger.info(f'Cowan {name} running ...')
         self.cowan = Cowan(self.in36, self.in2, name, self.expdata_1, coupling_mode)
         cowan_run = CowanThread(self.cowan)
+        self.cowan_thread = cowan_run
         # ----界面代码
         progressDialog = CustomProgressDialog(dialog_title='正在计算...', range_=(0, 100))
         cowan_run.sub_complete.connect(update_progress)  # 更新进度条
@@ -504,7 +503,7 @@ class LineIdentification(MainWindow):
 
         def add_to_selection():
             index = self.ui.run_history_list.currentIndex().row()
-            self.cowan_lists.add_cowan(list(self.cowan_lists.cowan_run_history.values())[index].name)
+            self.cowan_lists.add_cowan(list(self.cowan_lists.cowan_run_history.keys())[index])
 
             # -------------------------- 更新页面 --------------------------
             # 更新选择列表
@@ -579,7 +578,8 @@ class LineIdentification(MainWindow):
 
         """
         index = self.ui.run_history_list.currentIndex().row()
-        self.cowan = copy.deepcopy(list(self.cowan_lists.cowan_run_history.values())[index])
+        self.cowan = copy.deepcopy(
+            self.cowan_lists.get_cowan_from_name(list(self.cowan_lists.cowan_run_history.keys())[index]))
         self.in36 = copy.deepcopy(self.cowan.in36)
         self.in2 = copy.deepcopy(self.cowan.in2)
         self.atom = copy.deepcopy(self.in36.atom)
@@ -873,8 +873,9 @@ class UpdateLineIdentification(MainWindow):
 
     def update_history_list(self):
         self.ui.run_history_list.clear()
-        for i, (name, cowan) in enumerate(self.cowan_lists.cowan_run_history.items()):
-            item = QListWidgetItem(cowan.name)
+        # 历史记录的键就是 cowan 的名称，不需要读回溢出到磁盘的对象
+        for name in self.cowan_lists.cowan_run_history.keys():
+            item = QListWidgetItem(name)
             self.ui.run_history_list.addItem(item)
 
     def update_selection_list(self):
@@ -1,11 +1,13 @@
+import functools
 from pathlib import Path
 
 import pandas as pd
 from PySide6.QtWidgets import QFileDialog, QDialog, QPushButton, \
-    QHBoxLayout, QDoubleSpinBox, QLabel, QVBoxLayout
+    QHBoxLayout, QDoubleSpinBox, QLabel, QVBoxLayout, QMessageBox, QInputDialog
 
 from main import VerticalLine, MainWindow
-from ..Model import PROJECT_PATH, Cowan
+from ..Model import PROJECT_PATH, Cowan, XRangeUpdater, WidenPrefetchThread, check_memory_budgets, \
+    clear_exp_cache, AUTOSAVE_INTERVAL
 from ..Tools import ProgressThread, console_logger
 
 
@@ -31,6 +33,9 @@ class Menu(MainWindow):
 
         """
 
+        def progress(done, total, text):
+            self.task_thread.progress.emit(30 + int(done / total * 70), f'{text} ({done}/{total})')
+
         def update_xrange():
             def task():
                 self.task_thread.progress.emit(0, 'ready to set range ...')
@@ -43,32 +48,21 @@ class Menu(MainWindow):
                 self.task_thread.progress.emit(10, 'self.expdata_1 set range ...')
                 if self.expdata_1 is not None:
                     self.expdata_1.set_xrange(x_range)
-                # 设置 页面上的 Cowan  --------------------------------
-                self.task_thread.progress.emit(20, 'self.cowan set range ...')
-                if self.cowan is not None:
-                    self.cowan.set_xrange(x_range, num)
-                # 设置各个 Cowan  --------------------------------
-                self.task_thread.progress.emit(30, 'self.cowan_lists set range ...')
-                if self.cowan_lists is not None:
-                    self.cowan_lists.set_xrange(x_range, num)
                 # 设置第二页的实验谱线  --------------------------------
-                self.task_thread.progress.emit(40, 'self.expdata_2 set range ...')
+                self.task_thread.progress.emit(20, 'self.expdata_2 set range ...')
                 if self.expdata_2 is not None:
                     self.expdata_2.set_xrange(x_range)
-                # 设置叠加谱线 --------------------------------
-                self.task_thread.progress.emit(50, 'self.simulate set range ...')
-                if self.simulate is not None:
-                    self.simulate.set_xrange(x_range, num, self.cowan_lists)
-                # 设置实验叠加谱线 --------------------------------
-                self.task_thread.progress.emit(100, 'self.space_time_resolution set range ...')
-                if self.space_time_resolution is not None:
-                    self.space_time_resolution.set_xrange(x_range, num, self.cowan_lists)
+                # 设置 cowan、叠加谱线、实验叠加谱线，相同的展宽只计算一次 --------------------------------
+                self.task_thread.progress.emit(30, 'plan widen tasks ...')
+                updater = XRangeUpdater(self.cowan, self.cowan_lists, self.simulate, self.space_time_resolution)
+                updater.update(x_range, num, progress)
                 # 完成 --------------------------------
                 self.ui.statusbar.showMessage('设置范围成功！')
 
             dialog.close()
             self.task_thread = ProgressThread(dialog_title='正在设置范围...', range_=(0, 100))
             self.task_thread.set_run(task)
+            self.task_thread.finished.connect(functools.partial(Menu.prefetch_widen, self))
             self.task_thread.start()
 
         dialog = QDialog()
@@ -114,6 +108,9 @@ class Menu(MainWindow):
 
         """
 
+        def progress(done, total, text):
+            self.task_thread.progress.emit(30 + int(done / total * 70), f'{text} ({done}/{total})')
+
         def task():
             self.task_thread.progress.emit(0, 'ready to reset range ...')
             self.info['x_range'] = None
@@ -122,33 +119,73 @@ class Menu(MainWindow):
             self.task_thread.progress.emit(10, 'self.expdata_1 reset range ...')
             if self.expdata_1 is not None:
                 self.expdata_1.reset_xrange()
-            # 设置 页面上的 Cowan
-            self.task_thread.progress.emit(20, 'self.cowan reset range ...')
-            if self.cowan is not None:
-                self.cowan.reset_xrange()
-            # 设置各个 Cowan
-            self.task_thread.progress.emit(30, 'self.cowan_lists reset range ...')
-            if self.cowan_lists is not None:
-                self.cowan_lists.reset_xrange()
             # 设置第二页的实验谱线
-            self.task_thread.progress.emit(40, 'self.expdata_2 reset range ...')
+            self.task_thread.progress.emit(20, 'self.expdata_2 reset range ...')
             if self.expdata_2 is not None:
                 self.expdata_2.reset_xrange()
-            # 设置叠加谱线
-            self.task_thread.progress.emit(50, 'self.simulate reset range ...')
-            if self.simulate is not None:
-                self.simulate.reset_xrange(self.cowan_lists)
-            # 设置实验叠加谱线
-            self.task_thread.progress.emit(100, 'self.space_time_resolution reset range ...')
-            if self.space_time_resolution is not None:
-                self.space_time_resolution.reset_xrange(self.cowan_lists)
+            # 重置 cowan、叠加谱线、实验叠加谱线，相同的展宽只计算一次
+            self.task_thread.progress.emit(30, 'plan widen tasks ...')
+            updater = XRangeUpdater(self.cowan, self.cowan_lists, self.simulate, self.space_time_resolution)
+            updater.update(None, None, progress)
 
             self.ui.statusbar.showMessage('重置范围成功！')
 
         self.task_thread = ProgressThread(dialog_title='正在重置范围...', range_=(0, 100))
         self.task_thread.set_run(task)
+        self.task_thread.finished.connect(functools.partial(Menu.prefetch_widen, self))
         self.task_thread.start()
 
+    def prefetch_widen(self):
+        """
+        在后台提前展宽第一页的 cowan 以及已经选中的离子，其余离子在第一次访问时再展宽
+
+        """
+        if self.prefetch_thread is not None and self.prefetch_thread.isRunning():
+            self.prefetch_thread.requestInterruption()
+            self.prefetch_thread.wait()
+        cowan_list = [self.cowan]
+        if self.cowan_lists is not None:
+            cowan_list += [self.cowan_lists.get_cowan_from_name(key) for key in self.cowan_lists.chose_cowan]
+        self.prefetch_thread = WidenPrefetchThread(cowan_list)
+        self.prefetch_thread.end.connect(self.prefetch_thread.update_origin)
+        self.prefetch_thread.start()
+
+    def show_memory_report(self):
+        """
+        显示各个子系统的内存占用，超出上限的子系统释放缓存
+
+        """
+        report = check_memory_budgets(self.get_loaded_records())
+        text = report.format()
+        console_logger.info('memory report ({:.3f}s)\n{}'.format(report.elapsed, text))
+        QMessageBox.information(self, '内存统计', text)
+
+    def set_autosave_interval(self):
+        """
+        设置自动保存的时间间隔（分钟），为 0 时关闭自动保存；设置保存在项目信息中，立即生效
+
+        """
+        minutes, ok = QInputDialog.getInt(
+            self, '自动保存', '自动保存间隔（分钟，0 表示关闭）：',
+            round(self.info.get('autosave_interval', AUTOSAVE_INTERVAL) / 60), 0, 1440)
+        if not ok:
+            return
+        self.info['autosave_interval'] = minutes * 60
+        self.start_autosave_timer()
+        if minutes == 0:
+            self.ui.statusbar.showMessage('已关闭自动保存')
+        else:
+            self.ui.statusbar.showMessage(f'自动保存间隔已设置为 {minutes} 分钟')
+
+    def clear_exp_cache_files(self):
+        """
+        删除 .cowan/exp_cache 中实验数据的解析缓存，下次读入时重新解析
+
+        """
+        count = clear_exp_cache()
+        console_logger.info(f'clear {count} exp cache files')
+        self.ui.statusbar.showMessage(f'已清除 {count} 个实验数据缓存文件')
+
     def export_con_ave_wave(self):
         console_logger.info('export started')
         path = QFileDialog.getExistingDirectory(self, '选择存储路径', PROJECT_PATH().as_posix())
@@ -13,10 +13,10 @@ from PySide6.QtWidgets import QFileDialog, QMessageBox, QMenu, QInputDialog, QCh
 
 from main import MainWindow
 from ..Model import (
-    PROJECT_PATH,
-    ExpData, SimulateGrid, SimulateGridThread, SimulateSpectral,
+    PROJECT_PATH, SIMILARITY_METHODS, EXP_READERS, EXP_FILE_FILTER,
+    ExpData, load_exp_files, SimulateGrid, SimulateGridThread, SimulateSpectral, BatchDiagnosisThread, SpaceTimeUpdateThread,
 )
-from ..Tools import ProgressThread, rainbow_color
+from ..Tools import rainbow_color
 from ..View import CustomProgressDialog
 from .EvolutionaryProcess import UpdateEvolutionaryProcess
 from .ConfigurationContribution import UpdateConfigurationContribution
@@ -38,6 +38,9 @@ class SpectralSimulation(MainWindow):
                 self.cowan_lists.add_or_not[i] = True
             else:
                 self.cowan_lists.add_or_not[i] = False
+        # 已经模拟过光谱时，直接重新叠加离子贡献，不需要重新展宽
+        if self.simulate is not None and self.simulate.update_add_or_not(self.cowan_lists):
+            functools.partial(UpdateSpectralSimulation.update_exp_sim_figure, self)()
 
     def load_exp_data(self):
         """
@@ -45,7 +48,7 @@ class SpectralSimulation(MainWindow):
 
         """
         path, types = QFileDialog.getOpenFileName(self, '请选择实验数据', PROJECT_PATH().as_posix(),
-                                                  '数据文件(*.txt *.csv)')
+                                                  EXP_FILE_FILTER)
         self.expdata_2 = ExpData(Path(path))
         # 如果设置了波长范围，就使用新的波长范围
         if self.info['x_range'] is not None:
@@ -89,7 +92,6 @@ class SpectralSimulation(MainWindow):
         if not flag:
             QMessageBox.warning(self, '警告', '请先设置元素比例！')
             return
-        self.simulate.set_threading(False)
         self.simulate.set_temperature_and_density(temperature, density)
         self.simulate.simulate_spectral()
         self.simulate.cal_con_contribution()
@@ -160,12 +162,13 @@ class SpectralSimulation(MainWindow):
         if not flag:
             QMessageBox.warning(self, '警告', '请先设置元素比例！')
             return
-        self.simulate.set_threading(True)
         self.simulated_grid = SimulateGrid(t_range, ne_range, self.simulate)
         self.simulated_grid.change_task('cal')
         if not self.ui.use_multiprocess.isChecked():
             self.simulated_grid.use_multiprocess = False
+        self.simulated_grid.similarity_method = list(SIMILARITY_METHODS.keys())[self.ui.similarity_method.currentIndex()]
         simulated_grid_run = SimulateGridThread(self.simulated_grid)
+        self.grid_thread = simulated_grid_run
         # ----界面代码
         progressDialog = CustomProgressDialog(dialog_title='正在计算...', range_=(0, 100))
         simulated_grid_run.progress.connect(update_progress_bar)
@@ -188,7 +191,7 @@ class SpectralSimulation(MainWindow):
         if (temperature, density) not in self.simulated_grid.grid_data:
             warnings.warn('计算出现错误，没有该温度密度下的结果！')
             return
-        self.simulate: SimulateSpectral = copy.deepcopy(self.simulated_grid.grid_data[(temperature, density)])
+        self.simulate: SimulateSpectral = self.simulated_grid.get_simulate(temperature, density)
 
         # -------------------------- 更新页面 --------------------------
         temp = density.split('e+')
@@ -232,8 +235,10 @@ class SpectralSimulation(MainWindow):
             self, '请选择实验数据所在的文件夹', PROJECT_PATH().as_posix()
         )
         path = Path(path)
+        st_keys = []
+        file_names = []
         for i, file_name in enumerate(path.iterdir()):
-            if 'csv' not in file_name.suffix:
+            if file_name.suffix[1:].lower() not in EXP_READERS:
                 continue
             if '_' in file_name.stem:
                 loc, tim = file_name.stem.split('_')
@@ -242,12 +247,19 @@ class SpectralSimulation(MainWindow):
             else:
                 loc = f'-{i + 1}'
                 tim = f'-{i + 1}'
-            self.expdata_2 = ExpData(file_name)
-            if self.info['x_range'] is not None:
-                self.expdata_2.set_xrange(self.info['x_range'])
+            st_keys.append((tim, (loc, '0', '0')))
+            file_names.append(file_name)
+        if not file_names:
+            return
+        # 所有文件并行读入一次，波长相同时共用一个二维数组
+        exp_list = load_exp_files(file_names)
+        for st_key, exp_data in zip(st_keys, exp_list):
             simulate = SimulateSpectral()
-            simulate.set_exp_obj(ExpData(Path(file_name)))
-            self.space_time_resolution.add_st((tim, (loc, '0', '0')), simulate)
+            simulate.exp_data = exp_data
+            self.space_time_resolution.add_st(st_key, simulate, copy_obj=False)
+        self.expdata_2 = copy.deepcopy(exp_list[-1])
+        if self.info['x_range'] is not None:
+            self.expdata_2.set_xrange(self.info['x_range'])
 
         # -------------------------- 更新页面 --------------------------
         # 第二页
@@ -281,6 +293,7 @@ class SpectralSimulation(MainWindow):
             self.simulated_grid.change_task('update', self.expdata_2)
             self.simulate.set_characteristic_peaks(self.simulate.characteristic_peaks)
             simulated_grid_run = SimulateGridThread(self.simulated_grid)
+            self.grid_thread = simulated_grid_run
             progressDialog = CustomProgressDialog(dialog_title='正在更新网格...')
             progressDialog.set_label_text('正在更新网格，请稍后……')
             simulated_grid_run.up_end.connect(update_grid)
@@ -338,13 +351,72 @@ class SpectralSimulation(MainWindow):
         # 设置动作
         item_1 = QAction('删除', self.ui.st_resolution_table)
         item_1.triggered.connect(del_st_item)
+        item_2 = QAction('批量诊断', self.ui.st_resolution_table)
+        item_2.triggered.connect(functools.partial(SpectralSimulation.batch_diagnosis, self))
+        item_3 = QAction('按时间顺序诊断', self.ui.st_resolution_table)
+        item_3.triggered.connect(functools.partial(SpectralSimulation.batch_diagnosis, self, order='time'))
+        item_4 = QAction('按位置顺序诊断', self.ui.st_resolution_table)
+        item_4.triggered.connect(functools.partial(SpectralSimulation.batch_diagnosis, self, order='location'))
 
         # 添加
         right_menu.addAction(item_1)
+        right_menu.addAction(item_2)
+        right_menu.addAction(item_3)
+        right_menu.addAction(item_4)
 
         # 显示右键菜单
         right_menu.popup(QCursor.pos())
 
+    def batch_diagnosis(self, *args, order=None):
+        """
+        使用当前的网格批量诊断所有还没有诊断的时空分辨光谱
+
+        Args:
+            *args:
+            order: 为 None 时独立诊断每个光谱；为 'time' 或 'location' 时按时间（或位置）顺序诊断，
+                以上一个光谱的结果为中心局部搜索
+
+        """
+
+        # 函数定义开始↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓
+        def update_progress_bar(progress):
+            progressDialog.set_label_text('诊断进度：')
+            progressDialog.set_value(int(progress))
+
+        def update_ui(*args):
+            diagnosis_run.wait()
+            diagnosis_run.update_origin()
+            progressDialog.close()
+            # -------------------------- 更新页面 --------------------------
+            # 第二页
+            functools.partial(UpdateSpectralSimulation.update_space_time_table, self)()
+            # 第三页
+            functools.partial(UpdateEvolutionaryProcess.update_space_time_combobox, self)()
+            # 第四页
+            functools.partial(UpdateConfigurationContribution.update_space_time_combobox, self)()
+            self.ui.statusbar.showMessage('诊断完成！共诊断 {} 个光谱，耗时 {:.3f}s'.format(
+                len(diagnosis_run.results), diagnosis_run.elapsed))
+            QMessageBox.information(self, '诊断完成', diagnosis_run.get_summary())
+            if diagnosis_run.failed:
+                QMessageBox.warning(self, '警告', '以下 {} 个光谱没有相似度有效的网格点，诊断失败：\n{}'.format(
+                    len(diagnosis_run.failed), '\n'.join(str(key) for key in diagnosis_run.failed)))
+
+        # 函数定义结束↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑
+
+        if self.simulated_grid is None or len(self.simulated_grid.grid_data) == 0:
+            QMessageBox.warning(self, '警告', '请先计算网格！')
+            return
+        diagnosis_run = BatchDiagnosisThread(self.simulated_grid, self.space_time_resolution, order=order)
+        if not diagnosis_run.tasks:
+            QMessageBox.warning(self, '警告', '没有需要诊断的时空分辨光谱！')
+            return
+        self.diagnosis_thread = diagnosis_run
+        progressDialog = CustomProgressDialog(dialog_title='正在诊断...', range_=(0, 100))
+        diagnosis_run.progress.connect(update_progress_bar)
+        diagnosis_run.end.connect(update_ui)
+        diagnosis_run.start()
+        progressDialog.show()
+
     def choose_peaks(self):
         """
         选择特征波长
@@ -398,10 +470,9 @@ class SpectralSimulation(MainWindow):
             self.simulate.set_characteristic_peaks(temp_peaks_wavelength)
             # 更新网格的特征波长以及相似度
             if self.simulated_grid is not None:  # 如果网格已经计算过
-                for sim in self.simulated_grid.grid_data.values():
-                    sim: SimulateSpectral
-                    sim.set_characteristic_peaks(temp_peaks_wavelength)
-                    sim.cal_spectrum_similarity()  # 重新计算相似度
+                self.simulated_grid.set_characteristic_peaks(temp_peaks_wavelength)
+                self.simulated_grid.cal_similarity()  # 重新计算相似度
+                functools.partial(UpdateSpectralSimulation.update_grid, self)()
             # 更新时空分辨光谱的特征波长
             if all_changed.isChecked():
                 for sim in self.space_time_resolution.simulate_spectral_dict.values():
@@ -597,29 +668,63 @@ class SpectralSimulation(MainWindow):
         update_ui()
         dialog.exec()
 
+    def similarity_method_changed(self, index):
+        """
+        切换网格相似度的计算方法，如果网格已经计算过，就重新计算所有网格点的相似度
+
+        Args:
+            index: 下拉框的索引
+
+        """
+        if self.simulated_grid is None or len(self.simulated_grid.grid_data) == 0:
+            return
+        method = list(SIMILARITY_METHODS.keys())[index]
+        if method == self.simulated_grid.similarity_method:
+            return
+        self.simulated_grid.similarity_method = method
+        self.simulated_grid.cal_similarity()
+
+        # -------------------------- 更新页面 --------------------------
+        functools.partial(UpdateSpectralSimulation.update_grid, self)()
+        self.ui.statusbar.showMessage('相似度已更新为：{}'.format(SIMILARITY_METHODS[method][0]))
+
     def cowan_obj_update(self):
         """
         更新 cowan 对象，重新模拟时空分辨光谱
 
         """
 
-        def task():
-            sum_num = len(self.space_time_resolution.simulate_spectral_dict.keys())
-            progressing = 0
-            for key, sim in self.space_time_resolution.simulate_spectral_dict.items():
-                progressing += 1
-                self.task_thread.progress.emit(int(progressing / sum_num * 100), str(key))
-                if sim.temperature is None or sim.electron_density is None:
-                    continue
-                sim.init_cowan_list(self.cowan_lists)
-                sim.simulate_spectral()
-                sim.del_cowan_list()
+        # 函数定义开始↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓
+        def update_progress_bar(progress):
+            progressDialog.set_label_text('正在重新模拟时空分辨光谱，请稍后……')
+            progressDialog.set_value(int(progress))
+
+        def update_ui(*args):
+            update_run.wait()
+            progressDialog.close()
+            # -------------------------- 更新页面 --------------------------
+            functools.partial(UpdateSpectralSimulation.update_space_time_table, self)()
+            if update_run.failed:
+                QMessageBox.warning(self, '警告', '{} 个时空分辨光谱没有设置元素比例，未更新！'.format(
+                    len(update_run.failed)))
+            if update_run.canceled:
+                self.ui.statusbar.showMessage('已取消，更新了 {} 个光谱'.format(len(update_run.updated)))
+            else:
+                self.ui.statusbar.showMessage('更新完成！')
 
-        # 使用Qt多线程运行task
-        self.task_thread = ProgressThread(dialog_title='正在应用Cowan的变化...', range_=(0, 100))
-        self.task_thread.set_run(task)
-        self.task_thread.progress_dialog.set_prompt_words('正在重新模拟xxx的光谱，请稍后……')
-        self.task_thread.start()
+        # 函数定义结束↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑↑
+
+        update_run = SpaceTimeUpdateThread(self.space_time_resolution, self.cowan_lists,
+                                           self.ui.use_multiprocess.isChecked())
+        if update_run.task_num == 0:
+            return
+        self.space_time_thread = update_run
+        progressDialog = CustomProgressDialog(dialog_title='正在应用Cowan的变化...', range_=(0, 100), cancelable=True)
+        progressDialog.canceled.connect(update_run.requestInterruption)
+        update_run.progress.connect(update_progress_bar)
+        update_run.end.connect(update_ui)
+        update_run.start()
+        progressDialog.show()
 
 
 class UpdateSpectralSimulation(MainWindow):
@@ -682,10 +787,15 @@ class UpdateSpectralSimulation(MainWindow):
         self.ui.page2_grid_list.setColumnCount(self.simulated_grid.t_num)
         self.ui.page2_grid_list.setHorizontalHeaderLabels(self.simulated_grid.t_list)
         self.ui.page2_grid_list.setVerticalHeaderLabels(self.simulated_grid.ne_list)
+        self.ui.similarity_method.blockSignals(True)
+        self.ui.similarity_method.setCurrentIndex(
+            list(SIMILARITY_METHODS.keys()).index(self.simulated_grid.similarity_method))
+        self.ui.similarity_method.blockSignals(False)
         # self.simulated_grid.grid_data 是一个字典
-        sim_max = max(
-            self.simulated_grid.grid_data.values(), key=lambda x: x.spectrum_similarity
-        ).spectrum_similarity
+        similarities = [sim.spectrum_similarity for sim in self.simulated_grid.grid_data.values()]
+        sim_max = max(similarities)
+        sim_min = min(similarities)
+        higher_better = SIMILARITY_METHODS[self.simulated_grid.similarity_method][1]
         for t in self.simulated_grid.t_list:
             for ne in self.simulated_grid.ne_list:
                 if (t, ne) not in self.simulated_grid.grid_data.keys():
@@ -693,7 +803,11 @@ class UpdateSpectralSimulation(MainWindow):
                     continue
                 similarity = self.simulated_grid.grid_data[(t, ne)].spectrum_similarity
                 item = QTableWidgetItem('{:.4f}'.format(similarity))
-                item.setBackground(QBrush(QColor(*rainbow_color(similarity / sim_max))))
+                if higher_better:  # 越大越相似的指标，颜色与峰值匹配法保持一致（越相似越接近 0）
+                    color_value = (sim_max - similarity) / (sim_max - sim_min) if sim_max != sim_min else 0
+                else:
+                    color_value = similarity / sim_max if sim_max != 0 else 0
+                item.setBackground(QBrush(QColor(*rainbow_color(color_value))))
                 self.ui.page2_grid_list.setItem(
                     self.simulated_grid.ne_list.index(ne),
                     self.simulated_grid.t_list.index(t),
@@ -703,8 +817,8 @@ class UpdateSpectralSimulation(MainWindow):
         self.ui.st_resolution_table.clear()
         self.ui.st_resolution_table.setRowCount(
             len(self.space_time_resolution.simulate_spectral_dict))
-        self.ui.st_resolution_table.setColumnCount(5)
-        self.ui.st_resolution_table.setHorizontalHeaderLabels(['时间', '位置', '温度', '密度', '实验谱'])
+        self.ui.st_resolution_table.setColumnCount(6)
+        self.ui.st_resolution_table.setHorizontalHeaderLabels(['时间', '位置', '温度', '密度', '实验谱', '相似度'])
         for i, (key, value) in enumerate(self.space_time_resolution.simulate_spectral_dict.items()):
             item1 = QTableWidgetItem(key[0])
             item2 = QTableWidgetItem(f'({key[1][0]}, {key[1][1]}, {key[1][2]})')
@@ -721,11 +835,18 @@ class UpdateSpectralSimulation(MainWindow):
                 item4.setBackground(QBrush(QColor(255, 0, 0)))
 
             item5 = QTableWidgetItem(value.exp_data.filepath.name)
+            # 不同方法的相似度不能相互比较，同时显示计算方法
+            if value.spectrum_similarity is not None:
+                item6 = QTableWidgetItem('{:.4f}（{}）'.format(
+                    value.spectrum_similarity, SIMILARITY_METHODS[value.similarity_method][0]))
+            else:
+                item6 = QTableWidgetItem('None')
             self.ui.st_resolution_table.setItem(i, 0, item1)
             self.ui.st_resolution_table.setItem(i, 1, item2)
             self.ui.st_resolution_table.setItem(i, 2, item3)
             self.ui.st_resolution_table.setItem(i, 3, item4)
             self.ui.st_resolution_table.setItem(i, 4, item5)
+            self.ui.st_resolution_table.setItem(i, 5, item6)
 
     def update_temperature_density(self):
         if self.simulate is None:
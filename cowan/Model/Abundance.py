@@ -0,0 +1,107 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+from .AtomInfo import OLD_IONIZATION_ENERGY, OUTER_ELECTRON_NUM
+
+
+class AbundanceEngine:
+    def __init__(self):
+        """
+        离子丰度计算引擎
+
+        每个元素的电离能、最外层电子数只在第一次使用时整理为数组，
+        之后可以一次计算多组温度、密度下的离子丰度
+        """
+        self.element_table: Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    def get_element_table(self, atomic_num: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        获取某个元素的离化度、电离能、最外层电子数数组
+
+        Args:
+            atomic_num: 原子序数
+
+        Returns:
+            (ion_num, ion_energy, electron_num)，长度均为原子序数
+        """
+        if atomic_num not in self.element_table:
+            ion_num = np.arange(atomic_num, dtype=float)
+            ion_energy = np.array([OLD_IONIZATION_ENERGY[atomic_num][k] for k in range(atomic_num)], dtype=float)
+            electron_num = np.array([OUTER_ELECTRON_NUM[atomic_num][k] for k in range(atomic_num)], dtype=float)
+            for array in [ion_num, ion_energy, electron_num]:
+                array.flags.writeable = False
+            self.element_table[atomic_num] = (ion_num, ion_energy, electron_num)
+        return self.element_table[atomic_num]
+
+    def cal_log_ratio(self, atomic_num: int, temperature, electron_density) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        计算相邻离化度的丰度之比 a_{k+1}/a_k = S / (Ar + ne * A3r)，在对数空间中表示
+
+        Args:
+            atomic_num: 原子序数
+            temperature: 等离子体温度 (n_T,)
+            electron_density: 等离子体电子密度 (n_ne,)
+
+        Returns:
+            (log|ratio|, sign(ratio))，形状均为 (n_T, n_ne, 原子序数)
+        """
+        ion_num, ion_energy, electron_num = self.get_element_table(atomic_num)
+        temperature = np.asarray(temperature, dtype=float).reshape(-1, 1, 1)
+        electron_density = np.asarray(electron_density, dtype=float).reshape(1, -1, 1)
+
+        t_over_e = temperature / ion_energy  # (n_T, 1, n_ion)
+        with np.errstate(divide='ignore'):
+            # S 中的 exp(-E/T) 在低温、高离化度时会下溢，因此直接计算 log(S)
+            log_s = (np.log(9 * 1e-6 * electron_num) + 0.5 * np.log(t_over_e) - ion_energy / temperature
+                     - 1.5 * np.log(ion_energy) - np.log(4.88 + t_over_e))
+            ar = (5.2 * 1e-14 * np.sqrt(ion_energy / temperature) * ion_num * (
+                    0.429 + 0.5 * np.log(ion_energy / temperature) + 0.469 * np.sqrt(t_over_e)))
+            a3r = (2.97 * 1e-27 * electron_num / (temperature * ion_energy ** 2 * (4.88 + t_over_e)))
+            denominator = ar + electron_density * a3r  # (n_T, n_ne, n_ion)
+            log_ratio = log_s - np.log(np.abs(denominator))
+        return log_ratio, np.sign(denominator)
+
+    def cal_abundance_cube(self, atomic_num: int, temperature, electron_density) -> np.ndarray:
+        """
+        计算多组温度、密度下各离化度的丰度
+
+        已知 a1/a0, a2/a1, ...，在对数空间中累加得到 a_k/a_0，再归一化为 a_k/S，其中 S=a0+a1+...+a_n，
+        高离化度时不会下溢
+
+        Args:
+            atomic_num: 原子序数
+            temperature: 等离子体温度 (n_T,)
+            electron_density: 等离子体电子密度 (n_ne,)
+
+        Returns:
+            离子丰度，形状为 (n_T, n_ne, 原子序数 + 1)
+        """
+        log_ratio, sign = self.cal_log_ratio(atomic_num, temperature, electron_density)
+        n_t, n_ne, n_ion = log_ratio.shape
+        log_a = np.zeros((n_t, n_ne, n_ion + 1))
+        sign_a = np.ones((n_t, n_ne, n_ion + 1))
+        log_a[:, :, 1:] = np.cumsum(log_ratio, axis=2)
+        sign_a[:, :, 1:] = np.cumprod(sign, axis=2)
+        # 减去最大值后再取指数，避免上溢与下溢
+        with np.errstate(invalid='ignore'):
+            a = sign_a * np.exp(log_a - log_a.max(axis=2, keepdims=True))
+        return a / a.sum(axis=2, keepdims=True)
+
+    def cal_abundance(self, atomic_num: int, temperature: float, electron_density: float) -> np.ndarray:
+        """
+        计算一组温度、密度下各离化度的丰度
+
+        Args:
+            atomic_num: 原子序数
+            temperature: 等离子体温度
+            electron_density: 等离子体电子密度
+
+        Returns:
+            离子丰度，长度为原子序数 + 1
+        """
+        return self.cal_abundance_cube(atomic_num, [temperature], [electron_density])[0, 0]
+
+
+# 全局共享的离子丰度计算引擎
+ABUNDANCE_ENGINE = AbundanceEngine()
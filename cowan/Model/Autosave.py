@@ -0,0 +1,205 @@
+import hashlib
+import io
+import pickle
+import shutil
+import weakref
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from PySide6 import QtCore
+from PySide6.QtCore import Signal
+
+from .ProjectStore import ProjectStore, UNCHANGED
+from ..Tools import console_logger
+
+# 默认的自动保存时间间隔（秒），每个项目可以单独设置（保存在 info['autosave_interval'] 中），为 0 时关闭自动保存
+AUTOSAVE_INTERVAL = 300
+
+
+class SnapshotPickler(pickle.Pickler):
+    def __init__(self, file, arrays: List[np.ndarray]):
+        """
+        生成快照时使用，数值数组不序列化，只记录引用
+
+        Args:
+            file: 写入对象结构的文件
+            arrays: 引用的数组，保存过程中添加
+        """
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.arrays = arrays
+        self.index: Dict[int, int] = {}  # id(数组) -> 在 arrays 中的序号
+
+    def persistent_id(self, obj):
+        if type(obj) is not np.ndarray or obj.dtype.hasobject:
+            return None
+        if id(obj) not in self.index:
+            self.index[id(obj)] = len(self.arrays)
+            self.arrays.append(obj)
+        return self.index[id(obj)]
+
+
+class SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file, arrays: List[np.ndarray]):
+        super().__init__(file)
+        self.arrays = arrays
+
+    def persistent_load(self, pid):
+        return self.arrays[pid]
+
+
+class Snapshot:
+    def __init__(self, data: bytes, arrays: List[np.ndarray]):
+        """
+        对象的快照：序列化后的对象结构，以及与原对象共享的数值数组
+
+        Args:
+            data: 对象结构
+            arrays: 引用的数组
+        """
+        self.data = data
+        self.arrays = arrays
+        self.digest = hashlib.blake2b(data, digest_size=20).digest()
+
+    def load(self):
+        """
+        由快照生成新的对象，在后台线程中调用
+
+        Returns:
+            对象
+        """
+        return SnapshotUnpickler(io.BytesIO(self.data), self.arrays).load()
+
+    def get_signature(self) -> tuple:
+        """
+        获取快照的签名，用于判断对象在两次快照之间是否改变；数组只保存弱引用，不会因此保留已经替换的数组
+
+        Returns:
+            (对象结构的哈希值, 数组的弱引用)
+        """
+        return self.digest, tuple(weakref.ref(array) for array in self.arrays)
+
+    def same_as(self, signature: Optional[tuple]) -> bool:
+        """
+        与签名对应的快照是否相同：对象结构相同，且引用的是同一组数组（数组不会原地修改）
+
+        Args:
+            signature: 之前的快照的签名（见 get_signature），为 None 时返回 False
+
+        Returns:
+            相同时返回 True
+        """
+        if signature is None:
+            return False
+        digest, refs = signature
+        return digest == self.digest and len(refs) == len(self.arrays) \
+            and all(ref() is array for ref, array in zip(refs, self.arrays))
+
+
+def take_snapshot(obj) -> Snapshot:
+    """
+    生成对象的快照：只在主线程中序列化对象结构，数值数组（包括 DataFrame 的数据块）与原对象共享，
+    由快照生成对象（Snapshot.load）在后台线程中进行
+
+    程序中的数组在计算后不再原地修改（重新计算时总是替换为新的数组），因此共享数组的快照与原对象互不影响，
+    快照之后界面上的修改不会进入快照。序列化的耗时与数组的大小无关，溢出的 cowan 对象也只复制文件的引用
+
+    Args:
+        obj: 要复制的对象
+
+    Returns:
+        快照
+    """
+    arrays = []
+    buffer = io.BytesIO()
+    SnapshotPickler(buffer, arrays).dump(obj)
+    return Snapshot(buffer.getvalue(), arrays)
+
+
+def load_snapshots(records: dict) -> dict:
+    """
+    由快照生成保存用的对象，在后台线程中调用
+
+    Args:
+        records: {名称: 快照或 UNCHANGED}
+
+    Returns:
+        {名称: 对象或 UNCHANGED}
+    """
+    return {name: value.load() if isinstance(value, Snapshot) else value for name, value in records.items()}
+
+
+def get_autosave_path(project_path: Path) -> Path:
+    return project_path.joinpath('.cowan/autosave')
+
+
+def has_recovery(project_path: Path) -> bool:
+    """
+    是否存在可以恢复的自动保存（程序上次没有正常退出，且自动保存比项目更新）
+
+    Args:
+        project_path: 项目路径
+
+    Returns:
+        可以恢复时返回 True
+    """
+    autosave = ProjectStore(get_autosave_path(project_path))
+    store = ProjectStore(project_path.joinpath('.cowan/store'))
+    return autosave.exists() and autosave.get_saved_at() > store.get_saved_at()
+
+
+def discard_autosave(project_path: Path):
+    """
+    删除自动保存的数据，正常保存或正常退出后调用
+
+    Args:
+        project_path: 项目路径
+
+    """
+    shutil.rmtree(get_autosave_path(project_path), ignore_errors=True)
+
+
+class AutosaveThread(QtCore.QThread):
+    end = Signal(str)  # 保存完成后发送一次信号
+
+    def __init__(self, store: ProjectStore, records: Dict[str, Snapshot], info: dict,
+                 saved: Optional[Dict[str, tuple]] = None, autosaved: Optional[Dict[str, tuple]] = None):
+        """
+        在后台线程中保存快照，只写入改变了的对象：
+        与上次保存项目时相同的对象不写入（恢复时从项目中读取），与上次自动保存时相同的对象沿用自动保存中的文件
+
+        Args:
+            store: 保存到的项目存储
+            records: 要保存的对象的快照，{名称: 快照}
+            info: 项目信息
+            saved: 上次保存项目时各个对象的快照签名（见 Snapshot.get_signature）
+            autosaved: 上次（成功的）自动保存时写入的对象的快照签名
+        """
+        super().__init__()
+        saved = saved or {}
+        autosaved = autosaved or {}
+        self.store = store
+        self.info = dict(info)
+        self.error: Optional[Exception] = None
+        self.records = {}
+        self.signatures: Dict[str, tuple] = {}  # 本次写入（或沿用）的对象的快照签名
+        for name, snapshot in records.items():
+            if snapshot.same_as(saved.get(name)):
+                continue
+            self.signatures[name] = snapshot.get_signature()
+            self.records[name] = UNCHANGED if snapshot.same_as(autosaved.get(name)) else snapshot
+
+    def run(self):
+        """
+        多线程运行的主函数
+
+        """
+        try:
+            self.store.save(load_snapshots(self.records), self.info)
+            console_logger.info(f'autosaved to {self.store.path}')
+        except Exception as e:
+            self.error = e
+            console_logger.error(f'autosave failed: {e!r}')
+
+        # 发送结束信号
+        self.end.emit(0)
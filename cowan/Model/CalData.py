@@ -6,6 +6,7 @@ import plotly.graph_objects as go
 from matplotlib import pyplot as plt
 from plotly.offline import plot
 
+from .Compression import read_cached_table
 from .GlobalVar import PROJECT_PATH
 from .ExpData import ExpData
 from .Widen import WidenAll, WidenPart
@@ -39,11 +40,13 @@ class CalData:
         产生两个展宽对象：widen_all、widen_part
 
         """
-        self.init_data = pd.read_fwf(
-            (PROJECT_PATH() / f'cal_result/{self.name}/spectra.dat').as_posix(),
-            widths=[9, 9, 9, 9, 3, 3, 5, 5],
-            names=['energy_l', 'energy_h', 'wavelength_ev', 'intensity', 'index_l', 'index_h', 'J_l', 'J_h', ],
-        )
+        self.init_data = read_cached_table(
+            PROJECT_PATH() / f'cal_result/{self.name}/spectra.dat',
+            lambda path: pd.read_fwf(
+                path,
+                widths=[9, 9, 9, 9, 3, 3, 5, 5],
+                names=['energy_l', 'energy_h', 'wavelength_ev', 'intensity', 'index_l', 'index_h', 'J_l', 'J_h', ],
+            ))
         self.widen_all = WidenAll(self.name, self.init_data, self.exp_data)
         self.widen_part = WidenPart(self.name, self.init_data, self.exp_data)
 
@@ -188,6 +191,34 @@ class CalData:
         self.set_fwhm(fwhm)
         self.set_temperature(temperature)
 
+    def is_dirty(self) -> bool:
+        """
+        展宽结果是否过期
+
+        修改展宽参数、波长范围后不会立即重新展宽，只是使展宽结果过期，
+        在第一次通过 get_widen_data、get_grouped_widen_data 或绘图方法访问时才重新计算
+
+        Returns:
+            整体展宽或按组态展宽的结果过期时返回 True
+        """
+        return self.widen_all.is_dirty() or self.widen_part.is_dirty()
+
+    def mark_dirty(self):
+        """
+        将展宽结果标记为过期
+
+        """
+        self.widen_all.mark_dirty()
+        self.widen_part.mark_dirty()
+
+    def ensure_widen(self):
+        """
+        重新计算过期的展宽结果
+
+        """
+        self.widen_all.ensure_widen()
+        self.widen_part.ensure_widen()
+
     def get_delta_lambda(self) -> float:
         """
         获取展宽时的波长偏移量
@@ -276,11 +307,13 @@ class CalData:
         return temp_data
 
     def get_statistics(self) -> dict:
-        spec_path = (PROJECT_PATH() / f'cal_result/{self.name}/Spec.dat').as_posix()
-        jenergy_path = (PROJECT_PATH() / f'cal_result/{self.name}/Jenergy-totaa.dat').as_posix()
-        eav_path = (PROJECT_PATH() / f'cal_result/{self.name}/Eav.dat').as_posix()
+        spec_path = PROJECT_PATH() / f'cal_result/{self.name}/Spec.dat'
+        jenergy_path = PROJECT_PATH() / f'cal_result/{self.name}/Jenergy-totaa.dat'
+        eav_path = PROJECT_PATH() / f'cal_result/{self.name}/Eav.dat'
+        # 解析结果缓存在 <文件名>.cache 中，再次统计时不需要重新解析文本
         # Spec.dat 文件读取 =====================================
-        spec = pd.read_fwf(spec_path, widths=[1, 11, 5, 3, 1, 8, 13, 5, 3, 1, 8, 13, 12, 8, 9, 8, 10, 9], header=None)
+        spec = read_cached_table(spec_path, lambda path: pd.read_fwf(
+            path, widths=[1, 11, 5, 3, 1, 8, 13, 5, 3, 1, 8, 13, 12, 8, 9, 8, 10, 9], header=None))
         spec = spec.dropna(axis=1)
         spec.columns = [
             'energy_l', 'J_l', 'index_l', 'configuration_l',
@@ -288,10 +321,12 @@ class CalData:
             'fnu', 'flam', 's2', 'gf', 'alggf', 'ga', 'brnch'
         ]
         # Jenergy-totaa.dat 文件读取 =====================================
-        J_energy = pd.read_fwf(jenergy_path, widths=[9, 2, 10], names=['level', 'temp', 'gaa'])
+        J_energy = read_cached_table(jenergy_path, lambda path: pd.read_fwf(
+            path, widths=[9, 2, 10], names=['level', 'temp', 'gaa']))
         J_energy = J_energy.drop('temp', axis=1)
         # Eav.dat 文件读取 =====================================
-        eav = pd.read_csv(eav_path, sep='\s+', names=['index_l', 'index_h', 'energy'])
+        eav = read_cached_table(eav_path, lambda path: pd.read_csv(
+            path, sep='\s+', names=['index_l', 'index_h', 'energy']))
         energy_ground = eav['energy'].values[0]
         eav['energy_with_ground'] = (eav['energy'] - energy_ground) * 0.124
         # 开始统计 ==================================================
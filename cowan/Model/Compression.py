@@ -0,0 +1,202 @@
+import bz2
+import lzma
+import os
+import pickle
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Optional
+
+import pandas as pd
+
+from ..Tools import console_logger
+
+
+class Codec(NamedTuple):
+    """
+    压缩算法
+
+    """
+    compress: Callable[[bytes, int], bytes]  # compress(数据, 压缩等级)
+    decompress: Callable[[bytes], bytes]
+    default_level: int
+
+
+CODECS: Dict[str, Codec] = {
+    'zlib': Codec(lambda data, level: zlib.compress(data, level), zlib.decompress, 1),
+    'bz2': Codec(lambda data, level: bz2.compress(data, level), bz2.decompress, 9),
+    'lzma': Codec(lambda data, level: lzma.compress(data, preset=level), lzma.decompress, 0),
+}
+# 可选的第三方压缩算法，安装后自动可用
+try:
+    import zstandard
+
+    CODECS['zstd'] = Codec(lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+                           lambda data: zstandard.ZstdDecompressor().decompress(data), 3)
+except ImportError:
+    pass
+try:
+    import lz4.frame
+
+    CODECS['lz4'] = Codec(lambda data, level: lz4.frame.compress(data, compression_level=level),
+                          lz4.frame.decompress, 0)
+except ImportError:
+    pass
+
+# 默认使用速度最快的可用算法；为 None 时不压缩
+DEFAULT_CODEC = next((name for name in ['lz4', 'zstd', 'zlib'] if name in CODECS), None)
+
+# 压缩数据的文件头：MAGIC + 算法名称的长度（1 字节）+ 算法名称，之后是压缩后的数据；
+# 没有文件头的数据是未压缩的原始数据（例如旧版本保存的文件）
+MAGIC = b'CWZ\x01'
+
+
+def encode(data: bytes, codec: Optional[str] = DEFAULT_CODEC, level: Optional[int] = None) -> bytes:
+    """
+    压缩数据，压缩后没有变小时返回原始数据
+
+    Args:
+        data: 原始数据
+        codec: 压缩算法的名称（见 CODECS），为 None 时不压缩
+        level: 压缩等级，为 None 时使用该算法的默认等级
+
+    Returns:
+        压缩后的数据（带文件头）或原始数据
+    """
+    if codec is None:
+        return data
+    if codec not in CODECS:
+        raise ValueError(f'unknown codec {codec}, available: {list(CODECS.keys())}')
+    if level is None:
+        level = CODECS[codec].default_level
+    name = codec.encode()
+    compressed = MAGIC + bytes([len(name)]) + name + CODECS[codec].compress(data, level)
+    if len(compressed) >= len(data):
+        return data
+    return compressed
+
+
+def decode(data: bytes) -> bytes:
+    """
+    解压 encode 得到的数据
+
+    Args:
+        data: 压缩后的数据或原始数据
+
+    Returns:
+        原始数据
+    """
+    if not data.startswith(MAGIC):
+        return data
+    length = data[len(MAGIC)]
+    codec = data[len(MAGIC) + 1:len(MAGIC) + 1 + length].decode()
+    if codec not in CODECS:
+        raise ValueError(f'data is compressed with {codec}, which is not installed')
+    return CODECS[codec].decompress(data[len(MAGIC) + 1 + length:])
+
+
+class CompressionStats:
+    def __init__(self):
+        """
+        按成员（项目记录、结果文件等）统计压缩率与压缩、解压的速度
+
+        """
+        # {成员: [原始字节数, 压缩后字节数, 压缩耗时, 解压的原始字节数, 解压耗时]}
+        self.data: Dict[str, list] = {}
+
+    def add_encode(self, member: str, raw: int, stored: int, seconds: float):
+        item = self.data.setdefault(member, [0, 0, 0.0, 0, 0.0])
+        item[0] += raw
+        item[1] += stored
+        item[2] += seconds
+
+    def add_decode(self, member: str, raw: int, seconds: float):
+        item = self.data.setdefault(member, [0, 0, 0.0, 0, 0.0])
+        item[3] += raw
+        item[4] += seconds
+
+    def get_report(self) -> Dict[str, dict]:
+        """
+        获取统计结果
+
+        Returns:
+            {成员: {'raw': 原始字节数, 'stored': 压缩后字节数, 'ratio': 压缩率,
+                    'encode_speed': 压缩速度（MB/s）, 'decode_speed': 解压速度（MB/s）}}
+        """
+        report = {}
+        for member, (raw, stored, encode_time, decoded, decode_time) in self.data.items():
+            report[member] = {
+                'raw': raw,
+                'stored': stored,
+                'ratio': raw / stored if stored else None,
+                'encode_speed': raw / 1024 ** 2 / encode_time if encode_time else None,
+                'decode_speed': decoded / 1024 ** 2 / decode_time if decode_time else None,
+            }
+        return report
+
+    def log(self, title: str):
+        """
+        输出统计结果
+
+        Args:
+            title: 标题
+
+        """
+
+        def fmt(value, spec):
+            return '-' if value is None else format(value, spec)
+
+        for member, item in self.get_report().items():
+            console_logger.info('{} {}: {:.1f} KB > {:.1f} KB ({}x), encode {} MB/s, decode {} MB/s'.format(
+                title, member, item['raw'] / 1024, item['stored'] / 1024, fmt(item['ratio'], '.2f'),
+                fmt(item['encode_speed'], '.1f'), fmt(item['decode_speed'], '.1f')))
+
+    def clear(self):
+        self.data.clear()
+
+
+# 计算结果缓存文件的统计
+RESULT_CACHE_STATS = CompressionStats()
+
+
+def read_cached_table(path: Path, read_fun: Callable[[str], pd.DataFrame], codec: Optional[str] = DEFAULT_CODEC,
+                      level: Optional[int] = None) -> pd.DataFrame:
+    """
+    读取 Cowan 输出的文本表格，解析结果压缩后缓存在同目录的 <文件名>.cache 中，
+    文本文件没有改变（修改时间与大小相同）时直接读取缓存，不再解析
+
+    Args:
+        path: 文本文件的路径
+        read_fun: 解析文本文件的函数，接收路径字符串
+        codec: 缓存文件的压缩算法
+        level: 压缩等级
+
+    Returns:
+        解析得到的表格
+    """
+    path = Path(path)
+    cache_path = path.with_name(path.name + '.cache')
+    stat = path.stat()
+    key = (stat.st_mtime_ns, stat.st_size)
+    if cache_path.exists():
+        try:
+            start = time.perf_counter()
+            raw = decode(cache_path.read_bytes())
+            cache = pickle.loads(raw)
+            RESULT_CACHE_STATS.add_decode(path.name, len(raw), time.perf_counter() - start)
+            if cache['key'] == key:
+                return cache['data']
+        except Exception as e:
+            console_logger.warning(f'can not read {cache_path}: {e!r}')
+    data = read_fun(path.as_posix())
+    raw = pickle.dumps({'key': key, 'data': data}, protocol=pickle.HIGHEST_PROTOCOL)
+    start = time.perf_counter()
+    stored = encode(raw, codec, level)
+    RESULT_CACHE_STATS.add_encode(path.name, len(raw), len(stored), time.perf_counter() - start)
+    try:
+        temp_path = cache_path.with_name(cache_path.name + '.tmp')
+        temp_path.write_bytes(stored)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        console_logger.warning(f'can not write {cache_path}: {e!r}')
+    return data
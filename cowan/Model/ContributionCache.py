@@ -0,0 +1,104 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+from ..Tools import console_logger
+
+
+class ContributionCache:
+    def __init__(self, max_size: int = 64):
+        """
+        组态贡献的共享缓存，按照 (离子, 温度, 半高宽, 波长偏移, 波长网格) 存储，超出容量后淘汰最久未使用的条目
+
+        缓存中的数据只读共享，多个模拟光谱对象（例如时空分辨光谱中的各个条目）只保存引用
+
+        Args:
+            max_size: 最多缓存的条目数
+        """
+        self.max_size = max_size
+        self.data: OrderedDict[tuple, Dict[str, List]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, cal_fun: Callable[[], Dict[str, List]]) -> Dict[str, List]:
+        """
+        获取缓存的组态贡献，不存在时调用 cal_fun 计算并存入缓存
+
+        Args:
+            key: (离子名称, 温度, 半高宽, 波长偏移, 波长网格)
+            cal_fun: 计算组态贡献的函数，返回 {'con_key': [con_data, 'con_name']}
+
+        Returns:
+            组态贡献，只读
+        """
+        if key in self.data:
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key]
+        self.misses += 1
+        value = cal_fun()
+        self.data[key] = value
+        while len(self.data) > self.max_size:
+            old_key, _ = self.data.popitem(last=False)
+            console_logger.debug(f'contribution cache evict {old_key}')
+        return value
+
+    def discard_ion(self, ion_name: str):
+        """
+        删除某个离子的全部缓存，离子重新计算后调用
+
+        Args:
+            ion_name: 离子名称
+
+        """
+        for key in [key for key in self.data.keys() if key[0] == ion_name]:
+            self.data.pop(key)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+
+def get_grid_key(widen) -> Tuple:
+    """
+    生成展宽对象（WidenAll 或 WidenPart）所用波长网格的键
+
+    Args:
+        widen: 展宽对象
+
+    Returns:
+        使用实验数据的波长时为 (最小波长, 最大波长, 点数, 第一个波长, 最后一个波长)，
+        否则为 (最小波长, 最大波长, 点数)
+    """
+    x_range = widen.exp_data.x_range
+    if widen.n is None:
+        # 使用实验数据的波长作为网格
+        wavelength: pd.Series = widen.exp_data.data['wavelength']
+        return (float(x_range[0]), float(x_range[1]), len(wavelength),
+                float(wavelength.iloc[0]), float(wavelength.iloc[-1]))
+    return float(x_range[0]), float(x_range[1]), int(widen.n)
+
+
+def get_contribution_key(ion_name: str, temperature: float, widen_part) -> Tuple:
+    """
+    生成组态贡献的缓存键
+
+    Args:
+        ion_name: 离子名称
+        temperature: 等离子体温度
+        widen_part: 按组态展宽对象（WidenPart）
+
+    Returns:
+        (离子名称, 温度, 半高宽, 波长偏移, 波长网格)
+    """
+    return (ion_name, float(temperature), float(widen_part.fwhm_value), float(widen_part.delta_lambda),
+            get_grid_key(widen_part))
+
+
+# 全局共享的组态贡献缓存
+CONTRIBUTION_CACHE = ContributionCache()
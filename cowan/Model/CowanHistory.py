@@ -0,0 +1,295 @@
+import hashlib
+import os
+import pickle
+import shutil
+import uuid
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .Compression import decode, encode
+from .Cowan_ import Cowan
+from .ExpData import ExpData
+from .GlobalVar import PROJECT_PATH
+from ..Tools import console_logger
+
+# 内存中最多保留的未固定（不在 chose_cowan 中）的 cowan 对象个数
+DEFAULT_MAX_RESIDENT = 8
+
+
+def get_spill_dir() -> Path:
+    return PROJECT_PATH() / '.cowan/history'
+
+
+class SpilledCowan:
+    def __init__(self, path: Path, digest: str):
+        """
+        写入磁盘的 cowan 对象
+
+        溢出文件按内容命名，写入后不再修改，也不会在读回时立即删除（快照可能还在使用），
+        不再使用的文件由 CowanHistory.collect_spill_files 删除
+
+        Args:
+            path: 溢出文件的路径（.cowan/history 中的文件，或者项目读取后还没有 flush 时项目存储中的文件）
+            digest: 文件内容（序列化并压缩后的数据）的哈希值
+        """
+        self.path = path
+        self.digest = digest
+
+    def read_bytes(self) -> bytes:
+        return self.path.read_bytes()
+
+    def load(self) -> Cowan:
+        return pickle.loads(decode(self.read_bytes()))
+
+    def __reduce__(self):
+        # 生成快照、复制时只复制文件的引用，不读取文件（文件不会被修改）；保存项目时见 ProjectStore.put_spilled
+        return SpilledCowan, (self.path, self.digest)
+
+
+class CowanHistory(MutableMapping):
+    def __init__(self, entries: Optional[Dict[str, Cowan]] = None, max_resident: int = DEFAULT_MAX_RESIDENT):
+        """
+        cowan 的运行历史，可以像 dict 一样使用（保持添加顺序）
+
+        内存中只保留最近使用的 max_resident 个 cowan 对象，其余的写入 .cowan/history（溢出），
+        通过 history[name] 访问时自动读回；已经选择的 cowan（pinned，见 CowanList.chose_cowan）始终保留在内存中。
+        values()、items() 会依次读回所有对象，只需要内存中的对象时使用 resident_items()
+
+        对象溢出期间设置的波长范围与实验数据在读回时补上
+
+        Args:
+            entries: 初始的对象，不会立即溢出（见 shrink）
+            max_resident: 内存中最多保留的未固定的对象个数
+        """
+        self.entries: Dict[str, Cowan | SpilledCowan] = dict(entries or {})
+        self.lru: OrderedDict[str, None] = OrderedDict((name, None) for name in self.entries.keys())
+        self.pinned: Set[str] = set()
+        self.max_resident = max_resident
+        # 当前的波长范围，None 表示没有设置（原始范围），否则为 (x_range, num)
+        self.xrange_state: Optional[Tuple[Tuple[float, float], Optional[int]]] = None
+        self.exp_data: Optional[ExpData] = None  # update_exp_data 设置的共享实验数据
+        self.spill_state: Dict[str, tuple] = {}  # 溢出时的 (xrange_state, exp_data)
+
+    def __getitem__(self, name: str) -> Cowan:
+        entry = self.entries[name]
+        if isinstance(entry, SpilledCowan):
+            entry = self.load(name)
+        self.touch(name)
+        return entry
+
+    def __setitem__(self, name: str, cowan: Cowan):
+        self.__discard_spilled(name)
+        self.entries[name] = cowan
+        self.touch(name)
+
+    def __delitem__(self, name: str):
+        self.__discard_spilled(name)
+        del self.entries[name]
+        self.lru.pop(name, None)
+
+    def __contains__(self, name) -> bool:
+        # 不读回溢出的对象
+        return name in self.entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __discard_spilled(self, name: str):
+        self.spill_state.pop(name, None)
+
+    def touch(self, name: str):
+        """
+        将对象标记为最近使用，超出数量时溢出最久未使用的对象
+
+        """
+        self.lru[name] = None
+        self.lru.move_to_end(name)
+        self.shrink()
+
+    def is_resident(self, name: str) -> bool:
+        return not isinstance(self.entries[name], SpilledCowan)
+
+    def resident_items(self) -> List[Tuple[str, Cowan]]:
+        """
+        获取内存中的对象，不读回已经溢出的对象
+
+        Returns:
+            [(名称, cowan), ...]
+        """
+        return [(name, entry) for name, entry in self.entries.items() if not isinstance(entry, SpilledCowan)]
+
+    def set_pinned(self, names: Iterable[str]):
+        """
+        设置始终保留在内存中的对象
+
+        Args:
+            names: 对象名称
+
+        """
+        self.pinned = set(names)
+        self.shrink()
+
+    def shrink(self, max_resident: Optional[int] = None):
+        """
+        溢出最久未使用的未固定的对象，直到内存中的未固定的对象不超过 max_resident 个
+
+        Args:
+            max_resident: 为 None 时使用 self.max_resident
+
+        """
+        if max_resident is None:
+            max_resident = self.max_resident
+        candidates = [name for name in self.lru.keys() if name not in self.pinned]
+        for name in candidates[:max(len(candidates) - max_resident, 0)]:
+            self.spill(name)
+
+    def spill(self, name: str):
+        """
+        将一个对象写入磁盘
+
+        Args:
+            name: 对象名称
+
+        """
+        data = encode(pickle.dumps(self.entries[name], protocol=pickle.HIGHEST_PROTOCOL))
+        digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+        self.entries[name] = SpilledCowan(self.write_spill_file(data, digest), digest)
+        self.spill_state[name] = (self.xrange_state, self.exp_data)
+        self.lru.pop(name)
+        console_logger.debug(f'history {name} spilled ({len(data) / 1024:.1f} KB)')
+
+    def load(self, name: str) -> Cowan:
+        """
+        读回一个已经溢出的对象，并补上溢出期间的修改
+
+        Args:
+            name: 对象名称
+
+        Returns:
+            cowan 对象
+        """
+        entry: SpilledCowan = self.entries[name]
+        cowan = entry.load()
+        state = self.spill_state.pop(name, None)
+        xrange_state, exp_data = (None, None) if state is None else state
+        if self.exp_data is not None and self.exp_data is not exp_data:
+            cowan.exp_data = self.exp_data
+        if cowan.cal_data is not None and (state is None or xrange_state != self.xrange_state):
+            if self.xrange_state is None:
+                cowan.reset_xrange()
+            else:
+                cowan.set_xrange(list(self.xrange_state[0]), self.xrange_state[1])
+        self.entries[name] = cowan
+        console_logger.debug(f'history {name} reloaded')
+        return cowan
+
+    def flush(self):
+        """
+        将项目读取后仍在项目存储中的溢出对象链接（或复制）到 .cowan/history，之后与项目存储的文件无关
+
+        """
+        for name, entry in self.entries.items():
+            if isinstance(entry, SpilledCowan) and entry.path.parent != get_spill_dir():
+                self.entries[name] = SpilledCowan(self.link_spill_file(entry.path, entry.digest), entry.digest)
+
+    def collect_spill_files(self) -> int:
+        """
+        删除 .cowan/history 中不再使用的溢出文件（已经读回或者删除的对象），
+        快照可能引用溢出文件，只在没有正在进行的保存时调用
+
+        Returns:
+            删除的文件个数
+        """
+        spill_dir = get_spill_dir()
+        if not spill_dir.exists():
+            return 0
+        used = {entry.path for entry in self.entries.values() if isinstance(entry, SpilledCowan)}
+        removed = 0
+        for path in spill_dir.iterdir():
+            if path not in used:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    @staticmethod
+    def write_spill_file(data: bytes, digest: str) -> Path:
+        """
+        写入一个溢出文件，按内容的哈希值命名，写入后不再修改
+
+        Args:
+            data: 文件内容
+            digest: 内容的哈希值
+
+        Returns:
+            文件路径
+        """
+        path = get_spill_dir() / f'{digest}.pkl'
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_name(f'{path.stem}.{uuid.uuid4().hex}.tmp')
+            temp_path.write_bytes(data)
+            os.replace(temp_path, path)
+        return path
+
+    @staticmethod
+    def link_spill_file(source: Path, digest: str) -> Path:
+        """
+        将其他位置（例如项目存储）中的溢出文件硬链接到 .cowan/history，不支持硬链接时复制
+
+        Args:
+            source: 原来的文件
+            digest: 内容的哈希值
+
+        Returns:
+            文件路径
+        """
+        path = get_spill_dir() / f'{digest}.pkl'
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_name(f'{path.stem}.{uuid.uuid4().hex}.tmp')
+            try:
+                os.link(source, temp_path)
+            except OSError:
+                shutil.copyfile(source, temp_path)
+            os.replace(temp_path, path)
+        return path
+
+    def set_xrange(self, x_range: Optional[List[float]], num: Optional[int] = None):
+        """
+        设置（或重置）内存中的对象的波长范围，溢出的对象在读回时设置
+
+        Args:
+            x_range: 波长范围，为 None 时重置
+            num: 展宽时的点的个数
+
+        """
+        self.xrange_state = None if x_range is None else ((float(x_range[0]), float(x_range[1])), num)
+        for _, cowan in self.resident_items():
+            if x_range is None:
+                cowan.reset_xrange()
+            else:
+                cowan.set_xrange(x_range, num)
+
+    def set_xrange_state(self, x_range: Optional[List[float]], num: Optional[int] = None):
+        """
+        只记录波长范围，内存中的对象已经由调用者设置（见 XRangeUpdater）
+
+        """
+        self.xrange_state = None if x_range is None else ((float(x_range[0]), float(x_range[1])), num)
+
+    def set_exp_data(self, exp_data: ExpData):
+        """
+        更新所有对象中的实验数据，溢出的对象在读回时更新
+
+        Args:
+            exp_data: 实验数据
+
+        """
+        self.exp_data = exp_data
+        for _, cowan in self.resident_items():
+            cowan.exp_data = exp_data
@@ -1,8 +1,10 @@
 import copy
-from typing import List, Dict
+from typing import List
 
 from .Cowan_ import Cowan
+from .CowanHistory import CowanHistory
 from .ExpData import ExpData
+from .ContributionCache import CONTRIBUTION_CACHE
 
 
 class CowanList:
@@ -13,7 +15,7 @@ class CowanList:
         self.chose_cowan: List[str] = []  # 用于存储 cowan 对象在历史列表中的索引
         self.add_or_not: List[bool] = []  # cowan 对象是否被添加
 
-        self.cowan_run_history: Dict[str:Cowan] = {}  # 用于存储 cowan 对象
+        self.cowan_run_history: CowanHistory = CowanHistory()  # 用于存储 cowan 对象，只在内存中保留最近使用的一部分
 
     def sort_chose_cowan(self):
         self.chose_cowan = sorted(self.chose_cowan, key=lambda x: (x.split('_')[0], int(x.split('_')[1])))
@@ -30,6 +32,8 @@ class CowanList:
             self.del_cowan(key)
         self.chose_cowan.append(key)
         self.add_or_not.append(True)
+        # 已经选择的 cowan 始终保留在内存中
+        self.cowan_run_history.set_pinned(self.chose_cowan)
 
     def del_cowan(self, key):
         """
@@ -42,6 +46,7 @@ class CowanList:
         index = self.chose_cowan.index(key)
         self.chose_cowan.pop(index)
         self.add_or_not.pop(index)
+        self.cowan_run_history.set_pinned(self.chose_cowan)
 
     def add_history(self, cowan: Cowan):
         """
@@ -53,7 +58,9 @@ class CowanList:
 
         """
         if cowan.name in self.cowan_run_history.keys():
-            self.cowan_run_history.pop(cowan.name)
+            del self.cowan_run_history[cowan.name]
+            # 重新计算后，旧的组态贡献不再有效
+            CONTRIBUTION_CACHE.discard_ion(cowan.name)
         self.cowan_run_history[cowan.name] = copy.deepcopy(cowan)
         # 如果它存在于已选择的列表中，就更新它
         if cowan.name in self.chose_cowan:
@@ -69,7 +76,7 @@ class CowanList:
         keys = list(self.cowan_run_history.keys())
         for key in keys:
             if key not in self.chose_cowan:
-                self.cowan_run_history.pop(key)
+                del self.cowan_run_history[key]
 
     def update_exp_data(self, exp_data: ExpData):
         """
@@ -79,16 +86,13 @@ class CowanList:
             exp_data: 要更新的exp_data对象
 
         """
-        for cowan in self.cowan_run_history.values():
-            cowan.exp_data = exp_data
+        self.cowan_run_history.set_exp_data(exp_data)
 
     def set_xrange(self, x_range, num):
-        for cowan in self.cowan_run_history.values():
-            cowan.set_xrange(x_range, num)
+        self.cowan_run_history.set_xrange(x_range, num)
 
     def reset_xrange(self):
-        for cowan in self.cowan_run_history.values():
-            cowan.reset_xrange()
+        self.cowan_run_history.set_xrange(None)
 
     def get_cowan_from_name(self, name):
         return self.cowan_run_history[name]
@@ -109,9 +113,12 @@ class CowanList:
     def load_class(self, class_info):
         self.chose_cowan = class_info.chose_cowan
         self.add_or_not = class_info.add_or_not
-        for (ok, ov), (nk, nv) in zip(self.cowan_run_history.items(), class_info.cowan_run_history.items()):
-            ov.load_class(nv)
-            self.cowan_run_history[ok] = ov
+        # 溢出的对象保存时已经是最新版本，只需要处理内存中的对象
+        history_info = class_info.cowan_run_history
+        for name, ov in self.cowan_run_history.resident_items():
+            ov.load_class(history_info.entries[name])
+        self.cowan_run_history.flush()
+        self.cowan_run_history.set_pinned(self.chose_cowan)
 
     def __getitem__(self, index) -> (Cowan, bool):
         return self.cowan_run_history[self.chose_cowan[index]], self.add_or_not[index]
@@ -37,24 +37,32 @@ class Cowan:
         self.run_path = PROJECT_PATH() / f'cal_result/{self.name}'
 
     def set_xrange(self, range_: List[float], num: int):
+        """
+        设置波长范围，展宽结果只标记为过期，第一次访问时再重新展宽
+
+        Args:
+            range_: 波长范围
+            num: 展宽时的点的个数
+
+        """
         self.exp_data.set_xrange(range_)
         self.cal_data.widen_all.exp_data.set_xrange(range_)
         self.cal_data.widen_all.n = num
         self.cal_data.widen_part.exp_data.set_xrange(range_)
         self.cal_data.widen_part.n = num
-
-        self.cal_data.widen_all.widen()
-        self.cal_data.widen_part.widen_by_group()
+        self.cal_data.mark_dirty()
 
     def reset_xrange(self):
+        """
+        重置波长范围，展宽结果只标记为过期，第一次访问时再重新展宽
+
+        """
         self.exp_data.reset_xrange()
         self.cal_data.widen_all.exp_data.reset_xrange()
         self.cal_data.widen_part.exp_data.reset_xrange()
         self.cal_data.widen_all.n = None
         self.cal_data.widen_part.n = None
-
-        self.cal_data.widen_all.widen()
-        self.cal_data.widen_part.widen_by_group()
+        self.cal_data.mark_dirty()
 
     def get_widen_all_obj(self) -> WidenAll:
         return copy.deepcopy(self.cal_data.widen_all)
@@ -81,6 +89,65 @@ class Cowan:
         self.run_path = PROJECT_PATH() / f'cal_result/{self.name}'
 
 
+class WidenPrefetchThread(QtCore.QThread):
+    progress = Signal(str)  # 每展宽完一个离子发送一次信号
+    end = Signal(str)  # 全部展宽完成后发送一次信号
+
+    def __init__(self, cowan_list: List[Cowan]):
+        """
+        在后台提前展宽过期的 cowan 对象（例如当前选中的离子），之后访问时不需要再等待
+
+        子线程只计算，不修改 cowan 对象；结果由 update_origin 在主线程中写回，
+        如果计算期间参数又发生了改变，就丢弃这个结果
+
+        Args:
+            cowan_list: 需要提前展宽的 cowan 对象
+        """
+        super().__init__()
+        self.cowan_list: List[Cowan] = []
+        for cowan in cowan_list:
+            if cowan is not None and cowan.cal_data is not None and cowan.cal_data.is_dirty() \
+                    and all(cowan is not c for c in self.cowan_list):
+                self.cowan_list.append(cowan)
+        self.results: List[tuple] = []  # [(cowan, 整体展宽结果, 按组态展宽结果), ...]，没有过期的部分为 None
+
+    def run(self):
+        """
+        多线程运行的主函数
+
+        """
+        for i, cowan in enumerate(self.cowan_list):
+            if self.isInterruptionRequested():
+                break
+            widen_all, widen_part = cowan.cal_data.widen_all, cowan.cal_data.widen_part
+            res_all, res_part = None, None
+            if widen_all.is_dirty():
+                state, only_p = widen_all.get_widen_state(), widen_all.threading
+                res_all = (widen_all.cal_widen_data(only_p=only_p), state, only_p)
+            if widen_part.is_dirty():
+                state = widen_part.get_widen_state()
+                res_part = (widen_part.cal_grouped_widen_data(), state)
+            self.results.append((cowan, res_all, res_part))
+            self.progress.emit(str(int((i + 1) / len(self.cowan_list) * 100)))
+        console_logger.info(f'prefetched {len(self.results)}/{len(self.cowan_list)} widen results')
+
+        # 发送结束信号
+        self.end.emit(0)
+
+    def update_origin(self):
+        """
+        将展宽结果写回 cowan 对象，需要在主线程中调用
+
+        """
+        for cowan, res_all, res_part in self.results:
+            widen_all, widen_part = cowan.cal_data.widen_all, cowan.cal_data.widen_part
+            if res_all is not None and widen_all.is_dirty() and res_all[1] == widen_all.get_widen_state():
+                widen_all.set_widen_data(*res_all)
+            if res_part is not None and widen_part.is_dirty() and res_part[1] == widen_part.get_widen_state():
+                widen_part.set_grouped_widen_data(*res_part)
+        self.results = []
+
+
 class CowanThread(QtCore.QThread):
     sub_complete = Signal(str)
     all_completed = Signal(str)
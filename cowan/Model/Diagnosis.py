@@ -0,0 +1,362 @@
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from PySide6 import QtCore
+from PySide6.QtCore import Signal
+
+from .ExpData import ExpData
+from .SimulateSpectral import SimulateResult
+from .SimulateGrid import SimulateGrid, cal_grid_similarity
+from .SpaceTimeResolution import SpaceTimeResolution
+from .SpectrumSimilarity import SIMILARITY_METHODS
+from .. import console_logger
+
+# 子进程中共享的网格数据，由 init_diagnosis_worker 在进程启动时设置一次
+_WORKER_GRID_DATA: Optional[Dict[tuple, SimulateResult]] = None
+_WORKER_METHOD: str = 'peak'
+_WORKER_AXES: Tuple[List[str], List[str]] = ([], [])
+# 诊断完成后的统计信息中列出的耗时最长的光谱个数
+SUMMARY_SLOWEST = 10
+
+
+class DiagnosisResult(NamedTuple):
+    """
+    一个时空分辨光谱的诊断结果
+
+    """
+    st_key: tuple  # 时空分辨光谱的键 (时间, (x, y, z))
+    grid_key: Optional[Tuple[str, str]]  # 最相似的网格点 (温度, 密度)，没有有效的网格点（诊断失败）时为 None
+    result: Optional[SimulateResult]  # 最相似的网格点的计算结果，相似度是相对于该实验光谱的；诊断失败时为 None
+    evaluations: int  # 计算相似度的网格点个数
+    elapsed: float  # 耗时（秒）
+
+
+def is_valid_similarity(similarity: Optional[float], method='peak') -> bool:
+    """
+    相似度是否有效
+
+    NaN 总是无效；越小越相似的方法（peak、chi2）正常情况下不会小于 0，
+    负数（-1）表示峰的个数不足等无法计算的情况。越大越相似的方法（例如 pearson）可以为负数
+
+    Args:
+        similarity: 相似度
+        method: 相似度的计算方法，见 SIMILARITY_METHODS
+
+    Returns:
+        有效时返回 True
+    """
+    if similarity is None or math.isnan(similarity):
+        return False
+    return SIMILARITY_METHODS[method][1] or similarity >= 0
+
+
+def get_best_key(grid_data: Dict[tuple, SimulateResult], method='peak') -> Optional[tuple]:
+    """
+    获取网格中最相似的网格点，相似度无效的网格点（见 is_valid_similarity）不参与比较
+
+    Args:
+        grid_data: 已经计算过相似度的网格数据
+        method: 相似度的计算方法，见 SIMILARITY_METHODS
+
+    Returns:
+        最相似的网格点的键，没有有效的网格点时返回 None
+    """
+    keys = [k for k, v in grid_data.items() if is_valid_similarity(v.spectrum_similarity, method)]
+    if not keys:
+        return None
+    if SIMILARITY_METHODS[method][1]:
+        return max(keys, key=lambda k: grid_data[k].spectrum_similarity)
+    return min(keys, key=lambda k: grid_data[k].spectrum_similarity)
+
+
+def diagnose_spectrum(st_key: tuple, exp_obj: ExpData, characteristic_peaks: List[float],
+                      grid_data: Dict[tuple, SimulateResult], method='peak') -> DiagnosisResult:
+    """
+    用网格数据诊断一个实验光谱
+
+    Args:
+        st_key: 时空分辨光谱的键
+        exp_obj: 实验光谱对象
+        characteristic_peaks: 特征峰波长
+        grid_data: 网格数据
+        method: 相似度的计算方法
+
+    Returns:
+        诊断结果，没有有效的网格点时 grid_key 与 result 为 None
+    """
+    start = time.perf_counter()
+    scored = cal_grid_similarity(grid_data, exp_obj, characteristic_peaks, method)
+    best_key = get_best_key(scored, method)
+    return DiagnosisResult(st_key, best_key, None if best_key is None else scored[best_key], len(scored),
+                           time.perf_counter() - start)
+
+
+def diagnose_sequence(tasks: List[tuple], grid_data: Dict[tuple, SimulateResult], t_list: List[str],
+                      ne_list: List[str], method='peak', radius=1) -> List[DiagnosisResult]:
+    """
+    按顺序诊断一组相邻的实验光谱（同一位置的时间序列，或同一时间的空间序列）
+
+    相邻光谱的等离子体状态相近，因此以上一个光谱的 (T, ne) 为中心，只在局部窗口内计算相似度；
+    如果最相似的点落在窗口边缘（且不是网格边缘），说明更好的点可能在窗口之外，向该方向扩大窗口后继续计算。
+    序列中的第一个光谱没有参考，在整个网格上计算；窗口内没有相似度有效的网格点时也在整个网格上计算，
+    仍然没有时该光谱诊断失败，下一个光谱沿用之前的中心
+
+    Args:
+        tasks: [(st_key, exp_obj, characteristic_peaks, start_key), ...]，按顺序排列；
+            start_key 不为 None 时表示该光谱已经诊断过，不再计算，只作为下一个光谱的窗口中心
+        grid_data: 网格数据
+        t_list: 网格的温度（字符串）
+        ne_list: 网格的密度（字符串）
+        method: 相似度的计算方法
+        radius: 窗口半径（网格点个数）
+
+    Returns:
+        诊断结果，与需要诊断的光谱一一对应
+    """
+    results = []
+    center = None
+    for st_key, exp_obj, characteristic_peaks, start_key in tasks:
+        if start_key is not None:
+            center = (t_list.index(start_key[0]), ne_list.index(start_key[1]))
+            continue
+        if center is None:
+            res = diagnose_spectrum(st_key, exp_obj, characteristic_peaks, grid_data, method)
+        else:
+            start = time.perf_counter()
+            t_lo, t_hi = max(center[0] - radius, 0), min(center[0] + radius, len(t_list) - 1)
+            ne_lo, ne_hi = max(center[1] - radius, 0), min(center[1] + radius, len(ne_list) - 1)
+            scored = {}
+            while True:
+                # 只计算新加入窗口的网格点
+                new_keys = [(t_list[i], ne_list[j]) for i in range(t_lo, t_hi + 1) for j in range(ne_lo, ne_hi + 1)
+                            if (t_list[i], ne_list[j]) not in scored and (t_list[i], ne_list[j]) in grid_data]
+                if new_keys:
+                    scored.update(cal_grid_similarity(
+                        {key: grid_data[key] for key in new_keys}, exp_obj, characteristic_peaks, method))
+                best_key = get_best_key(scored, method)
+                if best_key is None:
+                    # 窗口内没有相似度有效的网格点，退回到整个网格
+                    res = diagnose_spectrum(st_key, exp_obj, characteristic_peaks, grid_data, method)
+                    break
+                i, j = t_list.index(best_key[0]), ne_list.index(best_key[1])
+                old_window = (t_lo, t_hi, ne_lo, ne_hi)
+                if i == t_lo:
+                    t_lo = max(t_lo - radius, 0)
+                if i == t_hi:
+                    t_hi = min(t_hi + radius, len(t_list) - 1)
+                if j == ne_lo:
+                    ne_lo = max(ne_lo - radius, 0)
+                if j == ne_hi:
+                    ne_hi = min(ne_hi + radius, len(ne_list) - 1)
+                if (t_lo, t_hi, ne_lo, ne_hi) == old_window:
+                    res = DiagnosisResult(st_key, best_key, scored[best_key], len(scored),
+                                          time.perf_counter() - start)
+                    break
+        results.append(res)
+        if res.grid_key is not None:
+            center = (t_list.index(res.grid_key[0]), ne_list.index(res.grid_key[1]))
+    return results
+
+
+def init_diagnosis_worker(grid_data: Dict[tuple, SimulateResult], method: str, t_list: List[str] = None,
+                          ne_list: List[str] = None):
+    """
+    子进程的初始化函数，网格数据只传递一次
+
+    Args:
+        grid_data: 网格数据
+        method: 相似度的计算方法
+        t_list: 网格的温度（字符串），顺序诊断时使用
+        ne_list: 网格的密度（字符串），顺序诊断时使用
+
+    """
+    global _WORKER_GRID_DATA, _WORKER_METHOD, _WORKER_AXES
+    _WORKER_GRID_DATA = grid_data
+    _WORKER_METHOD = method
+    _WORKER_AXES = (t_list or [], ne_list or [])
+
+
+def diagnose_in_worker(st_key: tuple, exp_obj: ExpData, characteristic_peaks: List[float]) -> DiagnosisResult:
+    """
+    在子进程中诊断一个实验光谱
+
+    Args:
+        st_key: 时空分辨光谱的键
+        exp_obj: 实验光谱对象
+        characteristic_peaks: 特征峰波长
+
+    Returns:
+        诊断结果
+    """
+    return diagnose_spectrum(st_key, exp_obj, characteristic_peaks, _WORKER_GRID_DATA, _WORKER_METHOD)
+
+
+def diagnose_sequence_in_worker(tasks: List[tuple]) -> List[DiagnosisResult]:
+    """
+    在子进程中按顺序诊断一组实验光谱
+
+    Args:
+        tasks: 见 diagnose_sequence
+
+    Returns:
+        诊断结果
+    """
+    return diagnose_sequence(tasks, _WORKER_GRID_DATA, *_WORKER_AXES, _WORKER_METHOD)
+
+
+class BatchDiagnosisThread(QtCore.QThread):
+    progress = Signal(str)  # 每诊断完一个光谱发送一次信号
+    end = Signal(str)  # 全部诊断完成后发送一次信号
+
+    def __init__(self, grid: SimulateGrid, space_time_resolution: SpaceTimeResolution, only_undiagnosed=True,
+                 order: Optional[str] = None):
+        """
+        使用已经计算好的网格，批量诊断时空分辨光谱
+
+        Args:
+            grid: 已经计算好的网格
+            space_time_resolution: 时空分辨光谱
+            only_undiagnosed: 是否只诊断还没有温度密度的光谱
+            order: 为 None 时每个光谱都在整个网格上独立诊断；
+                为 'time' 或 'location' 时按时间（或位置）排序后顺序诊断，以上一个光谱的结果为中心局部搜索
+        """
+        super().__init__()
+        self.grid_data = grid.grid_data
+        self.similarity_method = grid.similarity_method
+        self.use_multiprocess = grid.use_multiprocess
+        self.t_list = grid.t_list
+        self.ne_list = grid.ne_list
+        self.space_time_resolution = space_time_resolution
+        self.order = order
+
+        # 在主线程中取出需要诊断的光谱，子线程只读
+        def is_diagnosed(sim):
+            return only_undiagnosed and sim.get_temperature_and_density() != (None, None)
+
+        self.tasks = []
+        self.sequences = []
+        if order is None:
+            for key, sim in space_time_resolution:
+                if is_diagnosed(sim):
+                    continue
+                self.tasks.append((key, sim.exp_data, list(sim.characteristic_peaks)))
+        else:
+            for keys in space_time_resolution.get_sequences(order):
+                sequence = []
+                for key in keys:
+                    sim = space_time_resolution.simulate_spectral_dict[key]
+                    if is_diagnosed(sim):
+                        # 已经诊断过的光谱只作为下一个光谱的搜索中心
+                        start_key = ('{:.3f}'.format(sim.temperature), '{:.3e}'.format(sim.electron_density))
+                        if start_key[0] in self.t_list and start_key[1] in self.ne_list:
+                            sequence.append((key, None, None, start_key))
+                        continue
+                    sequence.append((key, sim.exp_data, list(sim.characteristic_peaks), None))
+                    self.tasks.append(sequence[-1][:3])
+                if sequence:
+                    self.sequences.append(sequence)
+        self.results: Dict[tuple, DiagnosisResult] = {}
+        self.failed: List[tuple] = []  # 没有有效的网格点、诊断失败的光谱
+        self.timings: Dict[tuple, float] = {}  # 每个光谱的诊断耗时（秒），包括诊断失败的光谱
+        self.elapsed = 0.0  # 总耗时（秒）
+
+    def run(self):
+        """
+        多线程运行的主函数
+
+        """
+
+        def callback(f):
+            """
+            回调函数，用于更新进度条以及获取结果
+
+            Args:
+                f: 函数对象（用于获取结果）
+
+            """
+            res = f.result()
+            for r in (res if isinstance(res, list) else [res]):
+                add_result(r)
+
+        def add_result(res: DiagnosisResult):
+            nonlocal current_progress
+            current_progress += 1
+            self.progress.emit(str(int(current_progress / len(self.tasks) * 100)))
+            self.timings[res.st_key] = res.elapsed
+            if res.grid_key is None:
+                self.failed.append(res.st_key)
+                console_logger.warning('diagnosis {} failed: no grid point has a valid similarity ({} points)'.format(
+                    res.st_key, res.evaluations))
+                return
+            self.results[res.st_key] = res
+            console_logger.info('diagnosis {} >> T:{} ne:{} {} similarity:{:.4f} ({} points, {:.3f}s)'.format(
+                res.st_key, res.grid_key[0], res.grid_key[1], res.result.similarity_method,
+                res.result.spectrum_similarity, res.evaluations, res.elapsed))
+
+        start = time.perf_counter()
+        current_progress = 0
+        # 独立诊断时每个光谱是一个任务，顺序诊断时每个序列是一个任务
+        if self.order is None:
+            fun, jobs = diagnose_in_worker, self.tasks
+        else:
+            fun, jobs = diagnose_sequence_in_worker, [(sequence,) for sequence in self.sequences]
+        if self.use_multiprocess and len(jobs) > 1:
+            console_logger.info('use multiprocess to diagnose space time resolution.')
+            pool = ProcessPoolExecutor(max(os.cpu_count() - 1, 1), initializer=init_diagnosis_worker,
+                                       initargs=(self.grid_data, self.similarity_method, self.t_list, self.ne_list))
+            for job in jobs:
+                pool.submit(fun, *job).add_done_callback(callback)
+            pool.shutdown()
+        else:
+            console_logger.info('use single process to diagnose space time resolution.')
+            if self.order is None:
+                for task in self.tasks:
+                    add_result(diagnose_spectrum(*task, self.grid_data, self.similarity_method))
+            else:
+                for sequence in self.sequences:
+                    for res in diagnose_sequence(sequence, self.grid_data, self.t_list, self.ne_list,
+                                                 self.similarity_method):
+                        add_result(res)
+        self.elapsed = time.perf_counter() - start
+        evaluations = sum(res.evaluations for res in self.results.values())
+        console_logger.info('diagnosed {} spectra ({} failed) in {:.3f}s, {} similarity evaluations'.format(
+            len(self.results), len(self.failed), self.elapsed, evaluations))
+
+        # 发送结束信号
+        self.end.emit(0)
+
+    def get_summary(self) -> str:
+        """
+        诊断结果的统计信息：相似度方法、总耗时以及每个光谱的耗时，用于在诊断完成后显示
+
+        Returns:
+            统计信息文本
+        """
+        lines = ['相似度方法：{}'.format(SIMILARITY_METHODS[self.similarity_method][0]),
+                 '诊断 {} 个光谱，失败 {} 个，总耗时 {:.3f}s'.format(
+                     len(self.results), len(self.failed), self.elapsed)]
+        if self.timings:
+            timings = list(self.timings.values())
+            lines.append('单个光谱耗时：平均 {:.3f}s，最长 {:.3f}s'.format(sum(timings) / len(timings), max(timings)))
+            lines.append('')
+            lines.append('耗时最长的光谱：')
+            slowest = sorted(self.timings.items(), key=lambda item: -item[1])[:SUMMARY_SLOWEST]
+            for st_key, elapsed in slowest:
+                res = self.results.get(st_key)
+                if res is None:
+                    lines.append('{}：{:.3f}s，诊断失败'.format(st_key, elapsed))
+                else:
+                    lines.append('{}：{:.3f}s，{} 个网格点，相似度 {:.4f}'.format(
+                        st_key, elapsed, res.evaluations, res.result.spectrum_similarity))
+        return '\n'.join(lines)
+
+    def update_origin(self):
+        """
+        将诊断结果写回时空分辨光谱，需要在主线程中调用
+
+        """
+        for st_key, res in self.results.items():
+            self.space_time_resolution.set_diagnosis(st_key, res.result)
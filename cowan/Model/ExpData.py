@@ -1,12 +1,174 @@
 import copy
+import hashlib
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.offline import plot
 
+from .ExpLoader import load_exp_arrays
 from .GlobalVar import PROJECT_PATH
+from .SpectrumSimilarity import PreparedExperiment, prepare_experiment
+from ..Tools import console_logger
+
+# 每个实验光谱缓存的波长范围切片的最大个数
+RANGE_CACHE_SIZE = 64
+
+
+class ExpSpectrum:
+    # 已经创建的实验光谱，{哈希值: 对象}，内容相同的光谱只保留一份
+    registry: 'weakref.WeakValueDictionary[str, ExpSpectrum]' = weakref.WeakValueDictionary()
+
+    def __init__(self, wavelength: np.ndarray, intensity: np.ndarray,
+                 intensity_normalization: Optional[np.ndarray] = None, digest: Optional[str] = None):
+        """
+        不可变的实验光谱，数组只读，按波长升序排列，按内容计算哈希值；一般通过 intern 获取，内容相同的光谱在所有对象之间共享
+
+        Args:
+            wavelength: 波长
+            intensity: 强度
+            intensity_normalization: 归一化的强度，为 None 时重新计算
+            digest: 哈希值，为 None 时重新计算
+        """
+        wavelength, intensity, intensity_normalization = sort_by_wavelength(
+            wavelength, intensity, intensity_normalization)
+        # 调用者传入的可写数组先复制一份，不修改调用者数组的只读标志，调用者之后的修改也不会影响光谱
+        wavelength, intensity, intensity_normalization = [
+            array.copy() if array.flags.writeable else array
+            for array in [wavelength, intensity, intensity_normalization]]
+        for array in [wavelength, intensity, intensity_normalization]:
+            array.flags.writeable = False
+        self.wavelength = wavelength
+        self.intensity = intensity
+        self.intensity_normalization = intensity_normalization
+        self.digest = digest if digest is not None else get_spectrum_digest(wavelength, intensity)
+        self.slices: Dict[Tuple[float, float], slice] = {}  # 各个波长范围对应的切片，{(下限, 上限): 切片}
+        # 不复制数组
+        self.frame = pd.DataFrame({
+            'wavelength': wavelength,
+            'intensity': intensity,
+            'intensity_normalization': intensity_normalization,
+        }, copy=False)
+
+    @classmethod
+    def intern(cls, wavelength: np.ndarray, intensity: np.ndarray,
+               intensity_normalization: Optional[np.ndarray] = None, digest: Optional[str] = None) -> 'ExpSpectrum':
+        """
+        获取实验光谱，内容相同的光谱已经存在时直接返回已有的对象
+
+        Args:
+            wavelength: 波长
+            intensity: 强度
+            intensity_normalization: 归一化的强度，为 None 时重新计算
+            digest: 哈希值，为 None 时重新计算
+
+        Returns:
+            实验光谱
+        """
+        wavelength, intensity, intensity_normalization = sort_by_wavelength(
+            wavelength, intensity, intensity_normalization)
+        if digest is None:
+            digest = get_spectrum_digest(wavelength, intensity)
+        spectrum = cls.registry.get(digest)
+        if spectrum is None:
+            spectrum = cls(wavelength, intensity, intensity_normalization, digest)
+            cls.registry[digest] = spectrum
+        return spectrum
+
+    def __len__(self):
+        return len(self.wavelength)
+
+    def get_slice(self, x_range: Tuple[float, float]) -> slice:
+        """
+        获取波长范围（开区间）对应的切片，按范围缓存
+
+        Args:
+            x_range: 波长范围，单位为 nm
+
+        Returns:
+            切片
+        """
+        x_range = (float(x_range[0]), float(x_range[1]))
+        if x_range not in self.slices:
+            if len(self.slices) >= RANGE_CACHE_SIZE:
+                self.slices.clear()
+            self.slices[x_range] = get_range_slice(self.wavelength, x_range[0], x_range[1])
+        return self.slices[x_range]
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # 读取时同样通过 intern 共享
+        return ExpSpectrum.intern, (self.wavelength, self.intensity, self.intensity_normalization, self.digest)
+
+
+def sort_by_wavelength(wavelength: np.ndarray, intensity: np.ndarray,
+                       intensity_normalization: Optional[np.ndarray] = None) -> Tuple[np.ndarray, ...]:
+    """
+    将实验光谱按波长升序排列，已经有序时不复制
+
+    Args:
+        wavelength: 波长
+        intensity: 强度
+        intensity_normalization: 归一化的强度，为 None 时重新计算
+
+    Returns:
+        (wavelength, intensity, intensity_normalization)
+    """
+    wavelength = np.asarray(wavelength, dtype=float)
+    intensity = np.asarray(intensity, dtype=float)
+    if intensity_normalization is None:
+        intensity_normalization = (intensity - intensity.min()) / (intensity.max() - intensity.min())
+    intensity_normalization = np.asarray(intensity_normalization, dtype=float)
+    if np.any(wavelength[1:] < wavelength[:-1]):
+        order = np.argsort(wavelength, kind='stable')
+        wavelength, intensity, intensity_normalization = (
+            wavelength[order], intensity[order], intensity_normalization[order])
+    return wavelength, intensity, intensity_normalization
+
+
+def get_range_slice(values: np.ndarray, lower: float, upper: float) -> slice:
+    """
+    在升序排列的数组中查找开区间 (lower, upper) 内的元素，用切片取值时不复制数据
+
+    Args:
+        values: 升序排列的数组
+        lower: 下限
+        upper: 上限
+
+    Returns:
+        切片
+    """
+    start = int(np.searchsorted(values, lower, side='right'))
+    stop = int(np.searchsorted(values, upper, side='left'))
+    return slice(start, max(start, stop))
+
+
+def get_spectrum_digest(wavelength: np.ndarray, intensity: np.ndarray) -> str:
+    """
+    计算实验光谱的哈希值
+
+    Args:
+        wavelength: 波长
+        intensity: 强度
+
+    Returns:
+        哈希值
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for array in [wavelength, intensity]:
+        h.update(str(array.shape).encode())
+        h.update(np.ascontiguousarray(array).data)
+    return h.hexdigest()
 
 
 class ExpData:
@@ -14,50 +176,128 @@ class ExpData:
         """
         实验数据对象，一般附属于 Cowan、SimulateSpectral 对象
 
+        数据保存在共享的 ExpSpectrum 中，ExpData 只是其上的一个视图（波长范围），复制 ExpData 时不复制数据
+
         Args:
             filepath: 实验数据所在的路径
         """
         self.plot_path = (PROJECT_PATH() / 'figure/exp.html').as_posix()  # 实验谱线的绘图路径
         self.filepath: Path = filepath  # 实验数据的路径
 
-        self.init_data: Optional[pd.DataFrame] = None  # 原始的实验数据
-        self.data: Optional[pd.DataFrame] = None  # 实验数据
+        self.spectrum: Optional[ExpSpectrum] = None  # 实验数据，只读共享
+        self.cropped = False  # 是否设置过波长范围，没有设置时 data 为完整的数据
         self.init_xrange = None  # 原始的波长范围
         self.x_range: Optional[List[float]] = None  # 实验数据的波长范围
+        self.prepared_cache: Dict[tuple, PreparedExperiment] = {}  # 计算相似度用的预处理结果，键为特征峰
+        self.__view: Optional[tuple] = None  # 当前波长范围内的数据，(波长范围, DataFrame)
 
         self.__read_file()
 
+    @classmethod
+    def from_spectrum(cls, filepath: Path, spectrum: ExpSpectrum) -> 'ExpData':
+        """
+        由实验光谱构造实验数据对象，不再读文件
+
+        Args:
+            filepath: 实验数据所在的路径
+            spectrum: 实验光谱
+
+        Returns:
+            实验数据对象
+        """
+        obj = cls.__new__(cls)
+        obj.plot_path = (PROJECT_PATH() / 'figure/exp.html').as_posix()
+        obj.filepath = filepath
+        obj.spectrum = spectrum
+        obj.cropped = False
+        obj.x_range = [spectrum.wavelength.min(), spectrum.wavelength.max()]
+        obj.init_xrange = copy.deepcopy(obj.x_range)
+        obj.prepared_cache = {}
+        obj.__view = None
+        return obj
+
+    @classmethod
+    def from_arrays(cls, filepath: Path, wavelength: np.ndarray, intensity: np.ndarray,
+                    intensity_normalization: Optional[np.ndarray] = None) -> 'ExpData':
+        """
+        由已经读入的数组构造实验数据对象，不再读文件
+
+        数组不会被复制，批量读入时多个对象的 DataFrame 直接指向同一个二维数组中的各行
+
+        Args:
+            filepath: 实验数据所在的路径
+            wavelength: 波长
+            intensity: 强度
+            intensity_normalization: 归一化的强度，为 None 时重新计算
+
+        Returns:
+            实验数据对象
+        """
+        return cls.from_spectrum(filepath, ExpSpectrum.intern(wavelength, intensity, intensity_normalization))
+
     def __read_file(self):
         """
         根据路径读入实验数据
 
         """
-        filetype = self.filepath.suffix[1:]
-        if filetype == 'csv':
-            temp_data = pd.read_csv(self.filepath, sep=',', skiprows=1, names=['wavelength', 'intensity'])
-        elif filetype == 'txt':
-            temp_data = pd.read_csv(self.filepath, sep='\s+', skiprows=1, names=['wavelength', 'intensity'])
-        else:
-            raise ValueError(f'filetype {filetype} is not supported')
-        temp_data['intensity_normalization'] = (temp_data['intensity'] - temp_data['intensity'].min()) / (
-                temp_data['intensity'].max() - temp_data['intensity'].min())
-
-        self.data = temp_data
-        self.init_data = copy.deepcopy(temp_data)
-        self.x_range = [self.data['wavelength'].min(), self.data['wavelength'].max()]
+        wavelength, intensity = load_exp_arrays(self.filepath)
+        self.spectrum = ExpSpectrum.intern(wavelength, intensity)
+        self.x_range = [self.spectrum.wavelength.min(), self.spectrum.wavelength.max()]
         self.init_xrange = copy.deepcopy(self.x_range)
 
+    @property
+    def init_data(self) -> pd.DataFrame:
+        """
+        原始的实验数据（只读）
+
+        """
+        return self.spectrum.frame
+
+    @property
+    def data(self) -> pd.DataFrame:
+        """
+        当前波长范围内的实验数据（只读），是 init_data 的切片，不复制数据
+
+        """
+        if not self.cropped:
+            return self.spectrum.frame
+        key = (self.x_range[0], self.x_range[1])
+        if self.__view is None or self.__view[0] != key:
+            self.__view = (key, self.spectrum.frame.iloc[self.spectrum.get_slice(key)])
+        return self.__view[1]
+
+    def get_digest(self) -> str:
+        """
+        获取实验光谱的哈希值，内容相同的实验数据哈希值相同
+
+        """
+        return self.spectrum.digest
+
+    def cropped_view(self, x_range: List[float]) -> 'ExpData':
+        """
+        获取另一个波长范围的视图，与原对象共享数据
+
+        Args:
+            x_range: 波长范围，单位为 nm
+
+        Returns:
+            新的实验数据对象
+        """
+        obj = copy.deepcopy(self)
+        obj.set_xrange(x_range)
+        return obj
+
     def set_xrange(self, x_range: List[float]):
         """
-        设置实验数据的波长范围
+        设置实验数据的波长范围，只改变视图，不复制数据
 
         Args:
             x_range: 波长范围，单位为 nm
 
         """
         self.x_range = [x_range[0], x_range[1]]
-        self.data = self.init_data[(self.init_data['wavelength'] < self.x_range[1]) &
-                                   (self.init_data['wavelength'] > self.x_range[0])]
+        self.cropped = True
+        self.prepared_cache = {}
 
     def reset_xrange(self):
         """
@@ -82,18 +322,117 @@ class ExpData:
 
         plot(fig, filename=self.plot_path, auto_open=False)
 
+    def get_prepared(self, characteristic_peaks=()) -> PreparedExperiment:
+        """
+        获取预处理后的实验光谱，用于计算相似度
+
+        结果按特征峰缓存，只有在调用 set_xrange、reset_xrange 后才会重新计算
+
+        Args:
+            characteristic_peaks: 特征峰波长
+
+        Returns:
+            预处理后的实验光谱
+        """
+        key = tuple(characteristic_peaks)
+        if key not in self.prepared_cache:
+            self.prepared_cache[key] = prepare_experiment(
+                self.data['wavelength'].values, self.data['intensity'].values, key)
+        return self.prepared_cache[key]
+
     def get_exp_data(self) -> pd.DataFrame:
         return self.data.__deepcopy__()
 
+    def __deepcopy__(self, memo):
+        # 只复制视图，实验光谱共享
+        obj = copy.copy(self)
+        obj.x_range = copy.deepcopy(self.x_range)
+        obj.init_xrange = copy.deepcopy(self.init_xrange)
+        obj.prepared_cache = dict(self.prepared_cache)
+        memo[id(self)] = obj
+        return obj
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_ExpData__view'] = None
+        return state
+
     def load_class(self, class_info):
         self.plot_path = (PROJECT_PATH() / 'figure/exp.html').as_posix()
         self.filepath = class_info.filepath
-        # start [无版本号 > 1.0.0]
-        if 'init_data' not in class_info.__dict__.keys():
-            self.init_data = copy.deepcopy(class_info.data)
-        else:
-            self.init_data = class_info.init_data
-        # end [无版本号 > 1.0.0]
-        self.data = class_info.data
+        self.spectrum = class_info.spectrum
+        self.cropped = class_info.cropped
         self.init_xrange = class_info.init_xrange
         self.x_range = class_info.x_range
+        self.prepared_cache = {}
+        self.__view = None
+
+
+def read_exp_file(filepath: Path) -> pd.DataFrame:
+    """
+    读入实验数据文件，支持的格式见 ExpLoader.EXP_READERS
+
+    Args:
+        filepath: 实验数据所在的路径
+
+    Returns:
+        列标题为 wavelength, intensity 的 DataFrame
+    """
+    wavelength, intensity = load_exp_arrays(filepath)
+    return pd.DataFrame({'wavelength': wavelength, 'intensity': intensity}, copy=False)
+
+
+def load_exp_files(filepaths: List[Path], max_workers: Optional[int] = None) -> List[ExpData]:
+    """
+    并行批量读入实验数据，每个文件只读一次
+
+    如果所有文件的波长完全相同，强度存为一个二维数组，各个 ExpData 对象只是指向其中一行的视图（只读）
+
+    Args:
+        filepaths: 实验数据路径
+        max_workers: 读文件的线程数，为 None 时使用 CPU 个数
+
+    Returns:
+        实验数据对象，与 filepaths 一一对应
+    """
+    if not filepaths:
+        return []
+    with ThreadPoolExecutor(max_workers or os.cpu_count()) as pool:
+        data_list: List[pd.DataFrame] = list(pool.map(read_exp_file, filepaths))
+
+    wavelength, intensity = get_shared_axis(data_list)
+    if wavelength is None:
+        console_logger.info(f'load {len(filepaths)} exp files, wavelength axes differ')
+        return [ExpData.from_arrays(path, data['wavelength'].values, data['intensity'].values)
+                for path, data in zip(filepaths, data_list)]
+
+    console_logger.info(f'load {len(filepaths)} exp files, shared wavelength axis ({len(wavelength)} points)')
+    if np.any(wavelength[1:] < wavelength[:-1]):
+        # 只排序一次，各个对象仍然是二维数组中的一行
+        order = np.argsort(wavelength, kind='stable')
+        wavelength, intensity = wavelength[order], intensity[:, order]
+    intensity_min = intensity.min(axis=1, keepdims=True)
+    intensity_normalization = (intensity - intensity_min) / (intensity.max(axis=1, keepdims=True) - intensity_min)
+    for array in [wavelength, intensity, intensity_normalization]:
+        array.flags.writeable = False
+    return [ExpData.from_arrays(path, wavelength, intensity[i], intensity_normalization[i])
+            for i, path in enumerate(filepaths)]
+
+
+def get_shared_axis(data_list: List[pd.DataFrame]) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    检查多个实验数据是否共用同一个波长坐标
+
+    Args:
+        data_list: 列标题为 wavelength, intensity 的 DataFrame
+
+    Returns:
+        (wavelength, intensity)，intensity 的形状为 (文件个数, 波长点个数)；
+        如果波长不一致，则返回 (None, None)
+    """
+    wavelength = np.array(data_list[0]['wavelength'].values, dtype=float)
+    for data in data_list[1:]:
+        if not np.array_equal(data['wavelength'].values, wavelength):
+            return None, None
+    intensity = np.vstack([data['intensity'].values for data in data_list]).astype(float)
+    return wavelength, intensity
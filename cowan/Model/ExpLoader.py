@@ -0,0 +1,170 @@
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .GlobalVar import PROJECT_PATH
+from ..Tools import console_logger
+
+# 可选的 pyarrow 解析器，安装后自动用于 csv 文件（多线程解析，大文件快得多）
+try:
+    import pyarrow
+
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+
+def read_csv(filepath: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读入逗号分隔的文本，第一行为标题，前两列为波长、强度
+
+    """
+    if PYARROW_AVAILABLE:
+        try:
+            temp_data = pd.read_csv(filepath, sep=',', engine='pyarrow')
+            return temp_data.iloc[:, 0].values, temp_data.iloc[:, 1].values
+        except Exception as e:
+            console_logger.debug(f'pyarrow can not parse {filepath}: {e!r}')
+    temp_data = pd.read_csv(filepath, sep=',', skiprows=1, names=['wavelength', 'intensity'], engine='c')
+    return temp_data['wavelength'].values, temp_data['intensity'].values
+
+
+def read_whitespace(filepath: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读入空白字符分隔的文本，第一行为标题，前两列为波长、强度
+
+    """
+    temp_data = pd.read_csv(filepath, sep=r'\s+', skiprows=1, names=['wavelength', 'intensity'], engine='c')
+    return temp_data['wavelength'].values, temp_data['intensity'].values
+
+
+def read_npy(filepath: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读入 numpy 的 .npy 文件，形状为 (n, 2) 或 (2, n)
+
+    """
+    data = np.load(filepath, mmap_mode='r', allow_pickle=False)
+    if data.ndim != 2 or 2 not in data.shape:
+        raise ValueError(f'{filepath} has shape {data.shape}, expected (n, 2) or (2, n)')
+    if data.shape[1] != 2:
+        data = data.T
+    return np.array(data[:, 0], dtype=float), np.array(data[:, 1], dtype=float)
+
+
+def read_raw(filepath: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读入没有文件头的二进制文件：小端 float64，波长、强度交替排列
+
+    """
+    data = np.fromfile(filepath, dtype='<f8')
+    if data.size % 2:
+        raise ValueError(f'{filepath} has {data.size} values, expected (wavelength, intensity) pairs')
+    data = data.reshape(-1, 2)
+    return np.array(data[:, 0], dtype=float), np.array(data[:, 1], dtype=float)
+
+
+# 支持的实验数据格式，{扩展名: (读入函数, 是否缓存解析结果)}；二进制格式直接读取，不需要缓存
+EXP_READERS: Dict[str, Tuple[Callable[[Path], Tuple[np.ndarray, np.ndarray]], bool]] = {
+    'csv': (read_csv, True),
+    'txt': (read_whitespace, True),
+    'dat': (read_whitespace, True),
+    'npy': (read_npy, False),
+    'bin': (read_raw, False),
+}
+# 文件选择对话框使用的过滤器
+EXP_FILE_FILTER = '数据文件({})'.format(' '.join(f'*.{suffix}' for suffix in EXP_READERS.keys()))
+
+
+def get_cache_dir() -> Path:
+    return PROJECT_PATH() / '.cowan/exp_cache'
+
+
+def get_path_hash(filepath: Path) -> str:
+    return hashlib.blake2b(filepath.resolve().as_posix().encode(), digest_size=10).hexdigest()
+
+
+def get_cache_path(filepath: Path) -> Tuple[Path, str]:
+    """
+    获取缓存文件的路径
+
+    缓存文件名为 <路径的哈希值>_<修改时间与大小的哈希值>.npy，文件改变后旧的缓存不再匹配
+
+    Args:
+        filepath: 实验数据的路径
+
+    Returns:
+        (缓存文件路径, 路径的哈希值)
+    """
+    stat = filepath.stat()
+    path_hash = get_path_hash(filepath)
+    key_hash = hashlib.blake2b(f'{stat.st_mtime_ns}_{stat.st_size}'.encode(), digest_size=6).hexdigest()
+    return get_cache_dir() / f'{path_hash}_{key_hash}.npy', path_hash
+
+
+def load_exp_arrays(filepath: Path, use_cache=True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读入实验数据，文本文件的解析结果以二进制形式缓存在 .cowan/exp_cache 中（按路径、修改时间、大小匹配），
+    同一个文件再次读入时直接读取缓存，不再解析
+
+    Args:
+        filepath: 实验数据所在的路径
+        use_cache: 是否使用缓存
+
+    Returns:
+        (wavelength, intensity)
+    """
+    filepath = Path(filepath)
+    filetype = filepath.suffix[1:].lower()
+    if filetype not in EXP_READERS:
+        raise ValueError(f'filetype {filetype} is not supported')
+    read_fun, cacheable = EXP_READERS[filetype]
+    if not (use_cache and cacheable):
+        return read_fun(filepath)
+
+    cache_path, path_hash = get_cache_path(filepath)
+    if cache_path.exists():
+        try:
+            data = np.load(cache_path, allow_pickle=False)
+            console_logger.debug(f'exp cache hit {filepath.name}')
+            return data[0], data[1]
+        except Exception as e:
+            console_logger.warning(f'can not read {cache_path}: {e!r}')
+    wavelength, intensity = read_fun(filepath)
+    try:
+        # 删除该文件过期的缓存
+        for old_path in cache_path.parent.glob(f'{path_hash}_*.npy'):
+            old_path.unlink(missing_ok=True)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = cache_path.with_name(f'{cache_path.stem}.{uuid.uuid4().hex}.tmp')
+        with open(temp_path, 'wb') as f:
+            np.save(f, np.vstack([wavelength, intensity]).astype(float), allow_pickle=False)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        console_logger.warning(f'can not write {cache_path}: {e!r}')
+    return wavelength, intensity
+
+
+def clear_exp_cache(filepath: Optional[Path] = None) -> int:
+    """
+    删除实验数据的缓存
+
+    Args:
+        filepath: 只删除该文件的缓存，为 None 时删除全部
+
+    Returns:
+        删除的缓存文件个数
+    """
+    cache_dir = get_cache_dir()
+    if not cache_dir.exists():
+        return 0
+    pattern = '*.npy' if filepath is None else f'{get_path_hash(Path(filepath))}_*.npy'
+    count = 0
+    for path in cache_dir.glob(pattern):
+        path.unlink(missing_ok=True)
+        count += 1
+    return count
@@ -0,0 +1,229 @@
+import time
+import types
+import warnings
+from typing import Callable, Dict, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from .ContributionCache import CONTRIBUTION_CACHE
+from .ExpData import ExpData, ExpSpectrum
+from ..Tools import console_logger
+
+# 各个子系统的软上限（字节），为 None 时不限制；超出时发出警告，并调用 EVICTORS 中对应的函数释放缓存
+MEMORY_BUDGETS: Dict[str, Optional[int]] = {
+    'cowan_history': 2 * 1024 ** 3,
+    'cowan': None,
+    'exp_data': 256 * 1024 ** 2,
+    'simulate': None,
+    'grid': 2 * 1024 ** 3,
+    'space_time': 1024 ** 3,
+    'contribution_cache': 512 * 1024 ** 2,
+    'other': None,
+}
+# 项目中的对象所属的子系统，{对象名称: 子系统}，没有列出的对象属于 'other'
+RECORD_SUBSYSTEMS = {
+    'expdata_1': 'exp_data',
+    'expdata_2': 'exp_data',
+    'cowan_lists': 'cowan_history',
+    'cowan': 'cowan',
+    'cowan_page5': 'cowan',
+    'simulate': 'simulate',
+    'simulate_page4': 'simulate',
+    'simulated_grid': 'grid',
+    'space_time_resolution': 'space_time',
+}
+
+
+def get_nbytes(obj, seen: Optional[Set[int]] = None) -> int:
+    """
+    统计对象中数值数据（数组、DataFrame）占用的字节数，不统计 Python 对象本身的开销
+
+    与 asizeof 相比只累加数组的 nbytes，不逐个遍历数组中的元素，速度快得多
+
+    Args:
+        obj: 对象
+        seen: 已经统计过的对象的 id，多个对象共享的数据只统计一次
+
+    Returns:
+        字节数
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or obj is None or isinstance(obj, (str, bytes, int, float, bool, type, types.ModuleType)):
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, ExpData):
+        # 当前范围内的数据是实验光谱的切片，不单独统计
+        return get_nbytes(obj.spectrum, seen) + get_nbytes(obj.prepared_cache, seen)
+    if isinstance(obj, ExpSpectrum):
+        # frame 与三个数组共享内存，只统计数组
+        return sum(get_nbytes(array, seen) for array in
+                   [obj.wavelength, obj.intensity, obj.intensity_normalization])
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=False).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=False))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(get_nbytes(k, seen) + get_nbytes(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sum(get_nbytes(v, seen) for v in obj)
+    if hasattr(obj, '__dict__'):
+        return get_nbytes(vars(obj), seen)
+    return 0
+
+
+class MemoryReport:
+    def __init__(self, records: Dict[str, object]):
+        """
+        按子系统、按对象统计内存占用
+
+        子系统及其中的对象：
+            cowan_history       历史记录中的每个 cowan：<名称>.init_data、<名称>.widen_all、<名称>.widen_part、<名称>（其余部分）
+            cowan               第一页、第五页的 cowan，细分方式同上
+            exp_data            实验数据
+            simulate            第二页、第四页的模拟光谱
+            grid                网格中的每个网格点 <温度> <密度>
+            space_time          每个时空分辨光谱
+            contribution_cache  组态贡献缓存中的每个条目
+            other               其余对象
+
+        多个对象共享的数据只统计在最先统计的对象中（实验数据最先统计）
+
+        Args:
+            records: 项目中已经读取的对象，{对象名称: 对象}
+        """
+        start = time.perf_counter()
+        self.data: Dict[str, Dict[str, int]] = {name: {} for name in MEMORY_BUDGETS.keys()}
+        self.seen: Set[int] = set()
+
+        order = ['exp_data', 'cowan', 'cowan_history', 'simulate', 'grid', 'space_time', 'other']
+        items = sorted(records.items(), key=lambda item: order.index(RECORD_SUBSYSTEMS.get(item[0], 'other')))
+        for name, obj in items:
+            if obj is None:
+                continue
+            subsystem = RECORD_SUBSYSTEMS.get(name, 'other')
+            if subsystem == 'cowan_history':
+                # 只统计内存中的对象，溢出到磁盘的对象不占用内存
+                for key, cowan in obj.cowan_run_history.resident_items():
+                    self.add_cowan(subsystem, key, cowan)
+            elif subsystem == 'cowan':
+                self.add_cowan(subsystem, name, obj)
+            elif subsystem == 'grid':
+                self.add(subsystem, 'template', obj.simulate)
+                for (t, ne), result in obj.grid_data.items():
+                    self.add(subsystem, f'{t} {ne}', result)
+            elif subsystem == 'space_time':
+                for key, sim in obj:
+                    self.add(subsystem, str(key), sim)
+            else:
+                self.add(subsystem, name, obj)
+        for key, value in CONTRIBUTION_CACHE.data.items():
+            self.add('contribution_cache', str(key[:2]), value)
+        self.elapsed = time.perf_counter() - start
+
+    def add(self, subsystem: str, name: str, obj):
+        nbytes = get_nbytes(obj, self.seen)
+        if nbytes:
+            self.data[subsystem][name] = self.data[subsystem].get(name, 0) + nbytes
+
+    def add_cowan(self, subsystem: str, name: str, cowan):
+        if cowan.cal_data is not None:
+            self.add(subsystem, f'{name}.init_data', cowan.cal_data.init_data)
+            self.add(subsystem, f'{name}.widen_all', cowan.cal_data.widen_all)
+            self.add(subsystem, f'{name}.widen_part', cowan.cal_data.widen_part)
+        self.add(subsystem, name, cowan)
+
+    def get_total(self, subsystem: Optional[str] = None) -> int:
+        """
+        获取总的字节数
+
+        Args:
+            subsystem: 子系统，为 None 时统计所有子系统
+
+        Returns:
+            字节数
+        """
+        if subsystem is None:
+            return sum(sum(items.values()) for items in self.data.values())
+        return sum(self.data[subsystem].values())
+
+    def format(self, top=5) -> str:
+        """
+        生成文本形式的报告
+
+        Args:
+            top: 每个子系统列出的最大的对象个数
+
+        Returns:
+            报告
+        """
+        lines = ['{:<22} {:>12.2f} MB'.format('total', self.get_total() / 1024 ** 2)]
+        for subsystem, items in self.data.items():
+            budget = MEMORY_BUDGETS.get(subsystem)
+            lines.append('{:<22} {:>12.2f} MB{}'.format(
+                subsystem, self.get_total(subsystem) / 1024 ** 2,
+                '' if budget is None else ' / {:.0f} MB'.format(budget / 1024 ** 2)))
+            for name, nbytes in sorted(items.items(), key=lambda item: -item[1])[:top]:
+                lines.append('    {:<18} {:>12.2f} MB'.format(name, nbytes / 1024 ** 2))
+        return '\n'.join(lines)
+
+
+def evict_cowan_history(records: Dict[str, object]):
+    """
+    将历史记录中没有选中的 cowan 全部溢出到磁盘，下次访问时读回
+
+    """
+    cowan_lists = records.get('cowan_lists')
+    if cowan_lists is None:
+        return
+    cowan_lists.cowan_run_history.shrink(0)
+
+
+def evict_prepared_cache(records: Dict[str, object]):
+    """
+    清空实验数据中计算相似度用的预处理结果
+
+    """
+    exp_list = [records.get('expdata_1'), records.get('expdata_2')]
+    if records.get('space_time_resolution') is not None:
+        exp_list += [sim.exp_data for _, sim in records['space_time_resolution']]
+    for exp_data in exp_list:
+        if exp_data is not None and getattr(exp_data, 'prepared_cache', None):
+            exp_data.prepared_cache = {}
+
+
+# 超出内存上限时释放缓存的函数，{子系统: 函数}，函数接收 records
+EVICTORS: Dict[str, Callable[[Dict[str, object]], None]] = {
+    'cowan_history': evict_cowan_history,
+    'exp_data': evict_prepared_cache,
+    'space_time': evict_prepared_cache,
+    'contribution_cache': lambda records: CONTRIBUTION_CACHE.clear(),
+}
+
+
+def check_memory_budgets(records: Dict[str, object], evict=True) -> MemoryReport:
+    """
+    检查各个子系统是否超出内存上限（MEMORY_BUDGETS），超出时发出警告，并释放该子系统的缓存
+
+    Args:
+        records: 项目中已经读取的对象，{对象名称: 对象}
+        evict: 是否释放缓存
+
+    Returns:
+        检查时（释放缓存之前）的内存报告
+    """
+    report = MemoryReport(records)
+    for subsystem, budget in MEMORY_BUDGETS.items():
+        total = report.get_total(subsystem)
+        if budget is None or total <= budget:
+            continue
+        warnings.warn('{} uses {:.1f} MB, exceeds the budget of {:.1f} MB'.format(
+            subsystem, total / 1024 ** 2, budget / 1024 ** 2))
+        if evict and subsystem in EVICTORS:
+            EVICTORS[subsystem](records)
+            console_logger.info('{} evicted, {:.1f} MB > {:.1f} MB'.format(
+                subsystem, total / 1024 ** 2, MemoryReport(records).get_total(subsystem) / 1024 ** 2))
+    return report
@@ -0,0 +1,722 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+from packaging.version import Version
+
+from .Compression import CompressionStats, DEFAULT_CODEC, encode, decode
+from .Cowan_ import Cowan
+from .CowanHistory import CowanHistory, SpilledCowan
+from .CowanList import CowanList
+from .ExpData import ExpData, ExpSpectrum
+from .SimulateGrid import SimulateGrid
+from .SimulateSpectral import SimulateSpectral, SimulateResult, IonContribution
+from .Widen import WidenAll, WidenPart, sort_by_wavelength_ev
+from ..Tools import console_logger
+
+# 项目存储格式的版本
+STORE_SCHEMA = 1
+# 小于这个字节数的数组（表格）直接保存在对象结构中
+ARRAY_THRESHOLD = 4096
+
+# 保存时表示记录没有改变（例如还没有读取），沿用已经保存的文件
+UNCHANGED = object()
+
+# 项目版本的升级函数：{版本: {类: 升级函数}}
+# 读取版本（info['version']）低于某个版本的项目时，记录中每个该类的对象都调用一次对应的升级函数（原地修改），
+# 然后再调用 load_class；各个对象按子对象在前的顺序升级，见 migrate_record
+SCHEMA_MIGRATIONS: Dict[str, Dict[type, Callable[[object], None]]] = {}
+
+
+def migrate_exp_data_1_0_6(obj: ExpData):
+    """
+    [1.0.5 > 1.0.6] init_data、data 两个 DataFrame 改为共享的 ExpSpectrum
+
+    """
+    state = obj.__dict__
+    data = state.pop('data')
+    init_data = state.pop('init_data', None)
+    # 无版本号的项目没有 init_data
+    if init_data is None:
+        init_data = data
+    obj.spectrum = ExpSpectrum.intern(
+        init_data['wavelength'].values, init_data['intensity'].values,
+        init_data['intensity_normalization'].values if 'intensity_normalization' in init_data else None)
+    obj.cropped = len(data) != len(init_data)
+    obj.prepared_cache = {}
+    obj._ExpData__view = None
+
+
+def migrate_widen_all_1_0_6(obj: WidenAll):
+    """
+    [1.0.5 > 1.0.6] 原始数据按 wavelength_ev 升序排列，记录展宽结果对应的参数
+
+    """
+    obj.init_data = sort_by_wavelength_ev(obj.init_data)
+    # 旧版本保存的展宽结果总是与当前参数一致；无版本号的项目没有温度，下次使用时重新展宽
+    if obj.widen_data is not None and 'temperature' in obj.__dict__:
+        obj.set_widen_data(obj.widen_data)
+    else:
+        obj.widen_state = None
+
+
+def migrate_widen_part_1_0_6(obj: WidenPart):
+    """
+    [1.0.5 > 1.0.6] 原始数据以及各组按 wavelength_ev 升序排列，记录展宽结果对应的参数
+
+    """
+    obj.init_data = sort_by_wavelength_ev(obj.init_data)
+    if obj.__dict__.get('grouped_data') is not None:
+        obj.grouped_data = {key: sort_by_wavelength_ev(value) for key, value in obj.grouped_data.items()}
+    if obj.grouped_widen_data is not None and 'temperature' in obj.__dict__:
+        obj.widen_state = obj.get_widen_state()
+    else:
+        obj.widen_state = None
+
+
+def migrate_simulate_spectral_1_0_6(obj: SimulateSpectral):
+    """
+    [1.0.5 > 1.0.6] 离子贡献由 {离子名称: DataFrame} 改为 IonContribution；记录相似度的计算方法（旧版本只有峰值匹配）
+
+    """
+    if isinstance(obj.__dict__.get('ion_contribution'), dict):
+        obj.ion_contribution = IonContribution.from_dataframes(obj.ion_contribution)
+    obj.similarity_method = 'peak'
+
+
+def migrate_simulate_grid_1_0_6(obj: SimulateGrid):
+    """
+    [1.0.5 > 1.0.6] 网格点由模拟光谱对象改为只读的计算结果，记录相似度的计算方法（旧版本只有峰值匹配）
+
+    """
+    obj.similarity_method = 'peak'
+    obj.grid_data = {key: value if isinstance(value, SimulateResult) else SimulateSpectral.get_result(value)
+                     for key, value in obj.grid_data.items()}
+
+
+def migrate_cowan_list_1_0_6(obj: CowanList):
+    """
+    [1.0.5 > 1.0.6] 运行历史由 dict 改为 CowanHistory
+
+    """
+    obj.cowan_run_history = CowanHistory(obj.cowan_run_history)
+
+
+SCHEMA_MIGRATIONS['1.0.6'] = {
+    ExpData: migrate_exp_data_1_0_6,
+    WidenAll: migrate_widen_all_1_0_6,
+    WidenPart: migrate_widen_part_1_0_6,
+    SimulateSpectral: migrate_simulate_spectral_1_0_6,
+    SimulateGrid: migrate_simulate_grid_1_0_6,
+    CowanList: migrate_cowan_list_1_0_6,
+}
+
+
+def iter_objects(root) -> List[object]:
+    """
+    获取对象图中的所有对象（按 id 去重），子对象排在前面；不进入 numpy、pandas 的对象
+
+    Args:
+        root: 根对象
+
+    Returns:
+        对象列表
+    """
+    objects = []
+    seen: Set[int] = set()
+    stack = [(root, False)]
+    while stack:
+        obj, expanded = stack.pop()
+        if expanded:
+            objects.append(obj)
+            continue
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, dict):
+            children = list(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            children = list(obj)
+        elif hasattr(obj, '__dict__') and not isinstance(obj, type) \
+                and not type(obj).__module__.startswith(('numpy', 'pandas')):
+            children = list(vars(obj).values())
+        else:
+            continue
+        stack.append((obj, True))
+        stack.extend((child, False) for child in reversed(children))
+    return objects
+
+
+def get_migration_steps(version: str) -> List[str]:
+    """
+    获取升级该版本的项目需要执行的步骤（SCHEMA_MIGRATIONS 的键），按版本升序排列
+
+    Args:
+        version: 项目保存时的版本
+
+    Returns:
+        版本列表，为空时不需要升级
+    """
+    return [step for step in sorted(SCHEMA_MIGRATIONS.keys(), key=Version) if Version(version) < Version(step)]
+
+
+def migrate_record(obj, version: str):
+    """
+    将旧版本项目中读取的记录升级到当前版本（见 SCHEMA_MIGRATIONS），需要在 load_class 之前调用
+
+    Args:
+        obj: 读取的记录
+        version: 保存该记录时的项目版本
+
+    Returns:
+        升级后的记录（原地修改）
+    """
+    steps = get_migration_steps(version)
+    if obj is None or not steps:
+        return obj
+    start = time.perf_counter()
+    objects = iter_objects(obj)
+    for step in steps:
+        migrations = SCHEMA_MIGRATIONS[step]
+        for item in objects:
+            migrate = migrations.get(type(item))
+            if migrate is not None:
+                migrate(item)
+    console_logger.info('migrate {} from {} to {} ({} objects, {:.3f}s)'.format(
+        type(obj).__name__, version, steps[-1], len(objects), time.perf_counter() - start))
+    return obj
+
+
+def is_columnar_table(obj) -> bool:
+    """
+    是否将表格按列保存（每列一个数组，放在同一个 .npz 文件中），线状谱表格、展宽结果等都是这种表格
+
+    只处理列名为不重复的字符串、各列为数值类型、索引为数值类型的 DataFrame，其余的表格按 pandas 的方式保存
+
+    Args:
+        obj: 对象
+
+    Returns:
+        按列保存时返回 True
+    """
+    if type(obj) is not pd.DataFrame or obj.attrs or not obj.flags.allows_duplicate_labels:
+        return False
+    if isinstance(obj.columns, pd.MultiIndex) or isinstance(obj.index, pd.MultiIndex):
+        return False
+    if obj.columns.name is not None or obj.index.name is not None or not obj.columns.is_unique:
+        return False
+    if not all(isinstance(name, str) for name in obj.columns):
+        return False
+    dtypes = [*obj.dtypes, obj.index.dtype]
+    if not all(isinstance(dtype, np.dtype) and dtype.kind in 'biuf' for dtype in dtypes):
+        return False
+    return obj.memory_usage(index=False).sum() >= ARRAY_THRESHOLD
+
+
+def is_sub_record(obj) -> bool:
+    """
+    是否将对象单独保存为一个子记录，子记录没有改变时不需要重新写入
+
+    目前每个 cowan 对象（例如运行历史中的每一项）单独保存
+
+    Args:
+        obj: 对象
+
+    Returns:
+        单独保存时返回 True
+    """
+    return isinstance(obj, Cowan)
+
+
+class RecordPickler(pickle.Pickler):
+    def __init__(self, file, store: 'ProjectStore', root, blobs: Set[str]):
+        """
+        保存记录的对象结构；数值数组、按列保存的表格（见 is_columnar_table）、子记录和溢出的 cowan 对象
+        单独保存为按内容寻址的文件，对象结构中只保存它们的哈希值
+
+        Args:
+            file: 写入对象结构的文件
+            store: 项目存储
+            root: 要保存的对象
+            blobs: 记录用到的所有文件的哈希值，保存过程中添加
+        """
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.store = store
+        self.root = root
+        self.blobs = blobs
+        self.pids: Dict[int, tuple] = {}  # id(对象) -> persistent id，同一个对象只保存一次
+        self.keep_alive: List[object] = []  # 保证 id 不被复用
+
+    def persistent_id(self, obj):
+        if obj is self.root:
+            return None
+        if type(obj) is np.ndarray:
+            if obj.dtype.hasobject or obj.nbytes < ARRAY_THRESHOLD:
+                return None
+            # 只读数组（实验光谱、网格数据等）读取时在所有记录之间共享，其余数组每次读取都是新的副本
+            kind = 'array' if obj.flags.writeable else 'frozen'
+        elif is_columnar_table(obj):
+            kind = 'table'
+        elif is_sub_record(obj):
+            kind = 'record'
+        elif type(obj) is SpilledCowan:
+            kind = 'spilled'
+        else:
+            return None
+        if id(obj) not in self.pids:
+            if kind == 'table':
+                digest = self.store.put_table(obj)
+            elif kind == 'spilled':
+                digest = self.store.put_spilled(obj)
+            elif kind == 'record':
+                digest = self.store.put_record(obj, self.blobs)
+            else:
+                digest = self.store.put_array(obj)
+            self.blobs.add(digest)
+            # 序号用于区分内容相同的不同对象
+            self.pids[id(obj)] = (kind, digest, len(self.pids))
+            self.keep_alive.append(obj)
+        return self.pids[id(obj)]
+
+
+class RecordUnpickler(pickle.Unpickler):
+    def __init__(self, file, store: 'ProjectStore'):
+        """
+        读取 RecordPickler 保存的对象
+
+        Args:
+            file: 对象结构的文件
+            store: 项目存储
+        """
+        super().__init__(file)
+        self.store = store
+        self.memo_objects: Dict[tuple, object] = {}
+
+    def persistent_load(self, pid):
+        if pid in self.memo_objects:
+            return self.memo_objects[pid]
+        kind, digest, _ = pid
+        if kind == 'array':
+            obj = self.store.read_array(digest)
+        elif kind == 'frozen':
+            obj = self.store.get_array(digest)
+        elif kind == 'table':
+            obj = self.store.read_table(digest)
+        elif kind == 'record':
+            obj = self.store.read_record(digest)
+        elif kind == 'spilled':
+            # 不读取文件，读回时再读取（见 CowanHistory.flush）
+            obj = SpilledCowan(self.store.get_blob_path(digest, '.spill'), digest)
+        else:
+            raise pickle.UnpicklingError(f'unknown persistent id {pid}')
+        self.memo_objects[pid] = obj
+        return obj
+
+
+class ProjectStore:
+    def __init__(self, path: Path, fallback: Optional['ProjectStore'] = None, codec: Optional[str] = DEFAULT_CODEC,
+                 level: Optional[int] = None):
+        """
+        项目存储，代替原来的 shelve 数据库
+
+        目录结构如下：
+            manifest.json          项目信息（info）、存储格式版本以及各个记录用到的文件
+            objects/<hash>.pkl     对象结构（不含大数组）
+            objects/<hash>.npy     数值数组（网格数据、实验光谱等）
+            objects/<hash>.npz     按列保存的数值表格（线状谱表格、展宽结果等），每列一个数组
+            objects/<hash>.spill   运行历史中溢出的 cowan 对象（见 CowanHistory），与溢出文件的内容相同
+        文件可以压缩（见 Compression），读取时根据文件头自动识别
+
+        文件按内容（压缩前）的哈希值命名，写入后不再修改：保存时只写入内容改变了的数组和对象结构，
+        最后替换 manifest 完成提交，再删除不再使用的文件；提交之前中断时，原来的 manifest 及其文件仍然完整。
+        每个 cowan 对象单独保存为一个子记录，修改其中一个时，运行历史中的其他 cowan 不需要重新写入
+
+        读取时与 shelve 相同，每次 store[name] 都会得到一个新的对象；只读的数组只读取一次并在所有记录之间共享，
+        可以修改的数组和表格每次读取都是新的副本，修改一个记录不会影响其他记录
+
+        Args:
+            path: 存储目录，一般为 <项目路径>/.cowan/store
+            fallback: 这个存储中没有的记录从 fallback 中读取（自动保存只保存已经读取过的记录）
+            codec: 写入文件时使用的压缩算法（见 CODECS），为 None 时不压缩；读取时自动识别
+            level: 压缩等级，为 None 时使用该算法的默认等级
+        """
+        self.path = Path(path)
+        self.fallback = fallback
+        self.codec = codec
+        self.level = level
+        self.stats = CompressionStats()  # 各个记录的压缩率与压缩、解压速度
+        self.member = ''  # 正在读取或保存的记录名，用于统计
+        self.manifest: Optional[dict] = None
+        self.overrides: Dict[str, object] = {}  # 通过 store[name] = obj 或 update 设置、还没有保存的记录
+        self.array_cache: Dict[str, np.ndarray] = {}  # 已经读取的只读数组，{哈希值: 数组}
+        self.written_bytes = 0  # 本次保存写入的字节数
+
+    def exists(self) -> bool:
+        return (self.path / 'manifest.json').exists()
+
+    def load_manifest(self) -> dict:
+        """
+        读取 manifest
+
+        Returns:
+            manifest
+        """
+        if self.manifest is None:
+            manifest = json.loads((self.path / 'manifest.json').read_text(encoding='utf-8'))
+            if manifest['schema'] != STORE_SCHEMA:
+                raise ValueError(f'project store schema {manifest["schema"]} is not supported')
+            self.manifest = manifest
+        return self.manifest
+
+    def get_saved_at(self) -> float:
+        """
+        获取保存的时间
+
+        Returns:
+            保存时的时间戳，不存在时返回 0
+        """
+        if not self.exists():
+            return 0
+        return self.load_manifest().get('saved_at', 0)
+
+    def keys(self) -> List[str]:
+        keys = ['info'] + list(self.load_manifest()['records'].keys())
+        if self.fallback is not None:
+            keys += [key for key in self.fallback.keys() if key not in keys]
+        return keys + [key for key in self.overrides.keys() if key not in keys]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.keys()
+
+    def __getitem__(self, name: str):
+        if name in self.overrides:
+            return self.overrides[name]
+        manifest = self.load_manifest()
+        if name == 'info':
+            return dict(manifest['info'])
+        if name not in manifest['records'] and self.fallback is not None:
+            return self.fallback[name]
+        record = manifest['records'][name]
+        if record is None:
+            return None
+        self.member = name
+        return self.read_record(record['root'])
+
+    def __setitem__(self, name: str, value):
+        self.overrides[name] = value
+
+    def update(self, values: dict):
+        self.overrides.update(values)
+
+    def close(self):
+        self.stats.log('load')
+        self.stats.clear()
+        self.overrides.clear()
+        self.array_cache.clear()
+        if self.fallback is not None:
+            self.fallback.close()
+
+    def get_blob_path(self, digest: str, suffix: str) -> Path:
+        return self.path / 'objects' / f'{digest}{suffix}'
+
+    def read_array(self, digest: str) -> np.ndarray:
+        """
+        读取一个数组
+
+        Args:
+            digest: 数组的哈希值
+
+        Returns:
+            新的数组
+        """
+        return np.load(io.BytesIO(self.read_blob(digest, '.npy')), allow_pickle=False)
+
+    def get_array(self, digest: str) -> np.ndarray:
+        """
+        读取一个只读数组，同一个数组只读取一次，所有记录共享
+
+        Args:
+            digest: 数组的哈希值
+
+        Returns:
+            只读的数组
+        """
+        if digest not in self.array_cache:
+            array = self.read_array(digest)
+            array.flags.writeable = False
+            self.array_cache[digest] = array
+        return self.array_cache[digest]
+
+    def read_table(self, digest: str) -> pd.DataFrame:
+        """
+        读取一个按列保存的表格（见 put_table）
+
+        Args:
+            digest: 表格的哈希值
+
+        Returns:
+            新的表格
+        """
+        with np.load(io.BytesIO(self.read_blob(digest, '.npz')), allow_pickle=False) as data:
+            if '__range__' in data.files:
+                index = pd.RangeIndex(*data['__range__'].tolist())
+            else:
+                index = pd.Index(data['__index__'])
+            columns = {name: data[f'c{i}'] for i, name in enumerate(data['__columns__'].tolist())}
+        return pd.DataFrame(columns, index=index, copy=False)
+
+    def read_record(self, digest: str):
+        """
+        读取一个对象结构（记录或子记录）
+
+        Args:
+            digest: 对象结构的哈希值
+
+        Returns:
+            对象
+        """
+        return RecordUnpickler(io.BytesIO(self.read_blob(digest, '.pkl')), self).load()
+
+    def read_blob(self, digest: str, suffix: str) -> bytes:
+        """
+        读取一个文件并解压
+
+        Args:
+            digest: 文件的哈希值
+            suffix: 文件后缀
+
+        Returns:
+            解压后的内容
+        """
+        data = self.get_blob_path(digest, suffix).read_bytes()
+        start = time.perf_counter()
+        raw = decode(data)
+        self.stats.add_decode(self.member, len(raw), time.perf_counter() - start)
+        return raw
+
+    def write_blob(self, digest: str, suffix: str, raw: bytes):
+        """
+        压缩并写入一个文件，内容相同的文件已经存在时不再写入
+
+        Args:
+            digest: 原始内容的哈希值
+            suffix: 文件后缀
+            raw: 原始内容
+
+        """
+        path = self.get_blob_path(digest, suffix)
+        if path.exists():
+            return
+        start = time.perf_counter()
+        data = encode(raw, self.codec, self.level)
+        self.stats.add_encode(self.member, len(raw), len(data), time.perf_counter() - start)
+        write_atomic(path, data)
+        self.written_bytes += len(data)
+
+    def put_array(self, array: np.ndarray) -> str:
+        """
+        保存一个数组，内容相同的数组已经存在时不再写入
+
+        Args:
+            array: 数组
+
+        Returns:
+            数组的哈希值
+        """
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f'{array.dtype.str}{array.shape}'.encode())
+        h.update(np.ascontiguousarray(array).data)
+        digest = h.hexdigest()
+        if not self.get_blob_path(digest, '.npy').exists():
+            buffer = io.BytesIO()
+            np.save(buffer, array, allow_pickle=False)
+            self.write_blob(digest, '.npy', buffer.getvalue())
+        return digest
+
+    def put_table(self, table: pd.DataFrame) -> str:
+        """
+        按列保存一个表格（见 is_columnar_table），每列一个数组，放在同一个 .npz 文件中；内容相同的表格已经存在时不再写入
+
+        Args:
+            table: 表格
+
+        Returns:
+            表格的哈希值
+        """
+        arrays = {'__columns__': np.array(list(table.columns), dtype=str)}
+        if isinstance(table.index, pd.RangeIndex):
+            arrays['__range__'] = np.array([table.index.start, table.index.stop, table.index.step], dtype=np.int64)
+        else:
+            arrays['__index__'] = np.ascontiguousarray(table.index.to_numpy())
+        for i in range(table.shape[1]):
+            arrays[f'c{i}'] = np.ascontiguousarray(table.iloc[:, i].to_numpy())
+        h = hashlib.blake2b(digest_size=20)
+        for key, array in arrays.items():
+            h.update(f'{key}{array.dtype.str}{array.shape}'.encode())
+            h.update(array.data)
+        digest = h.hexdigest()
+        if not self.get_blob_path(digest, '.npz').exists():
+            buffer = io.BytesIO()
+            np.savez(buffer, **arrays)
+            self.write_blob(digest, '.npz', buffer.getvalue())
+        return digest
+
+    def put_spilled(self, spilled: SpilledCowan) -> str:
+        """
+        保存一个溢出的 cowan 对象，按溢出文件的哈希值命名；已经存在时不读取溢出文件
+
+        Args:
+            spilled: 溢出的 cowan 对象
+
+        Returns:
+            溢出文件的哈希值
+        """
+        path = self.get_blob_path(spilled.digest, '.spill')
+        if not path.exists():
+            # 溢出文件已经压缩，直接写入
+            data = spilled.read_bytes()
+            write_atomic(path, data)
+            self.written_bytes += len(data)
+        return spilled.digest
+
+    def put_record(self, obj, blobs: Set[str]) -> str:
+        """
+        保存一个对象的结构，内容相同的对象结构已经存在时不再写入
+
+        Args:
+            obj: 对象
+            blobs: 记录用到的所有文件的哈希值
+
+        Returns:
+            对象结构的哈希值
+        """
+        buffer = io.BytesIO()
+        RecordPickler(buffer, self, obj, blobs).dump(obj)
+        digest = hashlib.blake2b(buffer.getbuffer(), digest_size=20).hexdigest()
+        self.write_blob(digest, '.pkl', buffer.getvalue())
+        return digest
+
+    def write_record(self, obj) -> dict:
+        """
+        保存一个记录
+
+        Args:
+            obj: 对象
+
+        Returns:
+            manifest 中这个记录的信息
+        """
+        blobs: Set[str] = set()
+        root = self.put_record(obj, blobs)
+        blobs.add(root)
+        return {'root': root, 'blobs': sorted(blobs)}
+
+    def save(self, records: Dict[str, object], info: dict, progress: Optional[Callable[[str], None]] = None):
+        """
+        保存所有记录，只写入改变了的内容
+
+        Args:
+            records: {记录名: 对象}
+            info: 项目信息，需要可以转换为 JSON
+            progress: 每开始保存一个记录调用一次 progress(记录名)
+
+        记录为 UNCHANGED 时不重新写入，沿用上次保存（或打开）时的文件
+        """
+        start = time.perf_counter()
+        self.written_bytes = 0
+        self.stats.clear()
+        (self.path / 'objects').mkdir(parents=True, exist_ok=True)
+        old_records = self.load_manifest()['records'] if self.exists() else {}
+        manifest = {'schema': STORE_SCHEMA, 'saved_at': time.time(), 'codec': self.codec, 'info': info, 'records': {}}
+        changed = []
+        for name, obj in records.items():
+            if progress is not None:
+                progress(name)
+            self.member = name
+            if obj is UNCHANGED:
+                if name not in self.overrides:
+                    manifest['records'][name] = old_records[name]
+                    continue
+                obj = self.overrides[name]
+            manifest['records'][name] = None if obj is None else self.write_record(obj)
+            if manifest['records'][name] != old_records.get(name):
+                changed.append(name)
+        # 提交
+        write_atomic(self.path / 'manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+        self.manifest = manifest
+        self.overrides.clear()
+        self.array_cache.clear()
+        removed = self.collect_garbage()
+        console_logger.info('project saved in {:.3f}s: changed {}, wrote {:.1f} MB, removed {} unused files'.format(
+            time.perf_counter() - start, changed or 'nothing', self.written_bytes / 1024 ** 2, removed))
+        self.stats.log('save')
+        self.stats.clear()
+
+    def collect_garbage(self) -> int:
+        """
+        删除 manifest 中没有用到的文件
+
+        Returns:
+            删除的文件个数
+        """
+        used = set()
+        for record in self.load_manifest()['records'].values():
+            if record is not None:
+                used.update(record['blobs'])
+        removed = 0
+        for path in (self.path / 'objects').iterdir():
+            if path.name.split('.')[0] not in used:
+                try:
+                    path.unlink()
+                    removed += 1
+                except OSError as e:
+                    console_logger.warning(f'can not remove {path}: {e}')
+        return removed
+
+
+class LazyRecord:
+    """
+    按需读取的项目记录，作为主窗口的类属性使用
+
+    打开项目时只把记录名加入 owner.pending_records，第一次访问该属性时才调用 owner.load_pending_record(name) 读取
+
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if self.name in obj.__dict__.get('pending_records', ()):
+            obj.load_pending_record(self.name)
+        return obj.__dict__.get(self.name)
+
+    def __set__(self, obj, value):
+        obj.__dict__.get('pending_records', set()).discard(self.name)
+        obj.__dict__[self.name] = value
+
+
+def write_atomic(path: Path, data: bytes):
+    """
+    先写入临时文件，再替换目标文件
+
+    Args:
+        path: 目标文件
+        data: 要写入的数据
+
+    """
+    temp_path = path.with_name(path.name + '.tmp')
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
@@ -2,14 +2,20 @@ import os
 import copy
 import functools
 from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
 
 import numpy as np
 from PySide6 import QtCore
 from PySide6.QtCore import Signal
 
-from .SimulateSpectral import SimulateSpectral
+from .SimulateSpectral import SimulateSpectral, SimulateResult
+from .SpectrumSimilarity import crop_and_interp, cal_peak_similarity, cal_prepared_similarity, \
+    cal_matrix_similarity, interp_to_prepared
 from .. import console_logger
 
+# 子进程中的模拟光谱模板，由 init_grid_worker 在进程启动时设置一次
+_WORKER_SIMULATE: Optional[SimulateSpectral] = None
+
 
 class SimulateGrid:
     def __init__(self, temperature, density, simulate: SimulateSpectral):
@@ -24,9 +30,10 @@ class SimulateGrid:
         super().__init__()
         self.task = 'cal'
         self.use_multiprocess = True
+        self.similarity_method = 'peak'  # 相似度的计算方法，见 SIMILARITY_METHODS
         self.update_exp = None
 
-        self.simulate = copy.deepcopy(simulate)
+        self.simulate = copy.deepcopy(simulate)  # 模板，所有网格点共享其实验数据与特征峰
         self.temperature_tuple = temperature
         self.density_tuple = density
         self.t_num: int = int(temperature[-1])
@@ -43,7 +50,7 @@ class SimulateGrid:
         self.t_list = ['{:.3f}'.format(v) for v in t_list]
         self.ne_list = ['{:.3e}'.format(v) for v in ne_list]
 
-        self.grid_data = {}
+        self.grid_data: Dict[Tuple[str, str], SimulateResult] = {}
 
     def change_task(self, task, *args):
         """
@@ -59,6 +66,62 @@ class SimulateGrid:
         if task == 'update':
             self.update_exp = args[0]
 
+    def get_simulate(self, temperature: str, density: str) -> SimulateSpectral:
+        """
+        获取某个网格点对应的模拟光谱对象
+
+        Args:
+            temperature: 温度（t_list 中的字符串）
+            density: 密度（ne_list 中的字符串）
+
+        Returns:
+            新的模拟光谱对象
+        """
+        simulate = copy.deepcopy(self.simulate)
+        simulate.del_cowan_list()
+        simulate.load_result(self.grid_data[(temperature, density)])
+        return simulate
+
+    def set_characteristic_peaks(self, characteristic_peaks):
+        """
+        设置所有网格点的特征峰
+
+        Args:
+            characteristic_peaks: 特征峰波长
+
+        """
+        self.simulate.characteristic_peaks = copy.deepcopy(characteristic_peaks)
+
+    def cal_similarity(self, exp_obj=None):
+        """
+        使用当前的计算方法重新计算所有网格点的相似度
+
+        Args:
+            exp_obj: 实验光谱对象，为 None 时使用网格原有的实验光谱
+
+        """
+        if exp_obj is not None:
+            self.simulate.exp_data = exp_obj
+        if not self.grid_data:
+            return
+        self.grid_data = cal_grid_similarity(
+            self.grid_data, self.simulate.exp_data, self.simulate.characteristic_peaks, self.similarity_method)
+
+    def __getstate__(self):
+        # 网格点的强度、相似度按温度、密度堆叠为数组保存，见 get_grid_columns
+        state = dict(self.__dict__)
+        columns = get_grid_columns(self.grid_data, self.t_list, self.ne_list)
+        if columns is not None:
+            del state['grid_data']
+            state['grid_columns'] = columns
+        return state
+
+    def __setstate__(self, state):
+        if 'grid_columns' in state:
+            state = dict(state)
+            state['grid_data'] = from_grid_columns(state.pop('grid_columns'))
+        self.__dict__.update(state)
+
     def load_class(self, class_info):
         self.task = class_info.task
         if class_info.update_exp is None:
@@ -69,6 +132,7 @@ class SimulateGrid:
             self.use_multiprocess = class_info.use_multiprocess
         else:
             self.use_multiprocess = True
+        self.similarity_method = class_info.similarity_method
         self.simulate.load_class(class_info.simulate)
         self.temperature_tuple = class_info.temperature_tuple
         self.density_tuple = class_info.density_tuple
@@ -81,6 +145,194 @@ class SimulateGrid:
         self.grid_data = class_info.grid_data
 
 
+def get_sim_matrix(grid_data: Dict[tuple, SimulateResult]):
+    """
+    将网格中所有的模拟光谱堆叠为一个二维数组，顺序与 grid_data 的键一致
+
+    Args:
+        grid_data: 网格数据
+
+    Returns:
+        (wavelength, intensity)，intensity 的形状为 (网格点个数, 波长点个数)
+        如果各网格点的波长不一致，则返回 (None, None)
+    """
+    if not grid_data:
+        return None, None
+    values = list(grid_data.values())
+    wavelength = values[0].wavelength
+    for value in values[1:]:
+        if not np.array_equal(value.wavelength, wavelength):
+            return None, None
+    intensity = np.vstack([value.intensity for value in values])
+    return wavelength, intensity
+
+
+def get_grid_columns(grid_data: Dict[Tuple[str, str], SimulateResult], t_list, ne_list) -> Optional[dict]:
+    """
+    将网格数据按列存储：所有网格点的强度堆叠为 (n_t, n_ne, n_grid) 的数组，相似度为 (n_t, n_ne) 的数组，
+    其余较小的字段按网格点保存；没有计算的网格点强度为 nan
+
+    Args:
+        grid_data: 网格数据
+        t_list: 温度列表
+        ne_list: 密度列表
+
+    Returns:
+        按列存储的网格数据，网格为空、各网格点的波长不一致或者键不在温度密度列表中时返回 None
+    """
+    wavelength, intensity = get_sim_matrix(grid_data)
+    if wavelength is None:
+        return None
+    t_index = {t: i for i, t in enumerate(t_list)}
+    ne_index = {ne: i for i, ne in enumerate(ne_list)}
+    if any(t not in t_index or ne not in ne_index for t, ne in grid_data.keys()):
+        return None
+    intensity_cube = np.full((len(t_list), len(ne_list), len(wavelength)), np.nan)
+    similarity = np.full((len(t_list), len(ne_list)), np.nan)
+    has_similarity = np.zeros((len(t_list), len(ne_list)), dtype=bool)
+    points = {}
+    for row, ((t, ne), value) in zip(intensity, grid_data.items()):
+        i, j = t_index[t], ne_index[ne]
+        intensity_cube[i, j] = row
+        if value.spectrum_similarity is not None:
+            similarity[i, j] = value.spectrum_similarity
+            has_similarity[i, j] = True
+        points[(t, ne)] = (i, j, value.temperature, value.electron_density, value.abundance, value.peaks_index,
+                           value.similarity_method)
+    for array in [intensity_cube, similarity, has_similarity]:
+        array.flags.writeable = False
+    return {
+        'wavelength': wavelength,
+        'intensity': intensity_cube,
+        'similarity': similarity,
+        'has_similarity': has_similarity,
+        'points': points,
+    }
+
+
+def from_grid_columns(columns: dict) -> Dict[Tuple[str, str], SimulateResult]:
+    """
+    由 get_grid_columns 的结果还原网格数据，各网格点的强度为堆叠数组的只读视图
+
+    Args:
+        columns: 按列存储的网格数据
+
+    Returns:
+        网格数据
+    """
+    wavelength = columns['wavelength']
+    intensity_cube = columns['intensity']
+    grid_data = {}
+    for key, (i, j, temperature, electron_density, abundance, peaks_index, method) in columns['points'].items():
+        intensity = intensity_cube[i, j]
+        intensity.flags.writeable = False
+        grid_data[key] = SimulateResult(
+            temperature=temperature,
+            electron_density=electron_density,
+            abundance=abundance,
+            wavelength=wavelength,
+            intensity=intensity,
+            spectrum_similarity=float(columns['similarity'][i, j]) if columns['has_similarity'][i, j] else None,
+            peaks_index=peaks_index,
+            similarity_method=method,
+        )
+    return grid_data
+
+
+def cal_grid_similarity(grid_data: Dict[tuple, SimulateResult], exp_obj, characteristic_peaks,
+                        method='peak') -> Dict[tuple, SimulateResult]:
+    """
+    计算网格中所有模拟光谱与实验光谱的相似度
+
+    所有网格点的模拟光谱只在实验波长上插值一次，然后直接在数组上计算相似度
+
+    Args:
+        grid_data: 网格数据
+        exp_obj: 实验光谱对象
+        characteristic_peaks: 特征峰波长
+        method: 相似度的计算方法，见 SIMILARITY_METHODS
+
+    Returns:
+        更新了相似度的网格数据
+    """
+    wavelength, intensity = get_sim_matrix(grid_data)
+    keys = list(grid_data.keys())
+    exp_data = exp_obj.data
+    exp_wavelength = exp_data['wavelength'].values
+    exp_intensity = exp_data['intensity'].values
+    if wavelength is None:
+        # 各网格点的波长不一致，逐个计算
+        console_logger.warning('grid spectra do not share wavelength, update similarity one by one.')
+        new_grid_data = {}
+        for key, value in grid_data.items():
+            x, y1, y2 = crop_and_interp(exp_wavelength, exp_intensity, value.wavelength, value.intensity)
+            if method == 'peak':
+                similarity, peaks_index = cal_peak_similarity(x, y1, y2, value.wavelength, characteristic_peaks)
+                peaks_index = value.peaks_index if peaks_index[0] is None else peaks_index[0]
+            else:
+                similarity, peaks_index = cal_matrix_similarity(method, y1, y2), value.peaks_index
+            new_grid_data[key] = value._replace(spectrum_similarity=float(similarity[0]), peaks_index=peaks_index,
+                                                similarity_method=method)
+        return new_grid_data
+
+    if method == 'peak':
+        result = cal_prepared_similarity(exp_obj.get_prepared(characteristic_peaks), wavelength, intensity)
+        if result is None:
+            # 模拟光谱没有覆盖实验光谱的波长范围，需要重新截取
+            x, y1, y2 = crop_and_interp(exp_wavelength, exp_intensity, wavelength, intensity)
+            result = cal_peak_similarity(x, y1, y2, wavelength, list(characteristic_peaks))
+        similarities, peaks_indexes = result
+    else:
+        prepared = exp_obj.get_prepared()
+        y1 = prepared.intensity
+        y2 = interp_to_prepared(prepared, wavelength, intensity)
+        if y2 is None:
+            # 模拟光谱没有覆盖实验光谱的波长范围，需要重新截取
+            _, y1, y2 = crop_and_interp(exp_wavelength, exp_intensity, wavelength, intensity)
+        similarities = cal_matrix_similarity(method, y1, y2)
+        peaks_indexes = [None] * len(keys)
+
+    new_grid_data = {}
+    for key, similarity, peaks_index in zip(keys, similarities, peaks_indexes):
+        value = grid_data[key]
+        if peaks_index is None:
+            peaks_index = value.peaks_index
+        new_grid_data[key] = value._replace(spectrum_similarity=float(similarity), peaks_index=peaks_index,
+                                            similarity_method=method)
+    return new_grid_data
+
+
+def init_grid_worker(simulate: SimulateSpectral):
+    """
+    子进程的初始化函数，模拟光谱模板（包括 cowan 对象）只传递一次
+
+    Args:
+        simulate: 模拟光谱模板
+
+    """
+    global _WORKER_SIMULATE
+    _WORKER_SIMULATE = simulate
+
+
+def simulate_grid_point(temperature: float, density: float,
+                        abundance: Optional[Dict[str, np.ndarray]] = None, with_similarity=True) -> SimulateResult:
+    """
+    在子进程中模拟一个网格点
+
+    Args:
+        temperature: 等离子体温度
+        density: 等离子体电子密度
+        abundance: 预先计算好的各元素离子丰度
+        with_similarity: 是否在该网格点上计算（峰值匹配法的）相似度
+
+    Returns:
+        计算结果
+    """
+    simulate = copy.deepcopy(_WORKER_SIMULATE)
+    simulate.set_temperature_and_density(temperature, density)
+    return simulate.simulate_spectral(abundance, with_similarity=with_similarity)
+
+
 class SimulateGridThread(QtCore.QThread):
     progress = Signal(str)  # 计数完成后发送一次信号
     end = Signal(str)  # 计数完成后发送一次信号
@@ -97,6 +349,7 @@ class SimulateGridThread(QtCore.QThread):
         self.old_grid = old_grid
         self.task = old_grid.task
         self.use_multiprocess = old_grid.use_multiprocess
+        self.similarity_method = old_grid.similarity_method
         self.update_exp = old_grid.update_exp
 
         self.simulate = copy.deepcopy(old_grid.simulate)
@@ -139,40 +392,49 @@ class SimulateGridThread(QtCore.QThread):
             """
             nonlocal current_progress
             current_progress += 1
-            simulate_: SimulateSpectral = f.result()
-            simulate_.del_cowan_list()
-            self.grid_data[(t, ne)] = simulate_
+            self.grid_data[(t, ne)] = f.result()
             self.progress.emit(str(int(current_progress / self.t_num / self.ne_num * 100)))
 
         self.grid_data = {}
         current_progress = 0
+        self.simulate.con_contribution = None  # 清空组态贡献
+        # 整个网格的离子丰度一次算出，各网格点只取对应的切片
+        abundance_cube = self.simulate.cal_abundance_cube(
+            [eval(v) for v in self.t_list], [eval(v) for v in self.ne_list])
+
+        def get_abundance(i, j):
+            return {element: cube[i, j] for element, cube in abundance_cube.items()}
+
+        # 峰值匹配法在各个网格点中计算相似度；其他方法不在网格点中计算，最后对整个网格统一计算
+        with_similarity = self.similarity_method == 'peak'
+
         if self.use_multiprocess:
             # 多线程
             console_logger.info('use multiprocess to simulate grid data.')
-            pool = ProcessPoolExecutor(os.cpu_count() - 1)
-            for temperature in self.t_list:
-                for density in self.ne_list:
-                    simulate = copy.deepcopy(self.simulate)
-                    simulate.set_temperature_and_density(eval(temperature), eval(density))
-                    simulate.con_contribution = None  # 清空组态贡献
-                    future = pool.submit(simulate.simulate_spectral)
+            pool = ProcessPoolExecutor(max(os.cpu_count() - 1, 1), initializer=init_grid_worker, initargs=(self.simulate,))
+            for i, temperature in enumerate(self.t_list):
+                for j, density in enumerate(self.ne_list):
+                    future = pool.submit(simulate_grid_point, eval(temperature), eval(density), get_abundance(i, j),
+                                         with_similarity)
                     future.add_done_callback(functools.partial(callback, temperature, density))
             pool.shutdown()
         else:
             # 单线程
             console_logger.info('use single process to simulate grid data.')
-            for temperature in self.t_list:
-                for density in self.ne_list:
+            for i, temperature in enumerate(self.t_list):
+                for j, density in enumerate(self.ne_list):
                     simulate = copy.deepcopy(self.simulate)
                     simulate.set_temperature_and_density(eval(temperature), eval(density))
-                    simulate.con_contribution = None  # 清空组态贡献
-                    simulate.simulate_spectral()
-                    simulate.del_cowan_list()
-                    self.grid_data[(temperature, density)] = simulate
+                    self.grid_data[(temperature, density)] = simulate.simulate_spectral(
+                        get_abundance(i, j), with_similarity=with_similarity)
 
                     current_progress += 1
                     self.progress.emit(str(int(current_progress / self.t_num / self.ne_num * 100)))
 
+        if not with_similarity:
+            self.grid_data = cal_grid_similarity(
+                self.grid_data, self.simulate.exp_data, self.simulate.characteristic_peaks, self.similarity_method)
+
         # 发送结束信号
         self.end.emit(0)
 
@@ -184,11 +446,8 @@ class SimulateGridThread(QtCore.QThread):
             exp_obj: 实验光谱对象
 
         """
-        for key, value in self.grid_data.items():
-            self.simulate = copy.deepcopy(value)
-            self.simulate.exp_data = copy.deepcopy(exp_obj)
-            self.simulate.cal_spectrum_similarity()
-            self.grid_data[key] = copy.deepcopy(self.simulate)
+        self.old_grid.cal_similarity(exp_obj)
+        self.grid_data = self.old_grid.grid_data
         self.up_end.emit(0)
 
     def update_origin(self):
@@ -197,3 +456,4 @@ class SimulateGridThread(QtCore.QThread):
 
         """
         self.old_grid.grid_data = self.grid_data
+        self.old_grid.simulate.del_cowan_list()  # 计算完成后模板不再需要 cowan 对象
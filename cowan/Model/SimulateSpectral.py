@@ -1,20 +1,143 @@
 import copy
-import warnings
-from typing import List, Optional, Dict
+import functools
+from typing import List, Optional, Dict, NamedTuple
 
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
 from plotly.offline import plot
-from scipy.interpolate import interp1d
-from scipy.signal import find_peaks
 
 from ..Tools import console_logger
-from .AtomInfo import OLD_IONIZATION_ENERGY, OUTER_ELECTRON_NUM
+from .Abundance import ABUNDANCE_ENGINE
+from .ContributionCache import CONTRIBUTION_CACHE, get_contribution_key
 from .CowanList import CowanList
 from .Cowan_ import Cowan
 from .ExpData import ExpData
 from .GlobalVar import PROJECT_PATH
+from .SpectrumSimilarity import crop_and_interp, cal_prepared_similarity, similarity_by_auto_peaks, \
+    similarity_by_characteristic_peaks
+
+
+class SimulateResult(NamedTuple):
+    """
+    模拟光谱的计算结果，只读，网格中的每个温度密度点保存一个
+
+    """
+    temperature: float  # 等离子体温度
+    electron_density: float  # 等离子体电子密度
+    abundance: Dict[str, np.ndarray]  # 离子丰度
+    wavelength: np.ndarray  # 模拟光谱的波长
+    intensity: np.ndarray  # 模拟光谱的强度
+    spectrum_similarity: Optional[float] = None  # 光谱相似度
+    peaks_index: Optional[list] = None  # 特征峰索引，用于画图
+    similarity_method: str = 'peak'  # 相似度的计算方法，见 SIMILARITY_METHODS
+
+
+def widen_ions(cowan_list: List[Cowan], temperature: float) -> tuple:
+    """
+    在某个温度下展宽所有离子（不修改共享的 cowan 对象），结果与丰度无关，可以被同一温度的多个模拟光谱共用
+
+    Args:
+        cowan_list: cowan 对象列表
+        temperature: 等离子体温度
+
+    Returns:
+        (wavelength, intensity)，intensity 的形状为 (离子个数, 波长点个数)
+    """
+    wavelength = None
+    intensity = []
+    for cowan in cowan_list:
+        widen_data = cowan.cal_data.widen_all.cal_widen_data(temperature, only_p=True)
+        if wavelength is None:
+            wavelength = widen_data['wavelength'].values
+        intensity.append(widen_data['cross_P'].values)
+    return wavelength, np.array(intensity)
+
+
+class IonContribution:
+    def __init__(self, ion_names: List[str], wavelength: np.ndarray, intensity: np.ndarray, weight: np.ndarray):
+        """
+        各个离子的贡献，所有离子共用同一个波长网格，强度按行连续存储
+
+        Args:
+            ion_names: 离子名称，与 intensity 的行一一对应
+            wavelength: 波长 (n_grid,)
+            intensity: 展宽后的强度（未考虑丰度） (n_ion, n_grid)
+            weight: 离子丰度 × 元素比例 (n_ion,)
+        """
+        self.ion_names = list(ion_names)
+        self.ion_index = {name: i for i, name in enumerate(self.ion_names)}  # 离子名称 -> 行号
+        self.wavelength = np.asarray(wavelength, dtype=float)
+        self.intensity = np.ascontiguousarray(intensity, dtype=float)
+        self.weight = np.asarray(weight, dtype=float)
+
+    def mix(self, add_or_not: List[bool]) -> np.ndarray:
+        """
+        将选中的离子按权重叠加
+
+        Args:
+            add_or_not: 每个离子是否被添加
+
+        Returns:
+            叠加后的强度 (n_grid,)
+        """
+        return (self.weight * np.asarray(add_or_not, dtype=float)) @ self.intensity
+
+    def get_intensity(self, ion_name: str, with_population=False) -> np.ndarray:
+        """
+        获取某个离子的贡献
+
+        Args:
+            ion_name: 离子名称
+            with_population: 是否考虑丰度
+
+        Returns:
+            强度 (n_grid,)
+        """
+        index = self.ion_index[ion_name]
+        if with_population:
+            return self.intensity[index] * self.weight[index]
+        return self.intensity[index]
+
+    def to_dataframes(self) -> Dict[str, pd.DataFrame]:
+        """
+        转换为 {离子名称: DataFrame} 的形式，用于导出
+
+        Returns:
+            每个 DataFrame 包含 wavelength、intensity、intensity_with_population 三列
+        """
+        return {
+            name: pd.DataFrame({
+                'wavelength': self.wavelength.copy(),
+                'intensity': self.get_intensity(name).copy(),
+                'intensity_with_population': self.get_intensity(name, with_population=True),
+            }) for name in self.ion_names
+        }
+
+    @classmethod
+    def from_dataframes(cls, contribution: Dict[str, pd.DataFrame]) -> 'IonContribution':
+        """
+        从旧版本的 {离子名称: DataFrame} 形式构造
+
+        Args:
+            contribution: 旧版本的离子贡献
+
+        Returns:
+            离子贡献对象
+        """
+        ion_names = list(contribution.keys())
+        wavelength = contribution[ion_names[0]]['wavelength'].values
+        intensity = np.array([contribution[name]['intensity'].values for name in ion_names], dtype=float)
+        weight = []
+        for name in ion_names:
+            # 旧版本只保存了乘过权重的强度，在此反算权重
+            value = contribution[name]
+            index = int(np.argmax(np.abs(value['intensity'].values)))
+            if value['intensity'].values[index] == 0:
+                weight.append(0.0)
+            else:
+                weight.append(value['intensity_with_population'].values[index] / value['intensity'].values[index])
+        return cls(ion_names, wavelength, intensity, np.array(weight))
 
 
 class SimulateSpectral:
@@ -27,6 +150,7 @@ class SimulateSpectral:
         self.add_or_not: Optional[List[bool]] = None  # cowan 对象是否被添加
         self.exp_data: Optional[ExpData] = None  # 实验光谱数据
         self.spectrum_similarity = None  # 光谱相似度
+        self.similarity_method = 'peak'  # 相似度的计算方法，见 SIMILARITY_METHODS，不同方法的数值不能相互比较
         self.temperature = None  # 模拟的等离子体温度
         self.electron_density = None  # 模拟的等离子体电子密度
 
@@ -37,7 +161,7 @@ class SimulateSpectral:
         self.abundance = {}  # 离子丰度
         self.sim_data = None  # 模拟光谱数据
 
-        self.ion_contribution = None  # 离子贡献
+        self.ion_contribution: Optional[IonContribution] = None  # 离子贡献
         self.con_contribution: Dict[str:Dict[str:List[pd.DataFrame, str]]] = None  # 组态贡献
 
         self.plot_path = PROJECT_PATH().joinpath('figure/add.html').as_posix()
@@ -54,8 +178,9 @@ class SimulateSpectral:
         temp_list = []
         for key in cowan_lists.chose_cowan:
             temp_list.append(cowan_lists.cowan_run_history[key])
-        self.cowan_list = copy.deepcopy(temp_list)
-        self.add_or_not = cowan_lists.add_or_not
+        # cowan 对象只读共享，不再复制
+        self.cowan_list = temp_list
+        self.add_or_not = copy.copy(cowan_lists.add_or_not)
         if not cowan_lists.is_multi_elemental():
             self.element_ratio = {self.cowan_list[0].in36.atom.symbol: 1.0}
         for key in cowan_lists.chose_cowan:
@@ -72,11 +197,6 @@ class SimulateSpectral:
         self.cowan_list = None
         self.add_or_not = None
 
-    def set_threading(self, threading: bool):
-        for cowan in self.cowan_list:
-            cowan: Cowan
-            cowan.cal_data.widen_all.set_threading(threading)
-
     def set_exp_obj(self, exp_obj: ExpData):
         """
         读取实验光谱数据
@@ -116,57 +236,36 @@ class SimulateSpectral:
         获取离子丰度
 
         """
+        abundance_element = {}
+        # 按元素计算丰度，同一元素只计算一次
+        for cowan in self.cowan_list:
+            element = cowan.in36.atom.symbol
+            if element in abundance_element:
+                continue
+            abundance_element[element] = ABUNDANCE_ENGINE.cal_abundance(
+                cowan.in36.atom.num, self.temperature, self.electron_density)
 
-        def calculate_a_over_S(a_ratios):
-            """
-            已知a1/a2, a2/a3, ..., a_n-1/a_n，计算a1/S, a2/S, ..., a_n/S，其中S=a1+a2+...+a_n
-
-            Args:
-                a_ratios: a1/a2, a2/a3, ..., a_n-1/a_n
-
-            Returns:
-                a1/S, a2/S, ..., a_n/S
-            """
-            a = np.zeros(len(a_ratios) + 1)
-            a[0] = 1
-            for i in range(1, len(a)):
-                a[i] = a[i - 1] * a_ratios[i - 1]
-
-            # 计算S
-            S_ = np.sum(a)
+        self.abundance = abundance_element
 
-            # 计算a1/S, a2/S, ..., a_n/S
-            a_over_S = a / S_
+    def cal_abundance_cube(self, temperature, electron_density) -> Dict[str, np.ndarray]:
+        """
+        一次计算多组温度、密度下各元素的离子丰度
 
-            return a_over_S
+        Args:
+            temperature: 等离子体温度 (n_T,)
+            electron_density: 等离子体电子密度 (n_ne,)
 
-        cowan_element = {}
-        # 按元素分类
+        Returns:
+            元素符号 -> 离子丰度，形状为 (n_T, n_ne, 原子序数 + 1)
+        """
+        abundance_cube = {}
         for cowan in self.cowan_list:
-            cowan_element[cowan.in36.atom.symbol] = cowan_element.get(cowan.in36.atom.symbol, []) + [cowan]
-
-        abundance_element = {}
-        # 计算每个元素的丰度
-        for element, cowan_list in cowan_element.items():
-            temperature = self.temperature
-            electron_density = self.electron_density
-
-            atom_nums = cowan_list[0].in36.atom.num
-            ion_num = np.array([k for k in range(atom_nums)])
-            ion_energy = np.array([OLD_IONIZATION_ENERGY[atom_nums][k] for k in range(atom_nums)])
-            electron_num = np.array([OUTER_ELECTRON_NUM[atom_nums][k] for k in range(atom_nums)])
-
-            S = (9 * 1e-6 * electron_num * np.sqrt(temperature / ion_energy) * np.exp(-ion_energy / temperature)) / (
-                    ion_energy ** 1.5 * (4.88 + temperature / ion_energy))
-            Ar = (5.2 * 1e-14 * np.sqrt(ion_energy / temperature) * ion_num * (
-                    0.429 + 0.5 * np.log(ion_energy / temperature) + 0.469 * np.sqrt(temperature / ion_energy)))
-            A3r = (2.97 * 1e-27 * electron_num / (temperature * ion_energy ** 2 * (4.88 + temperature / ion_energy)))
-            ratio = S / (Ar + electron_density * A3r)
-            abundance = calculate_a_over_S(ratio)
-
-            abundance_element[element] = abundance
-
-        self.abundance = abundance_element
+            element = cowan.in36.atom.symbol
+            if element in abundance_cube:
+                continue
+            abundance_cube[element] = ABUNDANCE_ENGINE.cal_abundance_cube(
+                cowan.in36.atom.num, temperature, electron_density)
+        return abundance_cube
 
     def set_xrange(self, x_range, num, cowan_lists: CowanList):
         self.exp_data.set_xrange(x_range)
@@ -174,9 +273,9 @@ class SimulateSpectral:
         if not flag:
             console_logger.error(f'{self.temperature} {self.electron_density} do not set element ratio')
             return
-        for cowan in self.cowan_list:
-            cowan.set_xrange(x_range, num)
+        # cowan 对象是共享的，其波长范围已经由 CowanList 设置，这里只需要重新计算
         if self.temperature is not None and self.electron_density is not None:
+            self.cal_ion_contribution()
             self.cal_simulate_data()
 
     def reset_xrange(self, cowan_lists: CowanList):
@@ -185,44 +284,37 @@ class SimulateSpectral:
         if not flag:
             console_logger.error(f'{self.temperature} {self.electron_density} do not set element ratio')
             return
-        for cowan in self.cowan_list:
-            cowan.reset_xrange()
+        # cowan 对象是共享的，其波长范围已经由 CowanList 重置，这里只需要重新计算
         if self.temperature is not None and self.electron_density is not None:
+            self.cal_ion_contribution()
             self.cal_simulate_data()
 
-    def cal_ion_contribution(self):
-        def choose_abundance():
-            """
-            将所需要的离子丰度挑选出来
-            """
-            all_abundance = self.abundance
-            temp_abundance = []
-            for c in self.cowan_list:
-                element = c.in36.atom.symbol
-                element_abundance = all_abundance[element]
-                ion = int(c.name.split('_')[1])
-                temp_abundance.append(element_abundance[ion])
-            return temp_abundance
+    def cal_ion_contribution(self, widen_data: Optional[tuple] = None):
+        """
+        计算每个离子的贡献，展宽结果按行存入同一个数组
 
-        temp_contribution = {}
-        current_abundance = choose_abundance()
+        Args:
+            widen_data: 已经在这个温度下展宽好的 (wavelength, intensity)，见 widen_ions；为 None 时重新展宽
 
+        """
+        if widen_data is None:
+            widen_data = widen_ions(self.cowan_list, self.temperature)
+        wavelength, intensity = widen_data
+        weight = np.zeros(len(self.cowan_list))
         for i, cowan in enumerate(self.cowan_list):
             cowan: Cowan
-            cowan.cal_data.set_temperature(self.temperature)
-            cowan.cal_data.widen_all.widen()  # 使用这个温度重新展宽
-            widen_data = cowan.cal_data.widen_all.get_widen_data()  # 获取展宽后的数据
-            # 开始获取每个离子的贡献
-            temp_data = pd.DataFrame({
-                'wavelength': widen_data['wavelength'].values,
-                'intensity': widen_data['cross_P'].values,
-                'intensity_with_population': widen_data['cross_P'].values * current_abundance[i] * self.element_ratio[
-                    cowan.in36.atom.symbol]
-            })
-            temp_contribution[cowan.name] = temp_data
-        self.ion_contribution = temp_contribution
+            # 权重为离子丰度 × 元素比例
+            element = cowan.in36.atom.symbol
+            ion = int(cowan.name.split('_')[1])
+            weight[i] = self.abundance[element][ion] * self.element_ratio[element]
+        self.ion_contribution = IonContribution(
+            [cowan.name for cowan in self.cowan_list], wavelength, intensity, weight)
 
     def cal_con_contribution(self):
+        """
+        计算每个离子各个组态的贡献，结果来自共享缓存，只保存引用
+
+        """
         temp_contribution = {}
         # 结构如下
         # {
@@ -231,37 +323,143 @@ class SimulateSpectral:
         # }
         for i, cowan in enumerate(self.cowan_list):
             cowan: Cowan
-            temp_con_dict = {}
-            cowan.cal_data.set_temperature(self.temperature)
-            cowan.cal_data.widen_part.widen_by_group()
-            grouped_widen_data = cowan.cal_data.widen_part.get_grouped_widen_data()  # 获取展宽后的数据
-            for con_key, con_value in grouped_widen_data.items():
-                index_low, index_high = map(int, con_key.split('_'))
-                temp_con_dict[con_key] = [con_value, cowan.in36.get_configuration_name(index_low, index_high)]
-            temp_contribution[cowan.name] = temp_con_dict
+            key = get_contribution_key(cowan.name, self.temperature, cowan.cal_data.widen_part)
+            temp_contribution[cowan.name] = CONTRIBUTION_CACHE.get(
+                key, functools.partial(self.__cal_con_contribution, cowan, self.temperature))
         self.con_contribution = temp_contribution
 
-    def cal_simulate_data(self):
+    @staticmethod
+    def __cal_con_contribution(cowan: Cowan, temperature: float) -> Dict[str, List]:
+        """
+        计算一个离子各个组态的贡献
+
+        Args:
+            cowan: cowan 对象
+            temperature: 等离子体温度
+
+        Returns:
+            {'con_key': [con_data, 'con_name']}
+        """
+        temp_con_dict = {}
+        # 获取展宽后的数据（不修改共享的 cowan 对象）
+        grouped_widen_data = cowan.cal_data.widen_part.cal_grouped_widen_data(temperature)
+        for con_key, con_value in grouped_widen_data.items():
+            index_low, index_high = map(int, con_key.split('_'))
+            temp_con_dict[con_key] = [con_value, cowan.in36.get_configuration_name(index_low, index_high)]
+        return temp_con_dict
+
+    def cal_simulate_data(self, with_similarity=True):
+        """
+        按照 add_or_not 叠加离子贡献得到模拟光谱，不需要重新展宽
+
+        Args:
+            with_similarity: 是否计算（峰值匹配法的）光谱相似度；为 False 时相似度与特征峰索引清空，
+                由调用者统一计算（例如网格使用其他相似度方法时）
+
+        """
         res = pd.DataFrame()
-        res['wavelength'] = list(self.ion_contribution.values())[0]['wavelength']
-        temp = np.zeros_like(res['wavelength'].values)
-        for cowan, flag in zip(self.cowan_list, self.add_or_not):
-            if flag:
-                temp += self.ion_contribution[cowan.name]['intensity_with_population'].values
-        res['intensity'] = temp
+        res['wavelength'] = self.ion_contribution.wavelength
+        res['intensity'] = self.ion_contribution.mix(self.add_or_not)
         if res['intensity'].max() == 0.0:
             res['intensity_normalization'] = copy.deepcopy(res['intensity'])
         else:
             res['intensity_normalization'] = res['intensity'] / res['intensity'].max()
 
         self.sim_data = res
-        self.cal_spectrum_similarity()
+        if with_similarity:
+            self.cal_spectrum_similarity()
+        else:
+            self.spectrum_similarity = None
+            self.peaks_index = []
+
+    def update_add_or_not(self, cowan_lists: CowanList) -> bool:
+        """
+        离子选择改变时，直接用已有的离子贡献重新叠加
+
+        Args:
+            cowan_lists: cowan 对象列表
+
+        Returns:
+            是否更新成功，离子贡献不存在或 cowan 对象已经改变时返回 False
+        """
+        if self.ion_contribution is None or self.cowan_list is None:
+            return False
+        # cowan 对象是共享的，重新计算过的离子会被替换为新的对象
+        chose_cowan = [cowan_lists.cowan_run_history[key] for key in cowan_lists.chose_cowan]
+        if len(chose_cowan) != len(self.cowan_list) or any(a is not b for a, b in zip(chose_cowan, self.cowan_list)):
+            return False
+        self.add_or_not = copy.copy(cowan_lists.add_or_not)
+        self.cal_simulate_data()
+        return True
+
+    def simulate_spectral(self, abundance: Optional[Dict[str, np.ndarray]] = None,
+                          widen_data: Optional[tuple] = None, with_similarity=True) -> SimulateResult:
+        """
+        模拟光谱
 
-    def simulate_spectral(self):
-        self.cal_abundance()  # 计算丰度
-        self.cal_ion_contribution()  # 计算离子贡献
-        self.cal_simulate_data()  # 计算模拟光谱数据
-        return copy.deepcopy(self)
+        Args:
+            abundance: 预先计算好的各元素离子丰度，为 None 时重新计算
+            widen_data: 预先在这个温度下展宽好的 (wavelength, intensity)，为 None 时重新展宽
+            with_similarity: 是否计算光谱相似度，见 cal_simulate_data
+
+        Returns:
+            只读的计算结果
+        """
+        if abundance is None:
+            self.cal_abundance()  # 计算丰度
+        else:
+            self.abundance = dict(abundance)
+        self.cal_ion_contribution(widen_data)  # 计算离子贡献
+        self.cal_simulate_data(with_similarity)  # 计算模拟光谱数据
+        return self.get_result()
+
+    def get_result(self) -> SimulateResult:
+        """
+        获取只读的计算结果
+
+        Returns:
+            计算结果，其中的数组均为只读
+        """
+        wavelength = np.array(self.sim_data['wavelength'].values, dtype=float)
+        intensity = np.array(self.sim_data['intensity'].values, dtype=float)
+        abundance = {key: np.array(value) for key, value in self.abundance.items()}
+        for array in [wavelength, intensity, *abundance.values()]:
+            array.flags.writeable = False
+        return SimulateResult(
+            temperature=self.temperature,
+            electron_density=self.electron_density,
+            abundance=abundance,
+            wavelength=wavelength,
+            intensity=intensity,
+            spectrum_similarity=self.spectrum_similarity,
+            peaks_index=copy.deepcopy(self.peaks_index),
+            similarity_method=self.similarity_method,
+        )
+
+    def load_result(self, result: SimulateResult):
+        """
+        从计算结果恢复温度、密度、丰度、模拟光谱以及相似度；计算结果中没有离子贡献和组态贡献，恢复后均为 None
+
+        Args:
+            result: 计算结果
+
+        """
+        self.temperature = result.temperature
+        self.electron_density = result.electron_density
+        self.abundance = {key: np.array(value) for key, value in result.abundance.items()}
+        res = pd.DataFrame()
+        res['wavelength'] = np.array(result.wavelength)
+        res['intensity'] = np.array(result.intensity)
+        if res['intensity'].max() == 0.0:
+            res['intensity_normalization'] = copy.deepcopy(res['intensity'])
+        else:
+            res['intensity_normalization'] = res['intensity'] / res['intensity'].max()
+        self.sim_data = res
+        self.spectrum_similarity = result.spectrum_similarity
+        self.similarity_method = result.similarity_method
+        self.peaks_index = copy.deepcopy(result.peaks_index) if result.peaks_index is not None else []
+        self.ion_contribution = None
+        self.con_contribution = None
 
     def plot_html(self, show_point=False):
         """
@@ -279,7 +477,7 @@ class SimulateSpectral:
         trace2 = go.Scatter(
             x=x2, y=y2, mode='lines', line={'color': 'rgb(237, 78, 64)'}, name='模拟光谱'
         )
-        if show_point:
+        if show_point and self.peaks_index:
             exp_points_x = [x1.tolist()[index_] for index_ in self.peaks_index[0]]
             exp_points_y = [y1.tolist()[index_] for index_ in self.peaks_index[0]]
             cal_points_x = [x2.tolist()[index_] for index_ in self.peaks_index[1]]
@@ -319,12 +517,12 @@ class SimulateSpectral:
         """
         height = 0
         trace = []
-        for i, (ion_name, value) in enumerate(self.ion_contribution.items()):
+        x = self.ion_contribution.wavelength
+        for i, ion_name in enumerate(self.ion_contribution.ion_names):
             if not add_list[i][0]:
                 continue
-            x = value['wavelength']
             if with_popular:  # 如果考虑丰度
-                y = value['intensity_with_population']
+                y = self.ion_contribution.get_intensity(ion_name, with_population=True)
                 trace.append(
                     go.Scatter(
                         x=x,
@@ -335,7 +533,7 @@ class SimulateSpectral:
                     )
                 )
             else:  # 不考虑丰度
-                y = value['intensity']
+                y = self.ion_contribution.get_intensity(ion_name)
                 trace.append(
                     go.Scatter(
                         x=x,
@@ -403,9 +601,20 @@ class SimulateSpectral:
 
     def cal_spectrum_similarity(self):
         """
-        获取光谱相似度，直接存储在 self.spectrum_similarity 中
+        获取光谱相似度（峰值匹配），直接存储在 self.spectrum_similarity 中
 
         """
+        self.similarity_method = 'peak'
+        # 优先使用实验数据缓存的预处理结果
+        prepared = self.exp_data.get_prepared(self.characteristic_peaks)
+        result = cal_prepared_similarity(
+            prepared, self.sim_data['wavelength'].values, self.sim_data['intensity'].values)
+        if result is not None:
+            similarity, peaks_index = result
+            self.spectrum_similarity = float(similarity[0])
+            if peaks_index[0] is not None:
+                self.peaks_index = peaks_index[0]
+            return
         if len(self.characteristic_peaks) < 2:  # 如果特征峰个数小于2，就直调用自动相似度计算函数
             self.spectrum_similarity = self.spectrum_similarity1(
                 self.exp_data.data[['wavelength', 'intensity']],
@@ -422,46 +631,15 @@ class SimulateSpectral:
         自动峰值匹配法
 
         Args:
-            fax:
-            fbx:
+            fax: 实验数据
+            fbx: 计算数据
 
         """
         x, y1, y2 = self.get_y1y2(fax, fbx)
-        peaks1, _ = find_peaks(y1)
-        peaks2, _ = find_peaks(y2)
-        if len(peaks2) < 5:
-            warnings.warn('计算得到的峰值个数 < 5, 相似度返回 -1')
-            return -1
-        d = {}
-        for index in peaks2:
-            d[index] = y2[index]
-        peaks2 = sorted(d.items(), key=lambda item: item[1], reverse=True)
-        peaks2 = list(zip(*peaks2[:5]))[0]
-        temp_peaks = []
-        for index in peaks2:
-            min_index, temp = -1, abs(index - peaks1[0])
-            for i, index_1 in enumerate(peaks1[1:]):
-                if temp > abs(index - index_1):
-                    temp = abs(index - index_1)
-                    min_index = i + 1
-            temp_peaks.append(peaks1[min_index])
-        peaks1 = temp_peaks
-
-        new_peaks2 = []
-        for index in peaks2:
-            temp_index = np.argmin(np.abs(x[index] - self.sim_data['wavelength'].values))
-            new_peaks2.append(temp_index)
-        self.peaks_index = [peaks1, new_peaks2]
-
-        similarity = 0
-        for i in range(len(peaks1) - 1):
-            for j in range(i + 1, len(peaks1)):
-                similarity += abs(
-                    y1[peaks1[i]] / y1[peaks1[j]] - y2[peaks2[i]] / y2[peaks2[j]]
-                )
-        if similarity > len(peaks1):
-            similarity = len(peaks1)
-        return similarity
+        similarity, peaks_index = similarity_by_auto_peaks(x, y1, y2[None, :], self.sim_data['wavelength'].values)
+        if peaks_index[0] is not None:
+            self.peaks_index = peaks_index[0]
+        return float(similarity[0])
 
     def spectrum_similarity2(self, fax: pd.DataFrame, fbx: pd.DataFrame):
         """
@@ -471,69 +649,22 @@ class SimulateSpectral:
             fbx: 计算数据
 
         """
-        # 拿到一维的数据
         x, y1, y2 = self.get_y1y2(fax, fbx)
-        # 找出模拟光谱的峰值位置
-        peaks2, _ = find_peaks(y2)
-        # 指出模拟光谱谱峰对应的波长
-        peaks2_wavelength = np.array([x[index] for index in peaks2])
-        # 将给定的特征峰的强度与模拟光谱特征峰的强度进行比较
-        exp_wavelength_indexes = []  # 用来存放实验谱峰的索引值
-        cal_wavelength_indexes = []  # 用来存放计算谱峰的索引值
-        for wavelength in self.characteristic_peaks:
-            exp_index = np.argmin(abs(x - wavelength))
-            # min_index: wavelength 所对应的峰在 peaks2 中的索引
-            # temp: wavelength 所对应的峰与 peaks2 中最近的峰的距离
-            min_index, temp = 0, abs(wavelength - peaks2_wavelength[0])
-            for i, index_1 in enumerate(peaks2_wavelength[1:]):
-                if temp > abs(wavelength - index_1):
-                    temp = abs(wavelength - index_1)
-                    min_index = i + 1
-            exp_wavelength_indexes.append(exp_index)
-            cal_wavelength_indexes.append(peaks2[min_index])
-        # 如果对应谱峰太远，就直接赋值
-        for i in range(len(exp_wavelength_indexes)):
-            if abs(exp_wavelength_indexes[i] - cal_wavelength_indexes[i]) > (len(x)) * 0.01:
-                cal_wavelength_indexes[i] = exp_wavelength_indexes[i]
-
-        new_cal_wavelength_indexes = []
-        for index in cal_wavelength_indexes:
-            temp_index = np.argmin(np.abs(x[index] - self.sim_data['wavelength'].values))
-            new_cal_wavelength_indexes.append(temp_index)
-        self.peaks_index = [exp_wavelength_indexes, new_cal_wavelength_indexes]
-
-        # 计算两个光谱数据峰值位置以及强度的相似性
-        similarity = 0
-        for i in range(len(exp_wavelength_indexes) - 1):
-            for j in range(i + 1, len(exp_wavelength_indexes)):
-                similarity += abs(
-                    y1[exp_wavelength_indexes[i]] / y1[exp_wavelength_indexes[j]]
-                    - y2[cal_wavelength_indexes[i]] / y2[cal_wavelength_indexes[j]]
-                )
-        if similarity > len(exp_wavelength_indexes) * 3:
-            similarity = len(exp_wavelength_indexes) * 3
-        return similarity
+        similarity, peaks_index = similarity_by_characteristic_peaks(
+            x, y1, y2[None, :], self.sim_data['wavelength'].values, self.characteristic_peaks)
+        self.peaks_index = peaks_index[0]
+        return float(similarity[0])
 
     @staticmethod
     def get_y1y2(fax: pd.DataFrame, fbx: pd.DataFrame, min_x=None, max_x=None):
         col_names_a = fax.columns
         col_names_b = fbx.columns
-        if (min_x is None) and (max_x is None):
-            min_x = max(fax[col_names_a[0]].min(), fbx[col_names_b[0]].min())
-            max_x = min(fax[col_names_a[0]].max(), fbx[col_names_b[0]].max())
-        fax_new = fax[(fax[col_names_a[0]] <= max_x) & (min_x <= fax[col_names_a[0]])]
-        fbx_new = fbx[(fbx[col_names_b[0]] <= max_x) & (min_x <= fbx[col_names_b[0]])]
-        f2 = interp1d(
-            fbx_new[col_names_b[0]], fbx_new[col_names_b[1]], fill_value='extrapolate'
+        x, y1, y2 = crop_and_interp(
+            fax[col_names_a[0]].values, fax[col_names_a[1]].values,
+            fbx[col_names_b[0]].values, fbx[col_names_b[1]].values,
+            min_x, max_x,
         )
-        x = fax_new[col_names_a[0]].values
-        y1 = fax_new[col_names_a[1]].values
-        y2 = f2(x)
-        if max(y1) != 0.0:
-            y1 = y1 / max(y1)
-        if max(y2) != 0.0:
-            y2 = y2 / max(y2)
-        return x, y1, y2
+        return x, y1, y2[0]
 
     def get_temperature_and_density(self) -> tuple:
         return self.temperature, self.electron_density
@@ -545,14 +676,40 @@ class SimulateSpectral:
         return self.sim_data.__deepcopy__()
 
     def get_ion_contribution(self) -> {str: pd.DataFrame}:
-        return copy.deepcopy(self.ion_contribution)
+        if self.ion_contribution is None:
+            return None
+        return self.ion_contribution.to_dataframes()
 
     def get_con_contribution(self) -> {str: {str: [pd.DataFrame, str]}}:
-        return copy.deepcopy(self.con_contribution)
+        # 组态贡献由多个对象共享，只读，不再复制
+        return self.con_contribution
+
+    def has_contribution(self) -> bool:
+        """
+        是否有离子贡献和组态贡献（由网格结果恢复的光谱只有模拟光谱，没有贡献）
+
+        """
+        return self.ion_contribution is not None and self.con_contribution is not None
 
     def get_abundance(self) -> dict:
         return copy.deepcopy(self.abundance)
 
+    def __deepcopy__(self, memo):
+        """
+        深拷贝时 cowan_list 中的 cowan 对象以及组态贡献只读共享，不再复制
+
+        """
+        new_obj = self.__class__.__new__(self.__class__)
+        memo[id(self)] = new_obj
+        for key, value in self.__dict__.items():
+            if key == 'cowan_list':
+                new_obj.cowan_list = copy.copy(value)
+            elif key == 'con_contribution':
+                new_obj.con_contribution = copy.copy(value)
+            else:
+                setattr(new_obj, key, copy.deepcopy(value, memo))
+        return new_obj
+
     def load_class(self, class_info):
         if class_info.cowan_list is None:
             self.cowan_list = None
@@ -565,6 +722,7 @@ class SimulateSpectral:
         else:
             self.exp_data.load_class(class_info.exp_data)
         self.spectrum_similarity = class_info.spectrum_similarity
+        self.similarity_method = class_info.similarity_method
         self.temperature = class_info.temperature
         self.electron_density = class_info.electron_density
 
@@ -1,15 +1,120 @@
 import copy
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import plotly.graph_objs as go
 from plotly.offline import plot
 
 from .GlobalVar import PROJECT_PATH
-from .SimulateSpectral import SimulateSpectral
+from .SimulateSpectral import SimulateSpectral, SimulateResult
 from .CowanList import CowanList
 
 
+def to_number(value: str) -> float:
+    """
+    将时间、位置字符串转换为数字，无法转换时返回 nan
+
+    Args:
+        value: 时间或位置的字符串
+
+    Returns:
+        对应的数字
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+class SpaceTimeIndex:
+    def __init__(self, keys: List[tuple]):
+        """
+        时空分辨光谱的数值索引，只在增删光谱时重建
+
+        按时间排序、按位置排序各保存一份下标，按时间或位置切片时只需要二分查找；
+        各个光谱的温度、密度、相似度保存为数组，诊断或重新模拟后通过 set_values 逐个更新，画图时直接切片
+
+        Args:
+            keys: 时空分辨光谱的键，顺序与 simulate_spectral_dict 一致
+        """
+        self.keys = list(keys)  # 插入顺序（与界面表格一致）
+        self.lookup: Dict[tuple, int] = {key: i for i, key in enumerate(self.keys)}  # 键 -> 在 keys 中的下标
+        self.time = np.array([to_number(key[0]) for key in self.keys], dtype=float).reshape(-1)
+        self.xyz = np.array([[to_number(v) for v in key[1]] for key in self.keys], dtype=float).reshape(-1, 3)
+
+        # 位置编号，相同的 (x, y, z) 编号相同，编号按位置排序
+        self.locations, self.location_id = np.unique(self.xyz, axis=0, return_inverse=True)
+        self.location_id = self.location_id.reshape(-1)
+        self.times = np.unique(self.time)
+
+        # 按 (时间, 位置) 排序的下标，以及按 (位置, 时间) 排序的下标
+        self.order_by_time = np.lexsort((self.location_id, self.time))
+        self.order_by_location = np.lexsort((self.time, self.location_id))
+        self.sorted_time = self.time[self.order_by_time]
+        self.sorted_location_id = self.location_id[self.order_by_location]
+
+        # 温度、密度、相似度，没有诊断的为 nan
+        self.temperature = np.full(len(self.keys), np.nan)
+        self.electron_density = np.full(len(self.keys), np.nan)
+        self.similarity = np.full(len(self.keys), np.nan)
+
+    def set_values(self, key: tuple, temperature: Optional[float], electron_density: Optional[float],
+                   similarity: Optional[float]):
+        """
+        更新一个光谱的温度、密度、相似度
+
+        Args:
+            key: 时空分辨光谱的键
+            temperature: 温度，为 None 时记为 nan
+            electron_density: 密度，为 None 时记为 nan
+            similarity: 相似度，为 None 时记为 nan
+
+        """
+        i = self.lookup[key]
+        self.temperature[i] = np.nan if temperature is None else temperature
+        self.electron_density[i] = np.nan if electron_density is None else electron_density
+        self.similarity[i] = np.nan if similarity is None else similarity
+
+    def select_by_time(self, time: float) -> np.ndarray:
+        """
+        获取某个时间的所有光谱，按位置排序
+
+        Args:
+            time: 时间
+
+        Returns:
+            光谱在 keys 中的下标
+        """
+        lo = np.searchsorted(self.sorted_time, time, side='left')
+        hi = np.searchsorted(self.sorted_time, time, side='right')
+        return self.order_by_time[lo:hi]
+
+    def select_by_location(self, location) -> np.ndarray:
+        """
+        获取某个位置的所有光谱，按时间排序
+
+        Args:
+            location: 位置 (x, y, z)
+
+        Returns:
+            光谱在 keys 中的下标
+        """
+        location = np.asarray(location, dtype=float)
+        # 位置编号按位置排序，因此也可以二分查找
+        i = np.searchsorted(self.locations[:, 0], location[0], side='left')
+        location_id = None
+        while i < len(self.locations) and self.locations[i, 0] == location[0]:
+            if np.array_equal(self.locations[i], location):
+                location_id = i
+                break
+            i += 1
+        if location_id is None:
+            return np.array([], dtype=int)
+        lo = np.searchsorted(self.sorted_location_id, location_id, side='left')
+        hi = np.searchsorted(self.sorted_location_id, location_id, side='right')
+        return self.order_by_location[lo:hi]
+
+
 class SpaceTimeResolution:
     def __init__(self):
         """
@@ -17,34 +122,118 @@ class SpaceTimeResolution:
         """
         # 模拟光谱数据对象 列表
         self.simulate_spectral_dict: List[str:SimulateSpectral] = {}
+        self.index: Optional[SpaceTimeIndex] = None  # 数值索引，增删光谱后置为 None，使用时重建
 
         self.change_by_time_path = (PROJECT_PATH().joinpath('figure/change/by_time.html').as_posix())
         self.change_by_location_path = (PROJECT_PATH().joinpath('figure/change/by_location.html').as_posix())
         self.change_by_space_time_path = (PROJECT_PATH().joinpath('figure/change/by_space_time.html').as_posix())
 
-    def add_st(self, st: tuple, simulate_spectral):
+    def add_st(self, st: tuple, simulate_spectral, copy_obj=True):
         """
         添加一个位置时间的是按分辨光谱
 
         Args:
             st: 时间位置，格式为 (t，(x, y, z)) 类型为字符串
             simulate_spectral: 模拟光谱数据对象
+            copy_obj: 是否复制模拟光谱对象，新建的对象（例如批量导入时）不需要复制
 
         """
-        temp = copy.deepcopy(simulate_spectral)
+        temp = copy.deepcopy(simulate_spectral) if copy_obj else simulate_spectral
         temp.del_cowan_list()
-        self.simulate_spectral_dict[st] = temp
+        if st in self.simulate_spectral_dict:
+            # 覆盖已有的光谱时顺序不变，只更新索引中的数值
+            self.simulate_spectral_dict[st] = temp
+            self.update_values(st)
+        else:
+            self.simulate_spectral_dict[st] = temp
+            self.index = None
 
     def del_st(self, st):
         self.simulate_spectral_dict.pop(st)
+        self.index = None
+
+    def get_index(self) -> SpaceTimeIndex:
+        """
+        获取数值索引，不存在时重建
+
+        Returns:
+            数值索引
+        """
+        if self.index is None or len(self.index.keys) != len(self.simulate_spectral_dict):
+            self.index = SpaceTimeIndex(list(self.simulate_spectral_dict.keys()))
+            for key, sim in self.simulate_spectral_dict.items():
+                self.index.set_values(key, sim.temperature, sim.electron_density, sim.spectrum_similarity)
+        return self.index
+
+    def update_values(self, st: Optional[tuple] = None):
+        """
+        光谱的温度、密度或相似度改变后（诊断、重新模拟），更新索引中的数值；索引还没有建立时不需要更新
+
+        Args:
+            st: 时间位置，为 None 时更新全部
+
+        """
+        if self.index is None:
+            return
+        for key in (self.index.keys if st is None else [st]):
+            sim = self.simulate_spectral_dict[key]
+            self.index.set_values(key, sim.temperature, sim.electron_density, sim.spectrum_similarity)
+
+    def get_values(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        获取所有光谱的温度、密度、相似度，顺序与索引中的 keys 一致，没有诊断的为 nan
+
+        直接返回索引中的数组（只读，不要修改）
+
+        Returns:
+            (temperature, electron_density, similarity)
+        """
+        index = self.get_index()
+        return index.temperature, index.electron_density, index.similarity
+
+    def set_diagnosis(self, st: tuple, result: SimulateResult):
+        """
+        写入诊断结果（温度、密度、相似度以及对应的模拟光谱）
+
+        Args:
+            st: 时间位置
+            result: 最相似的网格点的计算结果
+
+        """
+        self.simulate_spectral_dict[st].load_result(result)
+        self.update_values(st)
+
+    def get_sequences(self, by='time') -> List[List[tuple]]:
+        """
+        将时空分辨光谱分为若干个序列，用于顺序诊断
+
+        Args:
+            by: 'time' 时，同一位置的光谱为一个序列，按时间排序；
+                'location' 时，同一时间的光谱为一个序列，按位置排序
+
+        Returns:
+            [[key1, key2, ...], ...]
+        """
+
+        index = self.get_index()
+        if by == 'time':
+            # 按 (位置, 时间) 排序后，在位置编号变化处分割
+            order, group = index.order_by_location, index.sorted_location_id
+        else:
+            # 按 (时间, 位置) 排序后，在时间变化处分割
+            order, group = index.order_by_time, index.sorted_time
+        splits = np.nonzero(group[1:] != group[:-1])[0] + 1
+        return [[index.keys[i] for i in part] for part in np.split(order, splits) if len(part)]
 
     def set_xrange(self, x_range, num, cowan_lists: CowanList):
         for key, sim in self.simulate_spectral_dict.items():
             sim.set_xrange(x_range, num, cowan_lists)
+        self.update_values()
 
     def reset_xrange(self, cowan_lists: CowanList):
         for key, sim in self.simulate_spectral_dict.items():
             sim.reset_xrange(cowan_lists)
+        self.update_values()
 
     def plot_change_by_time(self, location: Tuple[str, str, str]):
         """
@@ -54,16 +243,12 @@ class SpaceTimeResolution:
             location: 位置
 
         """
-        times = []
-        for key, value in self.simulate_spectral_dict.items():
-            if key[1] == location:
-                times.append(eval(key[0]))
-        times = sorted(times)
-        temperature = []
-        electron_density = []
-        for time in times:
-            temperature.append(self.simulate_spectral_dict[(str(time), location)].temperature)
-            electron_density.append(self.simulate_spectral_dict[(str(time), location)].electron_density)
+        index = self.get_index()
+        temperature, electron_density, _ = self.get_values()
+        select = index.select_by_location([to_number(v) for v in location])
+        times = index.time[select]
+        temperature = temperature[select]
+        electron_density = electron_density[select]
 
         trace1 = go.Scatter(x=times, y=temperature, mode='lines')
         trace2 = go.Scatter(x=times, y=electron_density, mode='lines', yaxis='y2')
@@ -84,24 +269,15 @@ class SpaceTimeResolution:
             time: 时间
 
         """
-        x_s = []
-        for key, value in self.simulate_spectral_dict.items():
-            if key[0] == time:
-                x_s.append(eval(key[1][0]))
-        x_s = sorted(x_s)
-
-        temperature = {}
-        electron_density = {}
-
-        for x in x_s:
-            temperature[(x, 0, 0)] = self.simulate_spectral_dict[(time, (str(x), '0', '0'))].temperature
-            electron_density[(x, 0, 0)] = self.simulate_spectral_dict[(time, (str(x), '0', '0'))].electron_density
-
-        def fun(xx, yy=0, zz=0):
-            return temperature[(xx, yy, zz)], electron_density[(xx, yy, zz)]
-
-        trace1 = go.Scatter(x=x_s, y=[fun(v)[0] for v in x_s], mode='lines')
-        trace2 = go.Scatter(x=x_s, y=[fun(v)[1] for v in x_s], mode='lines', yaxis='y2')
+        index = self.get_index()
+        temperature, electron_density, _ = self.get_values()
+        select = index.select_by_time(to_number(time))
+        # 只画 y=0, z=0 的位置
+        select = select[(index.xyz[select, 1] == 0) & (index.xyz[select, 2] == 0)]
+        x_s = index.xyz[select, 0]
+
+        trace1 = go.Scatter(x=x_s, y=temperature[select], mode='lines')
+        trace2 = go.Scatter(x=x_s, y=electron_density[select], mode='lines', yaxis='y2')
         data = [trace1, trace2]
         layout = go.Layout(
             margin=go.layout.Margin(autoexpand=True, b=15, l=30, r=0, t=0),
@@ -119,35 +295,16 @@ class SpaceTimeResolution:
             var_index: 选择是温度还是时间 0：温度 1：密度
 
         """
-        spaces = []
-        times = []
-        for key in self.simulate_spectral_dict:
-            if key[0] not in times:
-                times.append(key[0])
-            if key[1][0] not in spaces:
-                spaces.append(key[1][0])
-        spaces = sorted(spaces, key=lambda x: eval(x))
-        times = sorted(times, key=lambda x: eval(x))
-        t_res = []
-        d_res = []
-        for time in times:
-            temp_t_res = []
-            temp_d_res = []
-            for space in spaces:
-                if (time, (space, '0', '0')) not in self.simulate_spectral_dict:
-                    temp_t_res.append(None)
-                    temp_d_res.append(None)
-                    continue
-                temp_t_res.append(
-                    self.simulate_spectral_dict[(time, (space, '0', '0'))].temperature
-                )
-                temp_d_res.append(np.log10(  # 指数坐标
-                    self.simulate_spectral_dict[
-                        (time, (space, '0', '0'))
-                    ].electron_density
-                ))
-            t_res.append(temp_t_res)
-            d_res.append(temp_d_res)
+        index = self.get_index()
+        temperature, electron_density, _ = self.get_values()
+        # 只画 y=0, z=0 的位置
+        select = np.nonzero((index.xyz[:, 1] == 0) & (index.xyz[:, 2] == 0))[0]
+        spaces, space_id = np.unique(index.xyz[select, 0], return_inverse=True)
+        times, time_id = np.unique(index.time[select], return_inverse=True)
+        t_res = np.full((len(times), len(spaces)), np.nan)
+        d_res = np.full((len(times), len(spaces)), np.nan)
+        t_res[time_id, space_id] = temperature[select]
+        d_res[time_id, space_id] = np.log10(electron_density[select])  # 指数坐标
 
         if var_index == 0:
             trace1 = go.Heatmap(x=spaces, y=times, z=t_res)
@@ -178,12 +335,14 @@ class SpaceTimeResolution:
             value: SimulateSpectral
             if value.get_temperature_and_density() == (None, None):
                 continue
-            temp_list.append([copy.deepcopy(key), copy.deepcopy(value)])
-        return temp_list[index]
+            temp_list.append(key)
+        # 只复制需要的那一个
+        key = temp_list[index]
+        return [copy.deepcopy(key), copy.deepcopy(self.simulate_spectral_dict[key])]
 
     def __getitem__(self, index) -> Tuple[str, SimulateSpectral]:
-        return (list(self.simulate_spectral_dict.keys())[index],
-                list(self.simulate_spectral_dict.values())[index])
+        key = self.get_index().keys[index]
+        return key, self.simulate_spectral_dict[key]
 
     def __iter__(self):
         return iter(self.simulate_spectral_dict.items())
@@ -192,6 +351,7 @@ class SpaceTimeResolution:
         for (ok, ov), (nk, nv) in zip(self.simulate_spectral_dict.items(), class_info.simulate_spectral_dict.items()):
             ov.load_class(nv)
             self.simulate_spectral_dict[nk] = ov
+        self.index = None
 
         self.change_by_time_path = (PROJECT_PATH().joinpath('figure/change/by_time.html').as_posix())
         self.change_by_location_path = (PROJECT_PATH().joinpath('figure/change/by_location.html').as_posix())
@@ -0,0 +1,127 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from PySide6 import QtCore
+from PySide6.QtCore import Signal
+
+from .CowanList import CowanList
+from .Cowan_ import Cowan
+from .SimulateSpectral import widen_ions
+from .SpaceTimeResolution import SpaceTimeResolution
+from .. import console_logger
+
+# 子进程中共享的 cowan 对象，由 init_update_worker 在进程启动时设置一次
+_WORKER_COWAN_LIST: Optional[List[Cowan]] = None
+
+
+def init_update_worker(cowan_list: List[Cowan]):
+    """
+    子进程的初始化函数，cowan 对象（谱线数据）只传递一次，之后只读使用
+
+    Args:
+        cowan_list: cowan 对象列表
+
+    """
+    global _WORKER_COWAN_LIST
+    _WORKER_COWAN_LIST = cowan_list
+
+
+def widen_in_worker(temperature: float) -> tuple:
+    """
+    在子进程中展宽某个温度下的所有离子
+
+    Args:
+        temperature: 等离子体温度
+
+    Returns:
+        (temperature, (wavelength, intensity))
+    """
+    return temperature, widen_ions(_WORKER_COWAN_LIST, temperature)
+
+
+class SpaceTimeUpdateThread(QtCore.QThread):
+    progress = Signal(str)  # 每更新完一个光谱发送一次信号
+    end = Signal(str)  # 全部更新完成（或取消）后发送一次信号
+
+    def __init__(self, space_time_resolution: SpaceTimeResolution, cowan_lists: CowanList, use_multiprocess=True):
+        """
+        cowan 对象改变后，重新模拟所有已经诊断的时空分辨光谱
+
+        温度相同的光谱共用同一份展宽结果，因此每个 (离子, 温度) 只展宽一次
+
+        Args:
+            space_time_resolution: 时空分辨光谱
+            cowan_lists: cowan 对象列表
+            use_multiprocess: 是否使用多进程展宽
+        """
+        super().__init__()
+        self.space_time_resolution = space_time_resolution
+        self.cowan_lists = cowan_lists
+        self.use_multiprocess = use_multiprocess
+        self.cowan_list = [cowan_lists.cowan_run_history[key] for key in cowan_lists.chose_cowan]
+
+        # 按温度分组
+        self.groups: Dict[float, List[tuple]] = {}
+        for key, sim in space_time_resolution:
+            if sim.temperature is None or sim.electron_density is None:
+                continue
+            self.groups.setdefault(sim.temperature, []).append(key)
+        self.task_num = sum(len(keys) for keys in self.groups.values())
+        self.updated: List[tuple] = []  # 已经更新的光谱
+        self.failed: List[tuple] = []  # 没有设置元素比例的光谱
+        self.canceled = False
+
+    def run(self):
+        """
+        多线程运行的主函数
+
+        """
+        start = time.perf_counter()
+        if self.use_multiprocess and len(self.groups) > 1:
+            console_logger.info('use multiprocess to update space time resolution.')
+            pool = ProcessPoolExecutor(max(os.cpu_count() - 1, 1), initializer=init_update_worker,
+                                       initargs=(self.cowan_list,))
+            futures = [pool.submit(widen_in_worker, temperature) for temperature in self.groups.keys()]
+            for future in as_completed(futures):
+                if self.isInterruptionRequested():
+                    break
+                self.update_group(*future.result())
+            pool.shutdown(cancel_futures=True)
+        else:
+            console_logger.info('use single process to update space time resolution.')
+            for temperature in self.groups.keys():
+                if self.isInterruptionRequested():
+                    break
+                self.update_group(temperature, widen_ions(self.cowan_list, temperature))
+        self.canceled = self.isInterruptionRequested()
+        console_logger.info('updated {}/{} spectra at {} temperatures in {:.3f}s{}'.format(
+            len(self.updated), self.task_num, len(self.groups), time.perf_counter() - start,
+            ' (canceled)' if self.canceled else ''))
+
+        # 发送结束信号
+        self.end.emit(0)
+
+    def update_group(self, temperature: float, widen_data: tuple):
+        """
+        用同一份展宽结果重新模拟某个温度下的所有光谱
+
+        Args:
+            temperature: 等离子体温度
+            widen_data: 这个温度下的展宽结果
+
+        """
+        for key in self.groups[temperature]:
+            if self.isInterruptionRequested():
+                return
+            sim = self.space_time_resolution.simulate_spectral_dict[key]
+            if sim.init_cowan_list(self.cowan_lists):
+                sim.simulate_spectral(widen_data=widen_data)
+                self.space_time_resolution.update_values(key)
+                self.updated.append(key)
+            else:
+                console_logger.error(f'{key} do not set element ratio')
+                self.failed.append(key)
+            sim.del_cowan_list()
+            self.progress.emit(str(int((len(self.updated) + len(self.failed)) / self.task_num * 100)))
@@ -0,0 +1,447 @@
+import warnings
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from scipy.signal import find_peaks
+
+# 相似度的计算方法：名称 -> (显示名称, 是否越大越相似)，顺序与界面中下拉框的顺序一致
+SIMILARITY_METHODS = {
+    'peak': ('峰值匹配', False),
+    'cosine': ('余弦相似度', True),
+    'chi2': ('归一化卡方', False),
+    'pearson': ('皮尔逊相关系数', True),
+}
+
+
+def interp_rows(x_new: np.ndarray, x_old: np.ndarray, y_old: np.ndarray) -> np.ndarray:
+    """
+    线性插值（允许外推），一次处理多条共享横坐标的光谱
+
+    计算方式与 scipy.interpolate.interp1d(fill_value='extrapolate') 完全一致
+
+    Args:
+        x_new: 新的横坐标，形状为 (m,)
+        x_old: 原始横坐标，形状为 (n,)，所有光谱共享
+        y_old: 原始纵坐标，形状为 (k, n)
+
+    Returns:
+        插值后的纵坐标，形状为 (k, m)
+    """
+    x_old = np.asarray(x_old, dtype=float)
+    y_old = np.atleast_2d(np.asarray(y_old, dtype=float))
+    if np.any(x_old[1:] < x_old[:-1]):
+        index = np.argsort(x_old, kind='mergesort')
+        x_old = x_old[index]
+        y_old = y_old[:, index]
+    # 重复的波长会使相邻两点的间距为 0，只保留每个波长第一次出现的点
+    if np.any(x_old[1:] == x_old[:-1]):
+        x_old, index = np.unique(x_old, return_index=True)
+        y_old = y_old[:, index]
+    hi = np.searchsorted(x_old, x_new).clip(1, len(x_old) - 1)
+    lo = hi - 1
+    x_lo = x_old[lo]
+    x_hi = x_old[hi]
+    y_lo = y_old[:, lo]
+    y_hi = y_old[:, hi]
+    slope = (y_hi - y_lo) / (x_hi - x_lo)
+    return slope * (x_new - x_lo) + y_lo
+
+
+def normalize_rows(y: np.ndarray) -> np.ndarray:
+    """
+    按行除以最大值进行归一化，最大值为 0 的行保持不变
+
+    Args:
+        y: 形状为 (k, n) 的数组
+
+    Returns:
+        归一化后的数组
+    """
+    y_max = y.max(axis=1, keepdims=True)
+    return np.divide(y, y_max, out=y.copy(), where=y_max != 0.0)
+
+
+def crop_and_interp(exp_wavelength: np.ndarray, exp_intensity: np.ndarray,
+                    sim_wavelength: np.ndarray, sim_intensity: np.ndarray,
+                    min_x=None, max_x=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    截取实验光谱与模拟光谱的公共波长范围，将模拟光谱插值到实验光谱的波长上，并分别归一化
+
+    Args:
+        exp_wavelength: 实验光谱的波长 (m,)
+        exp_intensity: 实验光谱的强度 (m,)
+        sim_wavelength: 模拟光谱的波长 (n,)，所有模拟光谱共享
+        sim_intensity: 模拟光谱的强度 (n,) 或 (k, n)
+        min_x: 公共范围的最小值，为 None 时自动计算
+        max_x: 公共范围的最大值，为 None 时自动计算
+
+    Returns:
+        x (m',), y1 (m',), y2 (k, m')
+    """
+    sim_intensity = np.atleast_2d(sim_intensity)
+    if (min_x is None) and (max_x is None):
+        min_x = max(exp_wavelength.min(), sim_wavelength.min())
+        max_x = min(exp_wavelength.max(), sim_wavelength.max())
+    exp_flag = (exp_wavelength <= max_x) & (min_x <= exp_wavelength)
+    sim_flag = (sim_wavelength <= max_x) & (min_x <= sim_wavelength)
+    x = exp_wavelength[exp_flag]
+    y1 = exp_intensity[exp_flag]
+    y2 = interp_rows(x, sim_wavelength[sim_flag], sim_intensity[:, sim_flag])
+    if y1.max() != 0.0:
+        y1 = y1 / y1.max()
+    y2 = normalize_rows(y2)
+    return x, y1, y2
+
+
+class PreparedExperiment(NamedTuple):
+    """
+    预处理后的实验光谱，只与实验数据和特征峰有关，所有模拟光谱共享同一份
+
+    其中的数组均为只读
+    """
+    wavelength: np.ndarray  # 实验光谱的波长
+    intensity: np.ndarray  # 归一化后的实验光谱强度
+    peaks: np.ndarray  # 实验光谱的峰的索引
+    characteristic_peaks: Tuple[float, ...]  # 特征峰波长
+    characteristic_index: np.ndarray  # 特征峰在实验光谱中最近的点的索引
+
+
+def prepare_experiment(exp_wavelength: np.ndarray, exp_intensity: np.ndarray,
+                       characteristic_peaks=()) -> PreparedExperiment:
+    """
+    对实验光谱进行预处理：归一化、寻峰、定位特征峰
+
+    Args:
+        exp_wavelength: 实验光谱的波长
+        exp_intensity: 实验光谱的强度
+        characteristic_peaks: 特征峰波长
+
+    Returns:
+        预处理后的实验光谱
+    """
+    x = np.array(exp_wavelength, dtype=float)
+    y1 = np.array(exp_intensity, dtype=float)
+    if y1.max() != 0.0:
+        y1 = y1 / y1.max()
+    peaks, _ = find_peaks(y1)
+    characteristic_peaks = tuple(characteristic_peaks)
+    characteristic_index = nearest_index(x, np.array(characteristic_peaks, dtype=float))
+    for array in [x, y1, peaks, characteristic_index]:
+        array.flags.writeable = False
+    return PreparedExperiment(x, y1, peaks, characteristic_peaks, characteristic_index)
+
+
+def interp_to_prepared(prepared: PreparedExperiment, sim_wavelength: np.ndarray,
+                       sim_intensity: np.ndarray) -> Optional[np.ndarray]:
+    """
+    将模拟光谱插值到预处理后的实验光谱的波长上并归一化
+
+    只有当模拟光谱的波长范围覆盖实验光谱时，截取结果才与实验光谱无关，否则返回 None，
+    需要调用 crop_and_interp 重新截取
+
+    Args:
+        prepared: 预处理后的实验光谱
+        sim_wavelength: 模拟光谱的波长 (n,)
+        sim_intensity: 模拟光谱的强度 (k, n)
+
+    Returns:
+        插值后的模拟光谱 (k, m)，或者 None
+    """
+    x = prepared.wavelength
+    if len(x) == 0 or sim_wavelength.min() > x.min() or sim_wavelength.max() < x.max():
+        return None
+    sim_intensity = np.atleast_2d(sim_intensity)
+    sim_flag = (sim_wavelength <= x.max()) & (x.min() <= sim_wavelength)
+    return normalize_rows(interp_rows(x, sim_wavelength[sim_flag], sim_intensity[:, sim_flag]))
+
+
+def cal_prepared_similarity(prepared: PreparedExperiment, sim_wavelength: np.ndarray, sim_intensity: np.ndarray):
+    """
+    使用预处理后的实验光谱计算相似度，省去实验光谱一侧的截取、归一化和寻峰
+
+    Args:
+        prepared: 预处理后的实验光谱
+        sim_wavelength: 模拟光谱的波长 (n,)
+        sim_intensity: 模拟光谱的强度 (k, n)
+
+    Returns:
+        每条模拟光谱的相似度与峰的索引，模拟光谱没有覆盖实验光谱的波长范围时返回 None
+    """
+    x = prepared.wavelength
+    y2 = interp_to_prepared(prepared, sim_wavelength, sim_intensity)
+    if y2 is None:
+        return None
+    if len(prepared.characteristic_peaks) < 2:
+        return similarity_by_auto_peaks(x, prepared.intensity, y2, sim_wavelength, prepared.peaks)
+    else:
+        return similarity_by_characteristic_peaks(
+            x, prepared.intensity, y2, sim_wavelength, list(prepared.characteristic_peaks),
+            prepared.characteristic_index)
+
+
+def find_peaks_rows(y: np.ndarray) -> np.ndarray:
+    """
+    逐行寻找局部极大值，结果与不带参数的 scipy.signal.find_peaks 完全一致（平台取中点）
+
+    Args:
+        y: 形状为 (k, n) 的数组
+
+    Returns:
+        形状为 (k, n) 的布尔数组，峰所在的位置为 True
+    """
+    k, n = y.shape
+    is_peak = np.zeros((k, n), dtype=bool)
+    if n < 3:
+        return is_peak
+    d = np.diff(y, axis=1)  # (k, n - 1)
+    # 每个位置之后（含）第一个不为 0 的差分的位置，不存在时为 n - 1
+    index = np.where(d != 0, np.arange(n - 1), n - 1)
+    next_change = np.minimum.accumulate(index[:, ::-1], axis=1)[:, ::-1]
+    # 上升沿：y[i - 1] < y[i]，1 <= i <= n - 2
+    rows, left = np.nonzero(d[:, :n - 2] > 0)
+    left = left + 1
+    right = next_change[rows, left]
+    flag = right < n - 1
+    rows, left, right = rows[flag], left[flag], right[flag]
+    flag = d[rows, right] < 0  # 平台之后是下降沿
+    is_peak[rows[flag], (left[flag] + right[flag]) // 2] = True
+    return is_peak
+
+
+def nearest_index(a: np.ndarray, v) -> np.ndarray:
+    """
+    查找 a 中与 v 最近的元素的索引，距离相同时取靠前的索引，与 np.argmin(np.abs(v - a)) 的结果一致
+
+    a 为升序时使用二分查找，否则退化为逐个比较
+
+    Args:
+        a: 被查找的数组 (n,)
+        v: 要查找的值 (m,)
+
+    Returns:
+        索引 (m,)
+    """
+    v = np.asarray(v, dtype=float)
+    if len(a) == 1:
+        return np.zeros(v.shape, dtype=int)
+    if np.any(a[1:] < a[:-1]):
+        return np.argmin(np.abs(v[..., None] - a), axis=-1)
+    right = np.searchsorted(a, v).clip(1, len(a) - 1)
+    left = np.searchsorted(a, a[right - 1])  # 有重复值时取第一个
+    return np.where(np.abs(v - a[left]) <= np.abs(v - a[right]), left, right)
+
+
+def pairwise_ratio_distance(r1: np.ndarray, r2: np.ndarray) -> np.ndarray:
+    """
+    比较两组峰强的两两之比：sum_{i<j} |r1_i / r1_j - r2_i / r2_j|
+
+    按 (0,1), (0,2), ..., (n-2,n-1) 的顺序依次累加，与逐对循环的结果完全一致
+
+    Args:
+        r1: 实验峰强 (k, n)
+        r2: 模拟峰强 (k, n)
+
+    Returns:
+        (k,)
+    """
+    i, j = np.triu_indices(r1.shape[1], 1)
+    ratio1 = r1[:, :, None] / r1[:, None, :]
+    ratio2 = r2[:, :, None] / r2[:, None, :]
+    values = np.abs(ratio1[:, i, j] - ratio2[:, i, j])
+    if values.shape[1] == 0:
+        return np.zeros(r1.shape[0])
+    return np.cumsum(values, axis=1)[:, -1]
+
+
+def similarity_by_auto_peaks(x: np.ndarray, y1: np.ndarray, y2: np.ndarray,
+                             sim_wavelength: np.ndarray,
+                             peaks1: Optional[np.ndarray] = None) -> Tuple[np.ndarray, List[Optional[List[List[int]]]]]:
+    """
+    自动峰值匹配法
+
+    取每条模拟光谱最强的 5 个峰，分别匹配实验光谱中最近的峰，比较两两峰强之比
+
+    Args:
+        x: 公共波长 (m,)
+        y1: 归一化后的实验光谱 (m,)
+        y2: 归一化后的模拟光谱 (k, m)
+        sim_wavelength: 模拟光谱原始的波长，用于画图时定位峰的位置
+        peaks1: 实验光谱的峰的索引，为 None 时自动计算
+
+    Returns:
+        每条模拟光谱的相似度 (k,) 以及峰的索引 [实验峰索引, 模拟峰索引]，峰的个数不足时为 -1 和 None
+    """
+    k = y2.shape[0]
+    similarity = np.full(k, -1.0)
+    peaks_index = [None] * k
+
+    if peaks1 is None:
+        peaks1, _ = find_peaks(y1)
+    is_peak = find_peaks_rows(y2)
+    valid = is_peak.sum(axis=1) >= 5
+    if not valid.all():
+        warnings.warn('计算得到的峰值个数 < 5, 相似度返回 -1')
+    if len(peaks1) == 0:
+        warnings.warn('实验光谱中没有峰, 相似度返回 -1')
+        return similarity, peaks_index
+    rows = np.nonzero(valid)[0]
+    if len(rows) == 0:
+        return similarity, peaks_index
+
+    # 模拟光谱最强的 5 个峰（强度相同时保持原有顺序）
+    values = np.where(is_peak[rows], y2[rows], -np.inf)
+    peaks2 = np.argsort(-values, axis=1, kind='stable')[:, :5]
+    # 实验光谱中与之最近的峰，最近的是第一个峰时取最后一个峰（保持原有算法的结果）
+    matched = nearest_index(peaks1, peaks2)
+    matched[matched == 0] = len(peaks1) - 1
+    matched_peaks1 = peaks1[matched]
+    new_peaks2 = nearest_index(sim_wavelength, x[peaks2])
+
+    temp = pairwise_ratio_distance(y1[matched_peaks1], np.take_along_axis(y2[rows], peaks2, axis=1))
+    similarity[rows] = np.minimum(temp, 5)
+    for n, row in enumerate(rows):
+        peaks_index[row] = [matched_peaks1[n].tolist(), new_peaks2[n].tolist()]
+    return similarity, peaks_index
+
+
+def similarity_by_characteristic_peaks(x: np.ndarray, y1: np.ndarray, y2: np.ndarray,
+                                       sim_wavelength: np.ndarray,
+                                       characteristic_peaks: List[float],
+                                       exp_index: Optional[np.ndarray] = None) -> Tuple[np.ndarray, List[List[List[int]]]]:
+    """
+    指定峰值匹配法，自动匹配实验谱线的峰
+
+    Args:
+        x: 公共波长 (m,)
+        y1: 归一化后的实验光谱 (m,)
+        y2: 归一化后的模拟光谱 (k, m)
+        sim_wavelength: 模拟光谱原始的波长，用于画图时定位峰的位置
+        characteristic_peaks: 特征峰波长
+        exp_index: 特征峰在实验光谱中最近的点的索引，为 None 时自动计算
+
+    Returns:
+        每条模拟光谱的相似度 (k,) 以及峰的索引 [实验峰索引, 模拟峰索引]
+    """
+    k, m = y2.shape
+    peaks = np.asarray(characteristic_peaks, dtype=float)
+    # 实验光谱中与特征峰最近的点
+    if exp_index is None:
+        exp_index = nearest_index(x, peaks)
+    # 每条模拟光谱中与特征峰最近的峰
+    is_peak = find_peaks_rows(y2)
+    if not is_peak.any(axis=1).all():
+        warnings.warn('模拟光谱中没有峰, 相似度返回 -1')
+    if np.any(x[1:] < x[:-1]):
+        distance = np.where(is_peak[:, None, :], np.abs(peaks[:, None] - x), np.inf)
+        cal_index = np.argmin(distance, axis=2)
+    else:
+        index = np.arange(m)
+        prev_peak = np.maximum.accumulate(np.where(is_peak, index, -1), axis=1)
+        next_peak = np.minimum.accumulate(np.where(is_peak, index, m)[:, ::-1], axis=1)[:, ::-1]
+        pos = np.searchsorted(x, peaks)
+        left = np.where(pos > 0, prev_peak[:, (pos - 1).clip(0)], -1)
+        right = np.where(pos < m, next_peak[:, pos.clip(0, m - 1)], m)
+        d_left = np.where(left >= 0, np.abs(peaks - x[left.clip(0)]), np.inf)
+        d_right = np.where(right < m, np.abs(peaks - x[right.clip(0, m - 1)]), np.inf)
+        cal_index = np.where(d_left <= d_right, left, right).clip(0, m - 1)
+    # 如果对应谱峰太远，就直接赋值
+    exp_index = np.broadcast_to(exp_index, cal_index.shape)
+    cal_index = np.where(np.abs(exp_index - cal_index) > m * 0.01, exp_index, cal_index)
+    new_cal_index = nearest_index(sim_wavelength, x[cal_index])
+
+    # 计算两个光谱数据峰值位置以及强度的相似性
+    temp = pairwise_ratio_distance(y1[exp_index], np.take_along_axis(y2, cal_index, axis=1))
+    similarity = np.minimum(temp, len(peaks) * 3)
+    similarity[~is_peak.any(axis=1)] = -1
+    peaks_index = [[exp_index[n].tolist(), new_cal_index[n].tolist()] for n in range(k)]
+    return similarity, peaks_index
+
+
+def cal_peak_similarity(x: np.ndarray, y1: np.ndarray, y2: np.ndarray, sim_wavelength: np.ndarray,
+                        characteristic_peaks: List[float]) -> Tuple[np.ndarray, List[Optional[List[List[int]]]]]:
+    """
+    计算多条模拟光谱与同一条实验光谱的相似度
+
+    Args:
+        x: 公共波长 (m,)
+        y1: 归一化后的实验光谱 (m,)
+        y2: 归一化后的模拟光谱 (k, m)
+        sim_wavelength: 模拟光谱原始的波长
+        characteristic_peaks: 特征峰波长，个数小于 2 时使用自动峰值匹配法
+
+    Returns:
+        每条模拟光谱的相似度与峰的索引
+    """
+    if len(characteristic_peaks) < 2:
+        return similarity_by_auto_peaks(x, y1, y2, sim_wavelength)
+    else:
+        return similarity_by_characteristic_peaks(x, y1, y2, sim_wavelength, characteristic_peaks)
+
+
+def cosine_similarity(y1: np.ndarray, y2: np.ndarray) -> np.ndarray:
+    """
+    余弦相似度，越接近 1 越相似
+
+    Args:
+        y1: 实验光谱 (m,)
+        y2: 模拟光谱 (k, m)
+
+    Returns:
+        (k,)
+    """
+    norm = np.linalg.norm(y2, axis=1) * np.linalg.norm(y1)
+    dot = y2 @ y1
+    return np.divide(dot, norm, out=np.zeros_like(dot), where=norm != 0.0)
+
+
+def chi2_distance(y1: np.ndarray, y2: np.ndarray) -> np.ndarray:
+    """
+    归一化卡方（两条光谱均按最大值归一化后，逐点残差平方的平均值），越接近 0 越相似
+
+    展开为 (|y1|^2 - 2 y2·y1 + |y2|^2) / m，只需要一次矩阵乘法
+
+    Args:
+        y1: 实验光谱 (m,)
+        y2: 模拟光谱 (k, m)
+
+    Returns:
+        (k,)
+    """
+    chi2 = (y1 @ y1 - 2 * (y2 @ y1) + np.einsum('ij,ij->i', y2, y2)) / len(y1)
+    return np.maximum(chi2, 0.0)
+
+
+def pearson_correlation(y1: np.ndarray, y2: np.ndarray) -> np.ndarray:
+    """
+    皮尔逊相关系数，越接近 1 越相似
+
+    Args:
+        y1: 实验光谱 (m,)
+        y2: 模拟光谱 (k, m)
+
+    Returns:
+        (k,)
+    """
+    return cosine_similarity(y1 - y1.mean(), y2 - y2.mean(axis=1, keepdims=True))
+
+
+def cal_matrix_similarity(method: str, y1: np.ndarray, y2: np.ndarray) -> np.ndarray:
+    """
+    使用矩阵形式的指标一次计算多条模拟光谱与实验光谱的相似度
+
+    Args:
+        method: 'cosine'、'chi2' 或 'pearson'
+        y1: 归一化后的实验光谱 (m,)
+        y2: 归一化后的模拟光谱 (k, m)，与实验光谱共享波长
+
+    Returns:
+        (k,)
+    """
+    if method == 'cosine':
+        return cosine_similarity(y1, y2)
+    elif method == 'chi2':
+        return chi2_distance(y1, y2)
+    elif method == 'pearson':
+        return pearson_correlation(y1, y2)
+    else:
+        raise ValueError(f'similarity method {method} is not supported')
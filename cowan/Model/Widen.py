@@ -1,5 +1,5 @@
 import copy
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 
 import numpy as np
 import pandas as pd
@@ -9,7 +9,8 @@ from plotly.offline import plot
 from ..Tools import console_logger
 
 from .GlobalVar import PROJECT_PATH
-from .ExpData import ExpData
+from .ExpData import ExpData, get_range_slice, RANGE_CACHE_SIZE
+from .ContributionCache import get_grid_key
 
 
 class WidenAll:
@@ -19,12 +20,14 @@ class WidenAll:
 
         Args:
             name: CalData的名称
-            init_data: 计算的原始数据
+            init_data: 计算的原始数据，复制后按 wavelength_ev 升序排列
             exp_data: 实验数据
             n: 展宽时的点的个数，如果为None，则使用实验数据的波长
         """
         self.name = name
-        self.init_data = init_data.copy()
+        self.init_data = sort_by_wavelength_ev(init_data.copy())
+        # 各个能量范围在 init_data 中对应的切片，{(下限, 上限): 切片}
+        self.range_slices: Dict[Tuple[float, float], slice] = {}
         self.exp_data = exp_data
         self.n = n
         self.threading = False
@@ -37,6 +40,8 @@ class WidenAll:
         self.plot_path_cross_P = (PROJECT_PATH() / f'figure/cross_P/{self.name}.html').as_posix()
 
         self.widen_data: pd.DataFrame | None = None
+        # 计算 widen_data 时的展宽参数与是否只计算了 cross_P，参数改变后 widen_data 过期，第一次访问时重新展宽
+        self.widen_state: Optional[tuple] = None
 
     def set_threading(self, threading: bool):
         self.threading = threading
@@ -50,31 +55,97 @@ class WidenAll:
     def set_delta_lambda(self, delta_lambda: float):
         self.delta_lambda = delta_lambda
 
+    def get_widen_state(self) -> tuple:
+        """
+        获取当前的展宽参数
+
+        Returns:
+            (温度, 半高宽, 波长偏移, 波长网格)
+        """
+        return float(self.temperature), float(self.fwhm_value), float(self.delta_lambda), get_grid_key(self)
+
+    def is_dirty(self) -> bool:
+        """
+        展宽结果是否过期（没有计算过，或者计算之后参数、波长范围发生了改变）
+
+        Returns:
+            过期时返回 True
+        """
+        if self.widen_data is None or self.widen_state is None:
+            return True
+        state, only_p = self.widen_state
+        return state != self.get_widen_state() or (only_p and not self.threading)
+
+    def mark_dirty(self):
+        """
+        将展宽结果标记为过期
+
+        """
+        self.widen_state = None
+
     def widen(self):
         """
-        展宽
+        使用当前的温度展宽，结果存储在 self.widen_data 中
+
+        """
+        state = self.get_widen_state()
+        self.set_widen_data(self.cal_widen_data(), state, self.threading)
+
+    def ensure_widen(self):
+        """
+        如果展宽结果过期，就重新展宽
+
+        """
+        if self.is_dirty():
+            self.widen()
+
+    def set_widen_data(self, widen_data: pd.DataFrame, state: Optional[tuple] = None, only_p: Optional[bool] = None):
+        """
+        设置展宽结果
+
+        Args:
+            widen_data: 见 cal_widen_data
+            state: 计算时的展宽参数，为 None 时使用当前的参数
+            only_p: 是否只计算了 cross_P，为 None 时根据列名判断
+
+        """
+        if only_p is None:
+            only_p = 'gauss' not in widen_data.columns
+        self.widen_data = widen_data
+        self.widen_state = (self.get_widen_state() if state is None else state, only_p)
+
+    def cal_widen_data(self, temperature: Optional[float] = None, only_p: Optional[bool] = None) -> pd.DataFrame:
+        """
+        展宽，不修改对象本身，因此可以在多个模拟光谱对象之间只读共享
 
         列标题依次为：energy_l, energy_h, wavelength_ev, intensity, index_l, index_h, J_l, J_h
         分别代表：下态能量，上态能量，波长，强度，下态序号，上态序号，下态J值，上态J值
 
         Args:
+            temperature: 等离子体温度，为 None 时使用 self.temperature
+            only_p: 是否只计算 cross_P，为 None 时使用 self.threading
+
         Returns:
             返回一个DataFrame，包含了展宽后的数据
             列标题为：wavelength, gaussian, cross-NP, cross-P
             如果only_p为True，则没有cross-NP列和gaussian列
         """
+        if temperature is None:
+            temperature = self.temperature
+        if only_p is None:
+            only_p = self.threading
         # 日志
         temp_text = '{} >> T:{:.3f}eV d_lambda:{:.3f}nm fwhm:{:.3f}eV range:[{:.3f},{:.3f}]'.format(
-            self.name, self.temperature, self.delta_lambda, self.fwhm_value,
+            self.name, temperature, self.delta_lambda, self.fwhm_value,
             self.exp_data.x_range[0], self.exp_data.x_range[1])
         console_logger.info(f'WidenOverall started {temp_text}')
 
-        # 获取数据
-        data = self.init_data.copy()
+        # 获取数据（只读）
+        data = self.init_data
         fwhmgauss = self.fwhmgauss
         lambda_range = self.exp_data.x_range
 
-        new_data = data.copy()
+        new_data = data
         # 找到下态最小能量和最小能量对应的J值
         min_energy = new_data['energy_l'].min()
         min_J = new_data[new_data['energy_l'] == min_energy]['J_l'].min()
@@ -83,10 +154,7 @@ class WidenAll:
         max_wavelength_nm = lambda_range[1]
         min_wavelength_ev = 1239.85 / max_wavelength_nm
         max_wavelength_ev = 1239.85 / min_wavelength_nm
-        new_data = new_data[
-            (new_data['wavelength_ev'] > min_wavelength_ev)
-            & (new_data['wavelength_ev'] < max_wavelength_ev)
-            ]
+        new_data = new_data.iloc[self.get_energy_slice(min_wavelength_ev, max_wavelength_ev)]
         if self.n is None:
             wave = 1239.85 / np.array(self.exp_data.data['wavelength'].values)
             console_logger.debug('use exp wavelength')
@@ -100,7 +168,6 @@ class WidenAll:
             result['gauss'] = 0
             result['cross_NP'] = 0
             result['cross_P'] = 0
-            self.widen_data = result
             console_logger.info('WidenOverall completed! return None')
             return result
         new_data = new_data.reindex()
@@ -121,17 +188,35 @@ class WidenAll:
         new_J = temp_1.combine_first(temp_2)
         new_J = new_J.values
         # 计算布居
-        population = ((2 * new_J + 1) * np.exp(-abs(new_energy - min_energy) * 0.124 / self.temperature) / (
+        population = ((2 * new_J + 1) * np.exp(-abs(new_energy - min_energy) * 0.124 / temperature) / (
                 2 * min_J + 1))
-        res = [self.__complex_cal(val, new_intensity, fwhmgauss(val), new_wavelength, population, new_J) for val in
-               wave]
+        res = [self.__complex_cal(val, new_intensity, fwhmgauss(val), new_wavelength, population, new_J, only_p)
+               for val in wave]
         res = list(zip(*res))
-        if not self.threading:
+        if not only_p:
             result['gauss'] = res[0]
             result['cross_NP'] = res[1]
         result['cross_P'] = res[2]
-        self.widen_data = result
         console_logger.info('WidenOverall completed')
+        return result
+
+    def get_energy_slice(self, min_wavelength_ev: float, max_wavelength_ev: float) -> slice:
+        """
+        获取能量范围（开区间）在 init_data 中对应的切片，按范围缓存
+
+        Args:
+            min_wavelength_ev: 下限，单位为 eV
+            max_wavelength_ev: 上限，单位为 eV
+
+        Returns:
+            切片
+        """
+        key = (float(min_wavelength_ev), float(max_wavelength_ev))
+        if key not in self.range_slices:
+            if len(self.range_slices) >= RANGE_CACHE_SIZE:
+                self.range_slices.clear()
+            self.range_slices[key] = get_range_slice(self.init_data['wavelength_ev'].values, key[0], key[1])
+        return self.range_slices[key]
 
     def __complex_cal(
             self,
@@ -141,6 +226,7 @@ class WidenAll:
             new_wavelength: np.array,
             population: np.array,
             new_j: np.array,
+            only_p: bool,
     ):
         """
         展宽时的复杂计算
@@ -150,6 +236,7 @@ class WidenAll:
             fwhmgauss:
             new_wavelength:
             population:
+            only_p: 是否只计算 cross_P
 
         Returns:
             展宽后的数据，为一个元组，依次为：gauss, cross_NP, cross_P
@@ -157,7 +244,7 @@ class WidenAll:
         """
         uu = ((new_intensity * population / (2 * new_j + 1)) * 2 * fwhmgauss / (
                 2 * np.pi * ((new_wavelength - wave) ** 2 + np.power(2 * fwhmgauss, 2) / 4)))
-        if self.threading:
+        if only_p:
             return -1, -1, uu.sum()
         else:
             tt = (new_intensity / np.sqrt(2 * np.pi) / fwhmgauss * 2.355 * np.exp(
@@ -171,6 +258,7 @@ class WidenAll:
         绘制展宽后的谱线
 
         """
+        self.ensure_widen()
         if not self.threading:
             self.__plot_html(self.widen_data, self.plot_path_gauss, 'wavelength', 'gauss')
             self.__plot_html(self.widen_data, self.plot_path_cross_NP, 'wavelength', 'cross_NP')
@@ -213,11 +301,13 @@ class WidenAll:
         Returns:
 
         """
+        self.ensure_widen()
         return self.widen_data.__deepcopy__()
 
     def load_class(self, class_info):
         self.name = class_info.name
         self.init_data = class_info.init_data
+        self.range_slices = {}
         self.exp_data.load_class(class_info.exp_data)
         self.n = class_info.n
         # start [1.0.2 > 1.0.3]
@@ -238,6 +328,7 @@ class WidenAll:
         self.plot_path_cross_NP = (PROJECT_PATH() / f'figure/cross_NP/{self.name}.html').as_posix()
         self.plot_path_cross_P = (PROJECT_PATH() / f'figure/cross_P/{self.name}.html').as_posix()
         self.widen_data = class_info.widen_data
+        self.widen_state = class_info.widen_state
 
 
 class WidenPart:
@@ -251,7 +342,9 @@ class WidenPart:
             n: 展宽时的点的个数，如果为None，则使用实验数据的波长
         """
         self.name = name
-        self.init_data = init_data.copy()
+        self.init_data = sort_by_wavelength_ev(init_data.copy())
+        # 各组的各个能量范围对应的切片，{(组名, 下限, 上限): 切片}
+        self.range_slices: Dict[Tuple[str, float, float], slice] = {}
         self.exp_data = exp_data
         self.n = n
         self.delta_lambda: float = 0.0
@@ -262,6 +355,8 @@ class WidenPart:
 
         self.grouped_data: Optional[Dict[str, pd.DataFrame]] = None
         self.grouped_widen_data: Optional[Dict[str, pd.DataFrame]] = None
+        # 计算 grouped_widen_data 时的展宽参数，参数改变后 grouped_widen_data 过期，第一次访问时重新展宽
+        self.widen_state: Optional[tuple] = None
 
         self.grouping_data()  # 给 self.grouped_data 赋值
 
@@ -274,6 +369,7 @@ class WidenPart:
             temp_group = pd.DataFrame(data_grouped.get_group(index))
             temp_grouped_data[f'{index[0]}_{index[1]}'] = temp_group
         self.grouped_data = temp_grouped_data
+        self.range_slices = {}
 
     def set_fwhm(self, fwhm: float):
         self.fwhm_value = fwhm
@@ -291,18 +387,83 @@ class WidenPart:
     def set_delta_lambda(self, delta_lambda: float):
         self.delta_lambda = delta_lambda
 
+    def get_widen_state(self) -> tuple:
+        """
+        获取当前的展宽参数
+
+        Returns:
+            (温度, 半高宽, 波长偏移, 波长网格)
+        """
+        return float(self.temperature), float(self.fwhm_value), float(self.delta_lambda), get_grid_key(self)
+
+    def is_dirty(self) -> bool:
+        """
+        展宽结果是否过期（没有计算过，或者计算之后参数、波长范围发生了改变）
+
+        Returns:
+            过期时返回 True
+        """
+        return (self.grouped_widen_data is None or self.widen_state is None
+                or self.widen_state != self.get_widen_state())
+
+    def mark_dirty(self):
+        """
+        将展宽结果标记为过期
+
+        """
+        self.widen_state = None
+
     def widen_by_group(self):
         """
-        按组态进行展宽
+        使用当前的温度按组态进行展宽，结果存储在 self.grouped_widen_data 中
+
+        """
+        state = self.get_widen_state()
+        self.set_grouped_widen_data(self.cal_grouped_widen_data(), state)
+
+    def ensure_widen(self):
+        """
+        如果展宽结果过期，就重新展宽
+
+        """
+        if self.is_dirty():
+            self.widen_by_group()
+
+    def set_grouped_widen_data(self, grouped_widen_data: Dict[str, pd.DataFrame], state: Optional[tuple] = None):
+        """
+        设置按组态展宽的结果，并更新对应的图片路径
+
+        Args:
+            grouped_widen_data: 见 cal_grouped_widen_data
+            state: 计算时的展宽参数，为 None 时使用当前的参数
+
+        """
+        # 画图
+        self.plot_path_list = {}
+        for key, value in grouped_widen_data.items():
+            self.plot_path_list[key] = (
+                    PROJECT_PATH() / f'figure/part/{self.name}_{key}.html'
+            ).as_posix()
+        self.grouped_widen_data = grouped_widen_data
+        self.widen_state = self.get_widen_state() if state is None else state
+
+    def cal_grouped_widen_data(self, temperature: Optional[float] = None) -> Dict[str, pd.DataFrame]:
+        """
+        按组态进行展宽，不修改对象本身，因此可以在多个模拟光谱对象之间只读共享
+
+        Args:
+            temperature: 等离子体温度，为 None 时使用 self.temperature
 
         Returns:
             返回一个字典，包含了按跃迁正例分组后的展宽数据，例如
             {'1-2': pd.DataFrame, '1-3': pd.DataFrame, ...}
             pd.DataFrame的列标题为：wavelength, gaussian, cross-NP, cross-P
         """
+        if temperature is None:
+            temperature = self.temperature
         # 日志
         temp_text = '{} >> T:{:.3f}eV d_lambda:{:.3f}nm fwhm:{:.3f}eV range:[{:.3f},{:.3f}]'.format(
-            self.name, self.temperature, self.delta_lambda, self.fwhm_value,
+            self.name, temperature, self.delta_lambda, self.fwhm_value,
             self.exp_data.x_range[0], self.exp_data.x_range[1])
         console_logger.info(f'WidenByConfiguration started {temp_text}')
 
@@ -310,27 +471,21 @@ class WidenPart:
         temp_data = {}
         for key, value in self.grouped_data.items():
             console_logger.info(f'widen {key} ...')
-            temp_group = value.__deepcopy__()
-            temp_result = self.__widen(self.temperature, temp_group)
+            temp_result = self.__widen(temperature, key, value)
             console_logger.info(f'competed!')
             # 如果这个波段没有跃迁正例
             temp_data[key] = temp_result
-        # 画图
-        self.plot_path_list = {}
-        for key, value in temp_data.items():
-            self.plot_path_list[key] = (
-                    PROJECT_PATH() / f'figure/part/{self.name}_{key}.html'
-            ).as_posix()
-        self.grouped_widen_data = temp_data
         console_logger.info('WidenByConfiguration completed!')
+        return temp_data
 
-    def __widen(self, temperature: float, temp_data: pd.DataFrame):
+    def __widen(self, temperature: float, key: str, temp_data: pd.DataFrame):
         """
         展宽
 
         Args:
             temperature (float): 等离子体温度
-            temp_data: 展宽的原始数据
+            key: 组名
+            temp_data: 展宽的原始数据（只读），按 wavelength_ev 升序排列
                 列标题依次为：energy_l, energy_h, wavelength_ev, intensity, index_l, index_h, J_l, J_h
                 分别代表：下态能量，上态能量，波长，强度，下态序号，上态序号，下态J值，上态J值
         Returns:
@@ -338,7 +493,7 @@ class WidenPart:
             列标题为：wavelength, gaussian, cross-NP, cross-P
             如果only_p为True，则没有cross-NP列和gaussian列
         """
-        new_data = temp_data.copy()
+        new_data = temp_data
         fwhmgauss = self.fwhmgauss
         lambda_range = self.exp_data.x_range
 
@@ -350,10 +505,7 @@ class WidenPart:
         max_wavelength_nm = lambda_range[1]
         min_wavelength_ev = 1239.85 / max_wavelength_nm
         max_wavelength_ev = 1239.85 / min_wavelength_nm
-        new_data = new_data[
-            (new_data['wavelength_ev'] > min_wavelength_ev)
-            & (new_data['wavelength_ev'] < max_wavelength_ev)
-            ]
+        new_data = new_data.iloc[self.get_energy_slice(key, temp_data, min_wavelength_ev, max_wavelength_ev)]
         if new_data.empty:
             result = pd.DataFrame()
             result['wavelength'] = self.exp_data.data['wavelength'].values
@@ -431,11 +583,34 @@ class WidenPart:
                 2 * np.pi * ((new_wavelength - wave) ** 2 + np.power(2 * fwhmgauss, 2) / 4)))
         return tt.sum(), ss.sum(), uu.sum()
 
+    def get_energy_slice(self, key: str, temp_data: pd.DataFrame, min_wavelength_ev: float,
+                        max_wavelength_ev: float) -> slice:
+        """
+        获取能量范围（开区间）在一组数据中对应的切片，按组和范围缓存
+
+        Args:
+            key: 组名
+            temp_data: 该组的数据
+            min_wavelength_ev: 下限，单位为 eV
+            max_wavelength_ev: 上限，单位为 eV
+
+        Returns:
+            切片
+        """
+        cache_key = (key, float(min_wavelength_ev), float(max_wavelength_ev))
+        if cache_key not in self.range_slices:
+            if len(self.range_slices) >= RANGE_CACHE_SIZE * len(self.grouped_data):
+                self.range_slices.clear()
+            self.range_slices[cache_key] = get_range_slice(
+                temp_data['wavelength_ev'].values, cache_key[1], cache_key[2])
+        return self.range_slices[cache_key]
+
     def plot_widen_by_group(self):
         """
         绘制按组态展宽后的谱线
 
         """
+        self.ensure_widen()
         for key, value in self.grouped_widen_data.items():
             self.__plot_html(value, self.plot_path_list[key], 'wavelength', 'cross_P')
 
@@ -476,6 +651,7 @@ class WidenPart:
         列名 wavelength gauss cross_NP cross_P
         Returns:
         """
+        self.ensure_widen()
         return copy.deepcopy(self.grouped_widen_data)
 
     def get_grouped_data(self) -> Dict[str, pd.DataFrame]:
@@ -486,6 +662,7 @@ class WidenPart:
         index_h = []
         con_value_1 = []
         # con_value_2 = []
+        self.ensure_widen()
         for key, value in self.grouped_widen_data.items():
             key: str
             value: pd.DataFrame
@@ -511,6 +688,7 @@ class WidenPart:
     def load_class(self, class_info):
         self.name = class_info.name
         self.init_data = class_info.init_data
+        self.range_slices = {}
         self.exp_data.load_class(class_info.exp_data)
         self.n = class_info.n
         self.delta_lambda = class_info.delta_lambda
@@ -521,11 +699,11 @@ class WidenPart:
         else:
             self.temperature = 25.6
         # end [无版本号 > 1.0.0]
-        self.plot_path_list = {}
-        for key in class_info.plot_path_list.keys():
-            self.plot_path_list[key] = (
-                    PROJECT_PATH() / f'figure/part/{self.name}_{key}.html'
-            ).as_posix()
+        # class_info 可能就是 self，先生成新的字典再替换
+        self.plot_path_list = {
+            key: (PROJECT_PATH() / f'figure/part/{self.name}_{key}.html').as_posix()
+            for key in class_info.plot_path_list.keys()
+        }
         # start [1.0.2 > 1.0.3]
         if 'grouped_data' in class_info.__dict__.keys():
             self.grouped_data = class_info.grouped_data
@@ -534,3 +712,20 @@ class WidenPart:
             self.grouping_data()
         # end [1.0.2 > 1.0.3]
         self.grouped_widen_data = class_info.grouped_widen_data
+        self.widen_state = class_info.widen_state
+
+
+def sort_by_wavelength_ev(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    将跃迁数据按 wavelength_ev 升序排列（行号重新编号），已经有序时直接返回，
+    之后按能量范围筛选时可以用二分查找得到切片，不必每次生成布尔掩码并复制数据
+
+    Args:
+        data: 列标题包含 wavelength_ev 的跃迁数据
+
+    Returns:
+        排序后的数据
+    """
+    if data['wavelength_ev'].is_monotonic_increasing and data.index.is_monotonic_increasing:
+        return data
+    return data.sort_values(by='wavelength_ev', kind='stable', ignore_index=True)
@@ -0,0 +1,250 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .ContributionCache import get_grid_key
+from .CowanList import CowanList
+from .Cowan_ import Cowan
+from .SimulateSpectral import SimulateSpectral
+from .SpaceTimeResolution import SpaceTimeResolution
+from .Widen import WidenAll, WidenPart
+from .. import console_logger
+
+
+def get_data_fingerprint(init_data: pd.DataFrame) -> str:
+    """
+    计算谱线数据的指纹，同一个离子的多个副本（例如页面上的 cowan 与历史记录中的 cowan）指纹相同
+
+    Args:
+        init_data: 展宽对象的原始数据
+
+    Returns:
+        指纹字符串
+    """
+    hash_values = pd.util.hash_pandas_object(init_data, index=True).values
+    return hashlib.blake2b(hash_values.tobytes(), digest_size=16).hexdigest()
+
+
+def run_widen_task(widen, kind: str, temperature: float, only_p: bool):
+    """
+    执行一个展宽任务，可以在子进程中运行
+
+    Args:
+        widen: 展宽对象
+        kind: 'all' 表示整体展宽，'part' 表示按组态展宽
+        temperature: 等离子体温度
+        only_p: 是否只计算 cross_P（只对整体展宽有效）
+
+    Returns:
+        整体展宽时为 DataFrame，按组态展宽时为 {'con_key': DataFrame}
+    """
+    if kind == 'all':
+        return widen.cal_widen_data(temperature, only_p=only_p)
+    return widen.cal_grouped_widen_data(temperature)
+
+
+class XRangeUpdater:
+    def __init__(self, cowan: Optional[Cowan], cowan_lists: Optional[CowanList],
+                 simulate: Optional[SimulateSpectral], space_time_resolution: Optional[SpaceTimeResolution],
+                 use_multiprocess=True, lazy=True):
+        """
+        波长范围改变后，统一更新所有依赖波长范围的对象
+
+        页面上的 cowan、历史记录中的 cowan、模拟光谱、时空分辨光谱各自都需要展宽，
+        其中有大量重复（例如页面上的 cowan 通常就是历史记录中的某一个，同一温度的多个模拟光谱展宽相同的离子），
+        因此先收集所有的展宽任务，按 (离子, 温度, 半高宽, 波长偏移, 波长网格) 去重，
+        每个唯一的任务只计算一次（可以并行），再把结果分发给所有需要它的对象
+
+        Args:
+            cowan: 第一页上的 cowan 对象
+            cowan_lists: cowan 对象列表
+            simulate: 第二页的模拟光谱
+            space_time_resolution: 时空分辨光谱
+            use_multiprocess: 是否使用多进程展宽
+            lazy: 为 True 时 cowan 对象自身的展宽结果只标记为过期，第一次访问时再计算（见 CalData.is_dirty）；
+                为 False 时与模拟光谱的展宽一起立即计算
+        """
+        self.cowan_lists = cowan_lists
+        self.space_time_resolution = space_time_resolution
+        self.use_multiprocess = use_multiprocess
+        self.lazy = lazy
+
+        # 需要设置范围的 cowan 对象（按对象去重）
+        self.cowans: List[Cowan] = []
+        # 历史记录中已经溢出到磁盘的 cowan 不读回，读回时再设置范围（见 CowanHistory）
+        history = [obj for _, obj in cowan_lists.cowan_run_history.resident_items()] if cowan_lists is not None else []
+        for obj in [cowan] + history:
+            if obj is not None and obj.cal_data is not None and all(obj is not c for c in self.cowans):
+                self.cowans.append(obj)
+        # 需要重新模拟的光谱，以及模拟后是否释放 cowan 列表（时空分辨光谱的条目不保存 cowan 列表）
+        self.sims: List[tuple] = []
+        if simulate is not None:
+            self.sims.append((simulate, False))
+        if space_time_resolution is not None:
+            self.sims.extend((sim, True) for _, sim in space_time_resolution)
+
+        self.tasks: Dict[tuple, list] = {}  # key -> [widen, kind, temperature, only_p]
+        self.results: Dict[tuple, object] = {}  # key -> 展宽结果
+        self.cowan_plan: List[tuple] = []  # [(cowan, key_all, key_part), ...]
+        self.sim_plan: List[tuple] = []  # [(sim, del_cowan_list, [key_all, ...]), ...]
+        self.requests = 0  # 去重前的展宽任务个数
+        self.__fingerprints: Dict[int, str] = {}
+
+    def apply_xrange(self, x_range: Optional[List[float]] = None, num: Optional[int] = None):
+        """
+        设置（或重置）所有对象的波长范围，不展宽
+
+        Args:
+            x_range: 波长范围，为 None 时重置
+            num: 展宽时的点的个数
+
+        """
+        for cowan in self.cowans:
+            if x_range is None:
+                cowan.reset_xrange()
+            else:
+                cowan.set_xrange(x_range, num)
+        if self.cowan_lists is not None:
+            self.cowan_lists.cowan_run_history.set_xrange_state(x_range, num)
+        for sim, _ in self.sims:
+            if x_range is None:
+                sim.exp_data.reset_xrange()
+            else:
+                sim.exp_data.set_xrange(x_range)
+
+    def get_task_key(self, widen: WidenAll | WidenPart, kind: str, temperature: float) -> tuple:
+        """
+        生成展宽任务的键
+
+        Args:
+            widen: 展宽对象
+            kind: 'all' 或 'part'
+            temperature: 等离子体温度
+
+        Returns:
+            (种类, 离子名称, 数据指纹, 温度, 半高宽, 波长偏移, 波长网格)
+        """
+        if id(widen.init_data) not in self.__fingerprints:
+            self.__fingerprints[id(widen.init_data)] = get_data_fingerprint(widen.init_data)
+        return (kind, widen.name, self.__fingerprints[id(widen.init_data)], float(temperature),
+                float(widen.fwhm_value), float(widen.delta_lambda), get_grid_key(widen))
+
+    def add_task(self, widen: WidenAll | WidenPart, kind: str, temperature: float, only_p=False) -> tuple:
+        """
+        添加一个展宽任务，相同的任务只保留一个；
+        整体展宽时只要有一个需求需要完整的结果，就计算完整的结果（其中包含 cross_P）
+
+        Args:
+            widen: 展宽对象
+            kind: 'all' 或 'part'
+            temperature: 等离子体温度
+            only_p: 是否只需要 cross_P
+
+        Returns:
+            任务的键
+        """
+        self.requests += 1
+        key = self.get_task_key(widen, kind, temperature)
+        if key in self.tasks:
+            self.tasks[key][3] = self.tasks[key][3] and only_p
+        else:
+            self.tasks[key] = [widen, kind, float(temperature), only_p]
+        return key
+
+    def plan(self) -> int:
+        """
+        收集所有对象的展宽任务并去重，需要在 apply_xrange 之后调用
+
+        Returns:
+            唯一的展宽任务个数
+        """
+        for cowan in ([] if self.lazy else self.cowans):
+            widen_all, widen_part = cowan.cal_data.widen_all, cowan.cal_data.widen_part
+            self.cowan_plan.append((
+                cowan,
+                self.add_task(widen_all, 'all', widen_all.temperature, widen_all.threading),
+                self.add_task(widen_part, 'part', widen_part.temperature),
+            ))
+        for sim, del_cowan_list in self.sims:
+            if not sim.init_cowan_list(self.cowan_lists):
+                console_logger.error(f'{sim.temperature} {sim.electron_density} do not set element ratio')
+                continue
+            if sim.temperature is None or sim.electron_density is None:
+                if del_cowan_list:
+                    sim.del_cowan_list()
+                continue
+            keys = [self.add_task(cowan.cal_data.widen_all, 'all', sim.temperature, True)
+                    for cowan in sim.cowan_list]
+            self.sim_plan.append((sim, del_cowan_list, keys))
+        console_logger.info(f'x range update: {self.requests} widen requests, {len(self.tasks)} unique tasks')
+        return len(self.tasks)
+
+    def run(self, progress: Optional[Callable[[int, int, str], None]] = None):
+        """
+        计算所有唯一的展宽任务，需要在 plan 之后调用
+
+        Args:
+            progress: 每完成一个任务调用一次 progress(已完成个数, 总个数, 说明)
+
+        """
+        start = time.perf_counter()
+        total = len(self.tasks)
+
+        def add_result(key, result):
+            self.results[key] = result
+            if progress is not None:
+                progress(len(self.results), total, f'widen {key[1]} ({key[0]}) T={key[3]:.3f}')
+
+        if self.use_multiprocess and total > 1:
+            console_logger.info('use multiprocess to widen.')
+            with ProcessPoolExecutor(max(os.cpu_count() - 1, 1)) as pool:
+                futures = {pool.submit(run_widen_task, *task): key for key, task in self.tasks.items()}
+                for future in as_completed(futures):
+                    add_result(futures[future], future.result())
+        else:
+            console_logger.info('use single process to widen.')
+            for key, task in self.tasks.items():
+                add_result(key, run_widen_task(*task))
+        console_logger.info('x range update: {} unique tasks widened in {:.3f}s'.format(
+            total, time.perf_counter() - start))
+
+    def distribute(self):
+        """
+        将展宽结果分发给所有需要它的对象，并重新模拟光谱，需要在 run 之后调用；
+        相同的结果在多个对象之间只读共享
+
+        """
+        for cowan, key_all, key_part in self.cowan_plan:
+            cowan.cal_data.widen_all.set_widen_data(self.results[key_all], only_p=self.tasks[key_all][3])
+            cowan.cal_data.widen_part.set_grouped_widen_data(self.results[key_part])
+        for sim, del_cowan_list, keys in self.sim_plan:
+            wavelength = self.results[keys[0]]['wavelength'].values if keys else np.array([])
+            intensity = np.array([self.results[key]['cross_P'].values for key in keys])
+            sim.cal_ion_contribution((wavelength, intensity))
+            sim.cal_simulate_data()
+            if del_cowan_list:
+                sim.del_cowan_list()
+        # 重新模拟后相似度改变
+        if self.space_time_resolution is not None:
+            self.space_time_resolution.update_values()
+
+    def update(self, x_range: Optional[List[float]] = None, num: Optional[int] = None,
+               progress: Optional[Callable[[int, int, str], None]] = None):
+        """
+        依次执行 apply_xrange、plan、run、distribute
+
+        Args:
+            x_range: 波长范围，为 None 时重置
+            num: 展宽时的点的个数
+            progress: 见 run
+
+        """
+        self.apply_xrange(x_range, num)
+        self.plan()
+        self.run(progress)
+        self.distribute()
@@ -12,12 +12,26 @@ from .AtomInfo import (
 
 from .Atom import Atom
 from .InputFile import In36, In2
-from .ExpData import ExpData
-from .Cowan_ import Cowan, CowanThread
+from .ExpData import ExpData, load_exp_files
+from .ExpLoader import EXP_READERS, EXP_FILE_FILTER, clear_exp_cache
+from .Cowan_ import Cowan, CowanThread, WidenPrefetchThread
 from .CalData import CalData
 from .Widen import WidenAll, WidenPart
+from .CowanHistory import CowanHistory, DEFAULT_MAX_RESIDENT
 from .CowanList import CowanList
-from .SimulateSpectral import SimulateSpectral
+from .SpectrumSimilarity import SIMILARITY_METHODS
+from .Abundance import AbundanceEngine, ABUNDANCE_ENGINE
+from .ContributionCache import ContributionCache, CONTRIBUTION_CACHE
+from .SimulateSpectral import SimulateSpectral, SimulateResult, IonContribution
 from .SimulateGrid import SimulateGrid, SimulateGridThread
 from .SpaceTimeResolution import SpaceTimeResolution
+from .Diagnosis import DiagnosisResult, BatchDiagnosisThread
+from .SpaceTimeUpdate import SpaceTimeUpdateThread
+from .XRangeUpdate import XRangeUpdater
+from .Compression import CODECS, DEFAULT_CODEC, CompressionStats, RESULT_CACHE_STATS
+from .ProjectStore import ProjectStore, LazyRecord, UNCHANGED, SCHEMA_MIGRATIONS, \
+    get_migration_steps, migrate_record
+from .MemoryReport import MEMORY_BUDGETS, MemoryReport, check_memory_budgets, get_nbytes
+from .Autosave import AUTOSAVE_INTERVAL, AutosaveThread, Snapshot, take_snapshot, load_snapshots, \
+    get_autosave_path, has_recovery, discard_autosave
 from .GlobalVar import PROJECT_PATH, SET_PROJECT_PATH
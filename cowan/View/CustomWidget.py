@@ -1,13 +1,14 @@
-from PySide6.QtWidgets import QWidget, QProgressBar, QLabel, QVBoxLayout, QMessageBox, QFileDialog
-from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QWidget, QProgressBar, QLabel, QVBoxLayout, QMessageBox, QFileDialog, QPushButton
+from PySide6.QtCore import Qt, Signal
 
 
 class CustomProgressDialog(QWidget):
     """
     自定义进度条对话框
     """
+    canceled = Signal()  # 点击取消按钮时发送
 
-    def __init__(self, dialog_title, range_=(0, 0)):
+    def __init__(self, dialog_title, range_=(0, 0), cancelable=False):
         super().__init__()
         self.setWindowModality(Qt.WindowModal)
         self.resize(500, 75)
@@ -26,6 +27,10 @@ class CustomProgressDialog(QWidget):
         layout = QVBoxLayout()
         layout.addWidget(self.label)
         layout.addWidget(self.progress_bar)
+        if cancelable:
+            self.cancel_button = QPushButton('取消')
+            self.cancel_button.clicked.connect(self.cancel)
+            layout.addWidget(self.cancel_button)
         self.setLayout(layout)
 
         self.prompt_words = 'xxx'
@@ -45,3 +50,8 @@ class CustomProgressDialog(QWidget):
 
     def set_prompt_words(self, words):
         self.prompt_words = words
+
+    def cancel(self):
+        self.cancel_button.setEnabled(False)
+        self.set_label_text('正在取消，请稍后……')
+        self.canceled.emit()
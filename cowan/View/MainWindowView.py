@@ -130,6 +130,12 @@ class Ui_main_window(object):
         self.exit_project.setObjectName(u"exit_project")
         self.reset_cal = QAction(main_window)
         self.reset_cal.setObjectName(u"reset_cal")
+        self.memory_report = QAction(main_window)
+        self.memory_report.setObjectName(u"memory_report")
+        self.autosave_setting = QAction(main_window)
+        self.autosave_setting.setObjectName(u"autosave_setting")
+        self.clear_exp_cache = QAction(main_window)
+        self.clear_exp_cache.setObjectName(u"clear_exp_cache")
         self.export_data = QAction(main_window)
         self.export_data.setObjectName(u"export_data")
         self.set_xrange = QAction(main_window)
@@ -1884,12 +1890,21 @@ class Ui_main_window(object):
 
         self.horizontalLayout_34.addWidget(self.use_multiprocess)
 
+        self.similarity_method = QComboBox(self.groupBox_2)
+        self.similarity_method.addItem("")
+        self.similarity_method.addItem("")
+        self.similarity_method.addItem("")
+        self.similarity_method.addItem("")
+        self.similarity_method.setObjectName(u"similarity_method")
+
+        self.horizontalLayout_34.addWidget(self.similarity_method)
+
         self.page2_cal_grid = QPushButton(self.groupBox_2)
         self.page2_cal_grid.setObjectName(u"page2_cal_grid")
 
         self.horizontalLayout_34.addWidget(self.page2_cal_grid)
 
-        self.horizontalLayout_34.setStretch(1, 1)
+        self.horizontalLayout_34.setStretch(2, 1)
 
         self.verticalLayout_9.addLayout(self.horizontalLayout_34)
 
@@ -2292,6 +2307,9 @@ class Ui_main_window(object):
         self.menu_2.addAction(self.reset_xrange)
         self.menu_3.addAction(self.show_guides)
         self.menu_3.addAction(self.reset_cal)
+        self.menu_3.addAction(self.memory_report)
+        self.menu_3.addAction(self.autosave_setting)
+        self.menu_3.addAction(self.clear_exp_cache)
         self.menu_4.addAction(self.export_configuration_average_wavelength)
         self.menu_4.addAction(self.export_data_window)
         self.menu_5.addAction(self.debug_1)
@@ -2318,6 +2336,9 @@ class Ui_main_window(object):
         self.save_project.setText(QCoreApplication.translate("main_window", u"\u4fdd\u5b58\u9879\u76ee", None))
         self.exit_project.setText(QCoreApplication.translate("main_window", u"\u9000\u51fa", None))
         self.reset_cal.setText(QCoreApplication.translate("main_window", u"\u91cd\u7f6e\u8ba1\u7b97\u6309\u94ae", None))
+        self.memory_report.setText(QCoreApplication.translate("main_window", u"\u5185\u5b58\u7edf\u8ba1", None))
+        self.autosave_setting.setText(QCoreApplication.translate("main_window", u"\u81ea\u52a8\u4fdd\u5b58\u8bbe\u7f6e", None))
+        self.clear_exp_cache.setText(QCoreApplication.translate("main_window", u"\u6e05\u9664\u5b9e\u9a8c\u6570\u636e\u7f13\u5b58", None))
         self.export_data.setText(QCoreApplication.translate("main_window", u"\u5bfc\u51fa\u6570\u636e", None))
         self.set_xrange.setText(QCoreApplication.translate("main_window", u"\u8bbe\u7f6e\u6ce2\u957f\u8303\u56f4", None))
         self.reset_xrange.setText(QCoreApplication.translate("main_window", u"\u91cd\u7f6e\u6ce2\u957f\u8303\u56f4", None))
@@ -2559,6 +2580,10 @@ class Ui_main_window(object):
         self.label_17.setText(QCoreApplication.translate("main_window", u"\u5bc6\u5ea6\u8303\u56f4", None))
         self.density_num.setSuffix(QCoreApplication.translate("main_window", u"\u4e2a", None))
         self.use_multiprocess.setText("")
+        self.similarity_method.setItemText(0, QCoreApplication.translate("main_window", u"\u5cf0\u503c\u5339\u914d", None))
+        self.similarity_method.setItemText(1, QCoreApplication.translate("main_window", u"\u4f59\u5f26\u76f8\u4f3c\u5ea6", None))
+        self.similarity_method.setItemText(2, QCoreApplication.translate("main_window", u"\u5f52\u4e00\u5316\u5361\u65b9", None))
+        self.similarity_method.setItemText(3, QCoreApplication.translate("main_window", u"\u76ae\u5c14\u900a\u76f8\u5173\u7cfb\u6570", None))
         self.page2_cal_grid.setText(QCoreApplication.translate("main_window", u"\u5f00\u59cb\u8ba1\u7b97", None))
         self.groupBox.setTitle(QCoreApplication.translate("main_window", u"\u65f6\u7a7a\u5206\u8fa8", None))
         self.label_15.setText(QCoreApplication.translate("main_window", u"\u5b9e\u9a8c\u6570\u636e", None))
@@ -9,9 +9,8 @@ import traceback
 from pathlib import Path
 from typing import Optional
 
-from pympler import asizeof
 from packaging.version import Version
-from PySide6.QtCore import Qt, QUrl
+from PySide6.QtCore import Qt, QUrl, QTimer
 from PySide6.QtWidgets import QAbstractItemView, QWidget, QMessageBox, QFileDialog, QMainWindow, QHeaderView, \
     QApplication
 
@@ -217,13 +216,57 @@ class LoginWindow(QWidget):
 
 
 class MainWindow(QMainWindow):
+    # 项目中需要保存的对象（属性名），info 单独保存
+    PROJECT_RECORDS = [
+        'atom', 'in36', 'in2', 'expdata_1', 'cowan_lists', 'cowan',  # 第一页
+        'expdata_2', 'simulate', 'simulated_grid', 'space_time_resolution',  # 第二页
+        'simulate_page4',  # 第四页
+        'cowan_page5',  # 第五页
+    ]
+    # 项目文件的压缩算法与压缩等级（见 Compression.CODECS），算法为 None 时不压缩，等级为 None 时使用默认等级
+    STORE_CODEC = DEFAULT_CODEC
+    STORE_LEVEL = None
+    # 检查内存上限的时间间隔（秒）
+    MEMORY_CHECK_INTERVAL = 60
+    # 打开项目时不立即读取的对象，第一次使用时再读取（见 LazyRecord）
+    expdata_2 = LazyRecord()
+    simulate = LazyRecord()
+    simulated_grid = LazyRecord()
+    space_time_resolution = LazyRecord()
+    simulate_page4 = LazyRecord()
+    cowan_page5 = LazyRecord()
+
     def __init__(self, project_path, load=True):
         super().__init__()
         self.ui = Ui_main_window()
         self.ui.setupUi(self)
         # 设置全局变量
         SET_PROJECT_PATH(project_path)
+        # 上次运行时溢出到磁盘的运行历史（见 CowanHistory）已经没有用了
+        shutil.rmtree(PROJECT_PATH().joinpath('.cowan/history'), ignore_errors=True)
         self.task_thread = None
+        self.prefetch_thread = None  # 后台展宽线程
+        # 其他会修改项目中的对象的后台线程，运行期间跳过自动保存与内存检查（见 is_busy）
+        self.cowan_thread = None  # 计算 Cowan
+        self.grid_thread = None  # 计算、更新网格
+        self.diagnosis_thread = None  # 批量诊断
+        self.space_time_thread = None  # 重新模拟时空分辨光谱
+        # 项目存储，以及还没有读取的对象（见 LazyRecord）
+        self.project_store: Optional[ProjectStore] = None
+        self.pending_records = set()
+        self.project_version: Optional[str] = None  # 打开的项目保存时的版本，读取记录时据此升级（见 SCHEMA_MIGRATIONS）
+        # 还没有刷新的页面，{页面序号: [刷新函数, ...]}，第一次切换到该页面时刷新
+        self.pending_pages = {}
+        # 自动保存（见 autosave）
+        self.autosave_store: Optional[ProjectStore] = None
+        self.autosave_thread: Optional[AutosaveThread] = None
+        self.saved_signatures = {}  # 上次保存项目时各个对象的快照签名，自动保存时不再写入没有改变的对象
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self.autosave)
+        # 定时检查内存上限（见 check_memory_budgets）
+        self.memory_timer = QTimer(self)
+        self.memory_timer.setInterval(self.MEMORY_CHECK_INTERVAL * 1000)
+        self.memory_timer.timeout.connect(self.check_memory)
 
         # 设置参考线
         self.v_line = None
@@ -249,7 +292,8 @@ class MainWindow(QMainWindow):
 
         self.info = {
             'x_range': None,  # example: [2, 8, 0.01] [<最小波长>, <最大波长>, <最小步长>]
-            'version': '1.0.5',  # example: '1.0.0'
+            'version': '1.0.6',  # example: '1.0.0'
+            'autosave_interval': AUTOSAVE_INTERVAL,  # 自动保存的时间间隔（秒），为 0 时关闭
         }
 
         print('当前软件版本：{}'.format(self.info['version']))
@@ -260,6 +304,8 @@ class MainWindow(QMainWindow):
 
         if load:
             self.load_project()
+        self.start_autosave_timer()
+        self.memory_timer.start()
 
     def init(self):
         # 设置窗口标题
@@ -298,6 +344,7 @@ class MainWindow(QMainWindow):
     def bind_slot(self):
         # 设置左侧列表与右侧页面切换之间的关联
         self.ui.navigation.currentRowChanged.connect(self.ui.stackedWidget.setCurrentIndex)
+        self.ui.stackedWidget.currentChanged.connect(self.page_changed)
 
         # ------------------------------- 菜单栏 -------------------------------
         #  导出组态平均波长
@@ -311,6 +358,12 @@ class MainWindow(QMainWindow):
         self.ui.reset_cal.triggered.connect(lambda: self.ui.page2_cal_grid.setDisabled(False))
         # 退出项目
         self.ui.exit_project.triggered.connect(self.print_memory)
+        # 内存统计
+        self.ui.memory_report.triggered.connect(functools.partial(Menu.show_memory_report, self))
+        # 自动保存设置
+        self.ui.autosave_setting.triggered.connect(functools.partial(Menu.set_autosave_interval, self))
+        # 清除实验数据缓存
+        self.ui.clear_exp_cache.triggered.connect(functools.partial(Menu.clear_exp_cache_files, self))
         # 设置x轴范围
         self.ui.set_xrange.triggered.connect(functools.partial(Menu.set_xrange, self))
         # 重置范围
@@ -409,6 +462,10 @@ class MainWindow(QMainWindow):
         self.ui.show_abu.clicked.connect(functools.partial(SpectralSimulation.show_abu, self))
         # Cowan对象更新
         self.ui.page2_cowan_obj_update.clicked.connect(functools.partial(SpectralSimulation.cowan_obj_update, self))
+        # =====>> 下拉框
+        # 切换网格相似度的计算方法
+        self.ui.similarity_method.currentIndexChanged.connect(
+            functools.partial(SpectralSimulation.similarity_method_changed, self))
         # =====>> 复选框
         # 切换特征峰位置是否显示
         self.ui.show_peaks.toggled.connect(functools.partial(SpectralSimulation.plot_spectrum, self))
@@ -456,115 +513,235 @@ class MainWindow(QMainWindow):
 
     def save_project(self):
         def task():
-            obj_info = shelve.open(PROJECT_PATH().joinpath('.cowan/obj_info').as_posix(), flag='n')
-            # 第一页
-            self.task_thread.progress.emit(5, 'atom')
-            obj_info['atom'] = self.atom
-            self.task_thread.progress.emit(10, 'in36')
-            obj_info['in36'] = self.in36
-            self.task_thread.progress.emit(15, 'in2')
-            obj_info['in2'] = self.in2
-            self.task_thread.progress.emit(20, 'expdata_1')
-            obj_info['expdata_1'] = self.expdata_1
-            self.task_thread.progress.emit(30, 'cowan_lists')
-            obj_info['cowan_lists'] = self.cowan_lists
-            self.task_thread.progress.emit(35, 'cowan')
-            obj_info['cowan'] = self.cowan
-            self.task_thread.progress.emit(35, 'cowan')
-
-            # 第二页
-            self.task_thread.progress.emit(45, 'expdata_2')
-            obj_info['expdata_2'] = self.expdata_2
-            self.task_thread.progress.emit(50, 'simulate')
-            obj_info['simulate'] = self.simulate
-            self.task_thread.progress.emit(80, 'simulated_grid')
-            obj_info['simulated_grid'] = self.simulated_grid
-            self.task_thread.progress.emit(90, 'space_time_resolution')
-            obj_info['space_time_resolution'] = self.space_time_resolution
-
-            # 第四页
-            self.task_thread.progress.emit(95, 'simulate_page4')
-            obj_info['simulate_page4'] = self.simulate_page4
-
-            # 第五页
-            self.task_thread.progress.emit(95, 'cowan_page5')
-            obj_info['cowan_page5'] = self.cowan_page5
-
-            # 总共
-            obj_info['info'] = self.info
+            store.save(load_snapshots(records), info, progress=lambda name: self.task_thread.progress.emit(
+                int(self.PROJECT_RECORDS.index(name) / len(self.PROJECT_RECORDS) * 100), name))
+            self.saved_signatures = signatures
+            # 已经正常保存，不再需要自动保存的数据
+            discard_autosave(PROJECT_PATH())
             # -----------------------------------------------------------
             self.task_thread.progress.emit(100, 'All saved!')
             self.ui.statusbar.showMessage('保存成功！')
 
+        # 等待正在进行的自动保存结束
+        if self.autosave_thread is not None:
+            self.autosave_thread.wait()
+        self.autosave_store = None
+        if self.project_store is None:
+            self.project_store = ProjectStore(PROJECT_PATH().joinpath('.cowan/store'), codec=self.STORE_CODEC,
+                                              level=self.STORE_LEVEL)
+        store = self.project_store
+        # 在主线程中生成快照，保存过程中界面上的修改不会进入本次保存；还没有读取的对象没有改变，沿用原来的文件
+        records = self.take_records_snapshot(UNCHANGED)
+        signatures = {name: value.get_signature() for name, value in records.items() if isinstance(value, Snapshot)}
+        info = dict(self.info)
+
         self.task_thread = ProgressThread(dialog_title='正在保存项目，请稍后...', range_=(0, 100))
         self.task_thread.set_run(task)
         self.task_thread.progress_dialog.set_prompt_words('正在保存xxx变量...')
         self.task_thread.start()
 
+    def take_records_snapshot(self, pending=None) -> dict:
+        """
+        在主线程中生成所有对象的快照（见 take_snapshot）
+
+        Args:
+            pending: 还没有读取的对象的取值，为 None 时不包含这些对象
+
+        Returns:
+            {对象名称: 快照}
+        """
+        # 此时没有正在进行的保存（见 save_project、autosave），之前的快照不再使用溢出文件，可以删除读回后不再使用的文件
+        if 'cowan_lists' not in self.pending_records:
+            self.cowan_lists.cowan_run_history.collect_spill_files()
+        records = {}
+        for name in self.PROJECT_RECORDS:
+            if name in self.pending_records:
+                if pending is not None:
+                    records[name] = pending
+            else:
+                records[name] = take_snapshot(getattr(self, name))
+        return records
+
+    def get_loaded_records(self) -> dict:
+        """
+        获取已经读取的对象，不会触发读取（见 LazyRecord）
+
+        Returns:
+            {对象名称: 对象}
+        """
+        return {name: getattr(self, name) for name in self.PROJECT_RECORDS if name not in self.pending_records}
+
+    def is_busy(self) -> bool:
+        """
+        是否有后台线程正在运行，这些线程可能正在修改项目中的对象或使用缓存
+
+        对话框（包括模态的进度对话框）不会暂停定时器，因此定时任务需要自己检查
+
+        Returns:
+            有线程正在运行时返回 True
+        """
+        for thread in [self.task_thread, self.prefetch_thread, self.cowan_thread, self.grid_thread,
+                       self.diagnosis_thread, self.space_time_thread]:
+            if thread is not None and thread.isRunning():
+                return True
+        return False
+
+    def check_memory(self):
+        """
+        检查内存上限，由定时器在主线程中调用；其他线程可能正在使用缓存时跳过
+
+        """
+        if self.is_busy():
+            return
+        check_memory_budgets(self.get_loaded_records())
+
+    def start_autosave_timer(self):
+        """
+        按项目设置的时间间隔（info['autosave_interval']）启动自动保存定时器，时间间隔为 0 时关闭自动保存
+
+        """
+        interval = self.info.get('autosave_interval', AUTOSAVE_INTERVAL)
+        if interval <= 0:
+            self.autosave_timer.stop()
+            console_logger.info('autosave disabled')
+            return
+        self.autosave_timer.setInterval(int(interval * 1000))
+        self.autosave_timer.start()
+
+    def autosave(self):
+        """
+        自动保存，由定时器在主线程中调用
+
+        主线程中只序列化对象结构（不复制数组，见 take_snapshot），生成对象和写入在 AutosaveThread 中进行；
+        保存到 .cowan/autosave，不影响项目本身，正常保存或正常退出后删除，程序异常退出后下次打开项目时可以恢复。
+        还没有读取的对象、以及与上次保存项目时相同的对象不保存，恢复时从项目中读取；
+        与上次自动保存时相同的对象不重新写入
+
+        """
+        if self.autosave_thread is not None and self.autosave_thread.isRunning():
+            return
+        # 其他任务（保存、设置范围、计算网格等）可能正在修改对象，跳过这一次
+        if self.is_busy():
+            return
+        # 上次自动保存成功时写入的对象（保存项目后自动保存的数据已经删除）
+        if self.autosave_store is not None and self.autosave_thread is not None and self.autosave_thread.error is None:
+            autosaved = self.autosave_thread.signatures
+        else:
+            autosaved = {}
+        if self.autosave_store is None:
+            self.autosave_store = ProjectStore(get_autosave_path(PROJECT_PATH()), codec=self.STORE_CODEC,
+                                               level=self.STORE_LEVEL)
+        self.autosave_thread = AutosaveThread(self.autosave_store, self.take_records_snapshot(), self.info,
+                                              self.saved_signatures, autosaved)
+        self.autosave_thread.start()
+
     def load_project(self):
         def load_info():
             info = obj_info['info']
             self.info['x_range'] = info['x_range']
             self.info['version'] = info['version']
+            # 旧版本的项目没有自动保存设置
+            self.info['autosave_interval'] = info.get('autosave_interval', AUTOSAVE_INTERVAL)
 
         # 函数定义结束 ------------------------------------------------------
 
-        if not PROJECT_PATH().joinpath('.cowan/obj_info.dat').exists():
+        # 程序上次没有正常退出时，可以从自动保存中恢复
+        store = ProjectStore(PROJECT_PATH().joinpath('.cowan/store'), codec=self.STORE_CODEC, level=self.STORE_LEVEL)
+        recovering = has_recovery(PROJECT_PATH()) and QMessageBox.question(
+            self, '恢复项目', '程序上次没有正常退出，是否恢复自动保存的数据？') == QMessageBox.StandardButton.Yes
+        if not recovering:
+            discard_autosave(PROJECT_PATH())
+
+        # 读取初始化文件，旧版本的项目使用 shelve 保存，下次保存时转换为新的格式
+        if recovering:
+            obj_info = ProjectStore(get_autosave_path(PROJECT_PATH()), fallback=store if store.exists() else None)
+            console_logger.info('recover project from autosave')
+        elif store.exists():
+            obj_info = store
+        elif PROJECT_PATH().joinpath('.cowan/obj_info.dat').exists():
+            obj_info = shelve.open(PROJECT_PATH().joinpath('.cowan/obj_info').as_posix())
+        else:
             return
-        # 读取初始化文件
-        obj_info = shelve.open(PROJECT_PATH().joinpath('.cowan/obj_info').as_posix())
+        # 无版本号的项目视为 0.0.0
+        self.project_version = obj_info['info'].get('version', '0.0.0')
         self.update_version(obj_info)
         # ---------------------------------------------------------
         # 总共
         self.info = obj_info['info']
-        # 第一页
-        self.atom = obj_info['atom']
-        self.in36 = obj_info['in36']
-        self.in2 = obj_info['in2']
-        self.expdata_1 = obj_info['expdata_1']
-        self.cowan = obj_info['cowan']
-        self.cowan_lists = obj_info['cowan_lists']
-        # 第二页
-        self.expdata_2 = obj_info['expdata_2']
-        self.simulate = obj_info['simulate']
-        self.simulated_grid = obj_info['simulated_grid']
-        self.space_time_resolution = obj_info['space_time_resolution']
-        # 第四页
-        self.simulate_page4 = obj_info['simulate_page4']
-        # 第五页
-        self.cowan_page5 = obj_info['cowan_page5']
-
-        # ---------------------------------------------------------
-        obj_list = [
-            (self.atom, 'atom'), (self.in36, 'in36'), (self.in2, 'in2'), (self.expdata_1, 'expdata_1'),
-            (self.cowan, 'cowan'), (self.cowan_lists, 'cowan_lists'), (self.expdata_2, 'expdata_2'),
-            (self.simulate, 'simulate'), (self.simulated_grid, 'simulated_grid'),
-            (self.space_time_resolution, 'space_time_resolution'), (self.simulate_page4, 'simulate_page4')
-        ]
         load_info()
-        for obj, name in obj_list:
-            if obj is not None:
-                obj.load_class(obj_info[name])
+        # 第一页的对象立即读取；新格式的项目中，其余页面的对象在第一次使用时读取
+        # 从自动保存中恢复、或者需要升级时全部立即读取（保存时没有读取的对象沿用原来的文件，不会被升级）
+        lazy = isinstance(obj_info, ProjectStore) and not recovering and not get_migration_steps(self.project_version)
+        for name in self.PROJECT_RECORDS:
+            if lazy and isinstance(getattr(type(self), name, None), LazyRecord):
+                self.pending_records.add(name)
+            else:
+                self.load_record(obj_info, name)
         # ---------------------------------------------------------
-        obj_info.close()
+        if lazy:
+            self.project_store = obj_info
+        else:
+            obj_info.close()
+        if recovering:
+            self.ui.statusbar.showMessage('已恢复自动保存的数据，请及时保存项目！')
 
         # 更新界面
         # 第一页 =================================================
         functools.partial(UpdateLineIdentification.update_page, self)()
+        # 其余页面在第一次切换到该页面时更新
+        self.pending_pages = {
+            # 第二页 =================================================
+            1: [functools.partial(UpdateSpectralSimulation.update_page, self)],
+            # 第三页 =================================================
+            2: [functools.partial(UpdateEvolutionaryProcess.update_space_time_combobox, self)],
+            # 第四页 =================================================
+            3: [functools.partial(UpdateConfigurationContribution.update_space_time_combobox, self)],
+        }
 
-        # 第二页 =================================================
-        functools.partial(UpdateSpectralSimulation.update_page, self)()
+    def load_record(self, obj_info, name):
+        """
+        从项目中读取一个对象
 
-        # 第三页 =================================================
-        functools.partial(UpdateEvolutionaryProcess.update_space_time_combobox, self)()
+        Args:
+            obj_info: 项目存储（ProjectStore 或旧版本的 shelve）
+            name: 对象名称
 
-        # 第四页 =================================================
-        functools.partial(UpdateConfigurationContribution.update_space_time_combobox, self)()
+        """
+        # 每次取值都会重新反序列化，只读取一次；先升级到当前版本，再用读出的对象本身补全旧版本缺少的属性
+        obj = migrate_record(obj_info[name], self.project_version)
+        # cowan_page5 不需要 load_class
+        if obj is not None and name != 'cowan_page5':
+            obj.load_class(obj)
+        setattr(self, name, obj)
+
+    def load_pending_record(self, name):
+        """
+        读取一个还没有读取的对象，由 LazyRecord 在第一次访问时调用
 
-    @staticmethod
-    def print_memory():
-        print('{:>22} {:>15.2f} [GB]'.format('总大小：',
-                                             asizeof.asizeof(window) / 1024 ** 3))
+        Args:
+            name: 对象名称
+
+        """
+        self.pending_records.discard(name)
+        self.load_record(self.project_store, name)
+        console_logger.info(f'{name} loaded on demand')
+        if not self.pending_records:
+            # 全部读取完成，释放缓存的数组
+            self.project_store.close()
+
+    def page_changed(self, index):
+        """
+        切换页面时，如果该页面还没有刷新，就刷新一次
+
+        Args:
+            index: 页面序号
+
+        """
+        for update in self.pending_pages.pop(index, []):
+            update()
+
+    def print_memory(self):
+        print(MemoryReport(self.get_loaded_records()).format())
 
     @staticmethod
     def update_version(obj_info):
@@ -659,10 +836,35 @@ class MainWindow(QMainWindow):
             # 更新 >>>>>>>>>>>>>>>>>>
             obj_info.update({'info': project_info})
             print('版本升级完成！')
+        # 1.0.5 > 1.0.6 ---------------------------------------------------
+        if Version(obj_info['info']['version']) < Version('1.0.6'):
+            print('正在进行版本升级 [1.0.5 > 1.0.6]')
+            project_info = obj_info['info']
+            # 1. 添加版本号
+            project_info['version'] = '1.0.6'
+            print('版本号更新完成')
+            # 2. 给 SimulateGrid 对象添加 similarity_method 属性
+            print('给 SimulateGrid 对象添加 similarity_method 属性')
+            # 3. SimulateGrid 的网格点由 SimulateSpectral 对象改为只读的 SimulateResult
+            print('SimulateGrid 的网格点改为只读的计算结果')
+            # 4. SimulateSpectral 的离子贡献改为 IonContribution 对象
+            print('SimulateSpectral 的离子贡献改为按行存储的数组')
+            # 5. 以上对象的转换在读取各个记录时进行（见 SCHEMA_MIGRATIONS）
+            # 6. 项目改为使用 .cowan/store 保存，下次保存时自动转换
+            print('项目改为使用 .cowan/store 保存（对象结构与数值数组分开存储）')
+            # 更新 >>>>>>>>>>>>>>>>>>
+            obj_info.update({'info': project_info})
+            print('版本升级完成！')
 
     def closeEvent(self, event):
         # dialog = self.save_project()
         # dialog.exec()
+        # 正常退出，不再需要自动保存的数据
+        self.autosave_timer.stop()
+        for thread in [self.task_thread, self.autosave_thread]:
+            if thread is not None:
+                thread.wait()
+        discard_autosave(PROJECT_PATH())
         sys.exit()
 
 